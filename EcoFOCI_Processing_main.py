@@ -34,6 +34,10 @@ get_btl.report('/Users/bell/ecoraid/2020/CTDcasts/dy2012/rawconverted/','/Users/
  ---------
  CTD2NC.py
  
+ Processing runs on a background thread (ProcessingWorker / FunctionWorker) so the
+ window stays responsive; each cast is listed as it finishes and a batch can be
+ cancelled between casts.
+ 
 
  Original code reference:
  ------------------------
@@ -44,11 +48,11 @@ get_btl.report('/Users/bell/ecoraid/2020/CTDcasts/dy2012/rawconverted/','/Users/
 """
 # System Packages
 import datetime, os, sys
-import socket
+import socket, traceback
 
 
 # GUI Packages
-from PyQt4 import QtGui 
+from PyQt4 import QtCore, QtGui 
 
 import gui_ui.ecofoci_processing_design as design 
 			  # This file holds our MainWindow and all design related things
@@ -59,9 +63,86 @@ __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2014, 01, 29)
 __modified__ = datetime.datetime(2014, 10, 13)
-__version__  = "0.2.0"
+__version__  = "0.3.0"
 __status__   = "Development"
 
+"""------------------------------- Background Workers ---------------------------------"""
+
+class ProcessingWorker(QtCore.QThread):
+    """
+    Run a CTD2NC batch (CTD2NC.batch_conversions) off the GUI thread.
+
+    Signals
+    -------
+    castFinished(filein, ok, message) -- after every cast, message is the output
+                                         file or the error traceback
+    progress(done, total)
+    batchFinished(ok, cancelled)      -- ok is True if every converted cast succeeded
+    """
+    castFinished = QtCore.pyqtSignal(str, bool, str)
+    progress = QtCore.pyqtSignal(int, int)
+    batchFinished = QtCore.pyqtSignal(bool, bool)
+
+    def __init__(self, user_in, user_out, IPHC=False, parent=None, **options):
+        super(ProcessingWorker, self).__init__(parent)
+        self.user_in = user_in
+        self.user_out = user_out
+        self.IPHC = IPHC
+        self.options = options
+        self._cancel = False
+
+    def cancel(self):
+        """stop after the cast(s) currently being converted"""
+        self._cancel = True
+
+    def run(self):
+        import OnCruiseRoutines.CTD2NC as CTD2NC
+
+        converter = CTD2NC.convert_IPHC_cast if self.IPHC else CTD2NC.convert_cast
+        ok = True
+        try:
+            total = len(CTD2NC.cast_files(self.user_in))
+            self.progress.emit(0, total)
+            batch = CTD2NC.batch_conversions(self.user_in, self.user_out,
+                                             converter=converter, **self.options)
+            for done, (filein, savefile, error) in enumerate(batch, 1):
+                ok = ok and error is None
+                self.castFinished.emit(filein, error is None,
+                                       savefile if error is None else error)
+                self.progress.emit(done, total)
+                if self._cancel:
+                    # closing the generator drops casts still queued in the pool
+                    batch.close()
+                    break
+        except Exception:
+            ok = False
+            self.castFinished.emit(self.user_in, False, traceback.format_exc())
+        self.batchFinished.emit(ok, self._cancel)
+
+
+class FunctionWorker(QtCore.QThread):
+    """
+    Run func(*args) off the GUI thread, emitting finished(result is True, message)
+    where message is empty or the error traceback.
+    """
+    functionFinished = QtCore.pyqtSignal(bool, str)
+
+    def __init__(self, func, *args, **kwargs):
+        super(FunctionWorker, self).__init__(kwargs.pop('parent', None))
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            result = self.func(*self.args, **self.kwargs)
+            self.functionFinished.emit(result == True, '')
+        except Exception:
+            self.functionFinished.emit(False, traceback.format_exc())
+
+
+"""------------------------------- Main Window ----------------------------------------"""
+
 class ExampleApp(QtGui.QMainWindow, design.Ui_MainWindow):
     def __init__(self):
         # Explaining super is out of the scope of this article
@@ -77,6 +158,67 @@ class ExampleApp(QtGui.QMainWindow, design.Ui_MainWindow):
         self.btlSummaryButton.clicked.connect(self.BtlSummary)
         self.exitButton.clicked.connect(self.exit_main)
 
+        self.worker = None
+        self.status_panel()
+
+    def status_panel(self):
+        """
+        Progress bar, cancel button and the list of finished casts, in a dock below
+        the designer layout (kept out of the generated design file)
+        """
+        panel = QtGui.QWidget(self)
+        layout = QtGui.QVBoxLayout(panel)
+        row = QtGui.QHBoxLayout()
+        self.progressBar = QtGui.QProgressBar(panel)
+        self.progressBar.setValue(0)
+        self.cancelButton = QtGui.QPushButton("Cancel", panel)
+        self.cancelButton.setEnabled(False)
+        self.cancelButton.clicked.connect(self.cancel_processing)
+        row.addWidget(self.progressBar)
+        row.addWidget(self.cancelButton)
+        layout.addLayout(row)
+        self.statusList = QtGui.QListWidget(panel)
+        self.statusList.itemDoubleClicked.connect(self.show_status)
+        layout.addWidget(self.statusList)
+
+        dock = QtGui.QDockWidget("Processing Status", self)
+        dock.setFeatures(QtGui.QDockWidget.NoDockWidgetFeatures)
+        dock.setWidget(panel)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock)
+
+    def set_busy(self, busy):
+        for button in (self.inputButton, self.processButton, self.btlSummaryButton):
+            button.setEnabled(not busy)
+        self.cancelButton.setEnabled(busy)
+
+    def start_worker(self, worker):
+        self.statusList.clear()
+        self.progressBar.setValue(0)
+        self.set_busy(True)
+        self.worker = worker
+        self.worker.start()
+
+    def cast_finished(self, filein, ok, message):
+        item = QtGui.QListWidgetItem(("done:   " if ok else "FAILED: ") + os.path.basename(str(filein)))
+        item.setToolTip(message)
+        item.setForeground(QtGui.QBrush(QtGui.QColor("darkgreen" if ok else "red")))
+        self.statusList.addItem(item)
+        self.statusList.scrollToBottom()
+
+    def show_status(self, item):
+        """double click a cast for its output file / error"""
+        QtGui.QMessageBox.information(self, str(item.text()), item.toolTip())
+
+    def update_progress(self, done, total):
+        self.progressBar.setMaximum(max(total, 1))
+        self.progressBar.setValue(done)
+
+    def cancel_processing(self):
+        if self.worker is not None and hasattr(self.worker, 'cancel'):
+            self.worker.cancel()
+            self.cancelButton.setEnabled(False)
+            self.statusList.addItem("cancelling after the current cast...")
+
     def input_files(self):
         directory = QtGui.QFileDialog.getExistingDirectory(self,
                                                            "Pick a folder")
@@ -94,22 +236,21 @@ class ExampleApp(QtGui.QMainWindow, design.Ui_MainWindow):
 
            
     def Process_Files(self):
-        ''' run data processing routine in file CTD2nc.py'''
-        # User Packages
-        import OnCruiseRoutines.CTD2NC as CTD2NC
-        from OnCruiseRoutines.CTD_Vis import ctd
-        from OnCruiseRoutines.CTD_Vis import ncprocessing
-        if self.IPHCcheckBox.isChecked():
-            rflag = CTD2NC.IPHC_data_processing(os.path.join(self.directory, str(self.inputList.currentItem().text()) + '/'),
-                                        os.path.join(self.directory, str(self.outputList.currentItem().text()) + '/'),
-                                        pressure_varname=str(self.presscomboBox.currentText()))
-        else: #get header info for IPHC style files
-            rflag = CTD2NC.data_processing(os.path.join(self.directory, str(self.inputList.currentItem().text()) + '/'),
-                                        os.path.join(self.directory, str(self.outputList.currentItem().text()) + '/'),
-                                        pressure_varname=str(self.presscomboBox.currentText()))
-
-
-        if rflag == True:
+        ''' run data processing routine in file CTD2nc.py on a background thread'''
+        worker = ProcessingWorker(os.path.join(self.directory, str(self.inputList.currentItem().text()) + '/'),
+                                  os.path.join(self.directory, str(self.outputList.currentItem().text()) + '/'),
+                                  IPHC=self.IPHCcheckBox.isChecked(),
+                                  pressure_varname=str(self.presscomboBox.currentText()))
+        worker.castFinished.connect(self.cast_finished)
+        worker.progress.connect(self.update_progress)
+        worker.batchFinished.connect(self.processing_finished)
+        self.start_worker(worker)
+
+    def processing_finished(self, ok, cancelled):
+        self.set_busy(False)
+        if cancelled:
+            self.statusList.addItem("cancelled")
+        elif ok:
             self.processButton.setStyleSheet("background-color: green")
 
     def AddCruiseMetaData(self):
@@ -125,10 +266,30 @@ class ExampleApp(QtGui.QMainWindow, design.Ui_MainWindow):
     def BtlSummary(self):
         import OnCruiseRoutines.utilities.get_btl as get_btl
         
-        rflag = get_btl.report(os.path.join(self.directory, str(self.inputList.currentItem().text()) + '/'),
-                                        os.path.join(self.directory, str(self.outputList.currentItem().text()) + '/'))
-        if rflag == True:
+        worker = FunctionWorker(get_btl.report,
+                                os.path.join(self.directory, str(self.inputList.currentItem().text()) + '/'),
+                                os.path.join(self.directory, str(self.outputList.currentItem().text()) + '/'))
+        worker.functionFinished.connect(self.btl_finished)
+        self.progressBar.setMaximum(0) # busy indicator, report has no per file progress
+        self.start_worker(worker)
+        self.cancelButton.setEnabled(False)
+
+    def btl_finished(self, ok, message):
+        self.set_busy(False)
+        self.progressBar.setMaximum(1)
+        self.progressBar.setValue(1)
+        if ok:
             self.btlSummaryButton.setStyleSheet("background-color: green")
+        else:
+            self.cast_finished("bottle summary", False, message)
+
+    def closeEvent(self, event):
+        # don't leave a conversion running without a window
+        if self.worker is not None and self.worker.isRunning():
+            if hasattr(self.worker, 'cancel'):
+                self.worker.cancel()
+            self.worker.wait()
+        event.accept()
 
     def exit_main(self):
         self.close()
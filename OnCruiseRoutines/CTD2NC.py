@@ -16,6 +16,13 @@
  ------
  from CTD_Vis import ctd
  cast = ctd.from_cnv(filein)
+
+ python CTD2NC.py /path/to/cnv/ /path/to/output/ --workers 8
+ python CTD2NC.py /path/to/cnv/ /path/to/output/ --incremental
+ python CTD2NC.py /path/to/cnv/ /path/to/output/ --format NETCDF4
+ python CTD2NC.py /path/to/cnv/ /path/to/output/ --cruise_file /path/to/dy1309_cruise.nc
+ python CTD2NC.py /path/to/cnv/ /path/to/output/ --cache_dir /path/to/cnv_cache/
+ python CTD2NC.py /path/to/cnv/ /path/to/output/ --trace trace.json --profile_dir /path/to/prof/
  
 
  Original code reference:
@@ -26,20 +33,27 @@
 
 """
 # System Packages
-import datetime, os
+import datetime, os, traceback
+import glob, hashlib, json
 
 
 # User Packages
 from CTD_Vis import ctd
 from CTD_Vis import ncprocessing
+from CTD_Vis import castcache
+from utilities import stagetimer
+from io_utils.disk_cache import atomic_path, atomic_write
 
 __author__ = "Shaun Bell"
 __email__ = "shaun.bell@noaa.gov"
 __created__ = datetime.datetime(2014, 01, 29)
 __modified__ = datetime.datetime(2014, 10, 13)
-__version__ = "0.2.0"
+__version__ = "0.3.0"
 __status__ = "Development"
 
+# any change here forces --incremental runs to re-convert every cast
+CONVERTER_VERSION = "-".join((__version__, ctd.__version__, ncprocessing.__version__))
+
 """-------------------------------Work Flow--------------------------------------------"""
 """
 read sbe *.cnv files (python-ctd: Pandas Data Frame Utility)
@@ -48,201 +62,638 @@ Initialize .nc file
 Write attributes, variables and variable attributes
 
 """
-"""------------------------------- Data Pointer----------------------------------------"""
 
 
-def data_processing(user_in, user_out, pressure_varname="prDM"):
+def cast_files(user_in):
     """
-        Change pressure_var to prDM for 
-        most 9/11 and prSM for sbe25 in following line or 
-        prdM for sbe19pV2
-
+    Expand user input into a sorted list of .cnv files.
 
+    user_in may be a directory (all .cnv files are used), a single file, or
+    'path, file1, file2'
     """
-    # add ability to ingest entire directory
     if os.path.isdir(user_in):
-        user_in = [user_in] + [fi for fi in os.listdir(user_in) if fi.endswith(".cnv")]
+        return [os.path.join(user_in, fi) for fi in sorted(os.listdir(user_in))
+                if fi.endswith(".cnv")]
 
-    else:
-        user_in = user_in.split(",")
-
-    for i, filein in enumerate(sorted(user_in)):
-        if i == 0 and len(user_in) > 1:
-            path = filein.strip()
-            continue
-        elif i == 0 and len(user_in) == 1:
-            path = filein.strip()
-        else:
-            filein = path + filein.strip()
+    user_in = [fi.strip() for fi in user_in.split(",")]
+    if len(user_in) == 1:
+        return user_in
 
-        # read in .cnv file generate pandas dataframe... includes some preprocessing
-        # Todo: incorporate PMEL header information from cast logs (either as a '@' comment in the cnv file or from a separate text file)
-        cast = ctd.from_cnv(filein, pressure_varname=pressure_varname)
+    return [os.path.join(user_in[0], fi) for fi in sorted(user_in[1:])]
 
+
+def convert_cast(filein, user_out, pressure_varname="prDM", nc_format="NETCDF3_CLASSIC",
+                 cache_dir=None, timer=None):
+    """
+        Convert one .cnv file to an EPIC NetCDF file in user_out
+
+        nc_format is one of ncprocessing.OUTPUT_PROFILES (NETCDF3_CLASSIC or NETCDF4)
+        cache_dir reuses parsed casts from a castcache directory
+        timer (stagetimer.StageTimer) records every stage of the conversion
+
+        Returns the name of the file written
+    """
+    if timer is None:
+        timer = stagetimer.StageTimer()
+    cast_id = os.path.basename(filein)
+
+    # read in .cnv file generate pandas dataframe... includes some preprocessing
+    # Todo: incorporate PMEL header information from cast logs (either as a '@' comment in the cnv file or from a separate text file)
+    with timer.stage("from_cnv", cast=cast_id) as record:
+        cache_info = {}
+        cast = castcache.from_cnv(filein, cache_dir=cache_dir, pressure_varname=pressure_varname,
+                                  info=cache_info)
+        # a cache hit memory maps the parsed cast, the .cnv is not read
+        record["bytes_read"] = 0 if cache_info["cache_hit"] else os.path.getsize(filein)
+        record["rows"] = len(cast)
+
+    with timer.stage("DataTimes", cast=cast_id):
         timeclass = ctd.DataTimes(time_str=cast.time_str)
-        sfc_extend = "Extrapolated to SFC from " + str(cast.SFC_EXTEND) + "m"
+        time1, time2 = timeclass.get_EPIC_date()
+    sfc_extend = "Extrapolated to SFC from " + str(cast.SFC_EXTEND) + "m"
 
-        # make sure save path exists
-        savefile = user_out
-        if not os.path.exists(savefile):
-            os.makedirs(savefile)
+    # make sure save path exists
+    savefile = user_out
+    if not os.path.exists(savefile):
+        os.makedirs(savefile)
 
-        print "Working on Cast {cast_file}".format(cast_file=filein)
+    print "Working on Cast {cast_file}".format(cast_file=filein)
 
-        # PMEL EPIC Conventions
-        ncinstance = ncprocessing.CTD_NC(
-            savefile=(savefile + cast.name.replace("_ctd", "c") + "_ctd.nc"), data=cast
-        )
-        ncinstance.file_create()
-        ncinstance.sbeglobal_atts()  #
-        ncinstance.PMELglobal_atts(sfc_extend=sfc_extend)
-        ncinstance.dimension_init()
-        ncinstance.variable_init()
-        ncinstance.add_data()
-        ncinstance.add_coord_data(
-            pressure_var=pressure_varname,
-            time1=timeclass.get_EPIC_date()[0],
-            time2=timeclass.get_EPIC_date()[1],
-        )
+    # PMEL EPIC Conventions
+    ncinstance = ncprocessing.CTD_NC(
+        savefile=(savefile + cast.name.replace("_ctd", "c") + "_ctd.nc"), data=cast,
+        nc_format=nc_format,
+    )
+    _run_stages(timer, cast_id, len(cast), ncinstance, [
+        ("file_create", ncinstance.file_create),
+        ("sbeglobal_atts", ncinstance.sbeglobal_atts),
+        ("PMELglobal_atts", lambda: ncinstance.PMELglobal_atts(sfc_extend=sfc_extend)),
+        ("dimension_init", ncinstance.dimension_init),
+        ("variable_init", ncinstance.variable_init),
+        ("add_data", ncinstance.add_data),
+        ("add_coord_data", lambda: ncinstance.add_coord_data(
+            pressure_var=pressure_varname, time1=time1, time2=time2)),
+    ])
+
+    # COARDS/CF Style Conventions
+    """
+    ncinstance = ncprocessing.CF_CTD_NC(savefile=(savefile + cast.name.replace('_ctd', 'c') + '_cf_ctd.nc'), data=cast)
+    ncinstance.file_create()
+    ncinstance.sbeglobal_atts()
+    ncinstance.PMELglobal_atts(sfc_extend=sfc_extend)
+    ncinstance.dimension_init()
+    ncinstance.variable_init()
+    ncinstance.add_data()
+    ncinstance.add_coord_data( time=timeclass.get_python_date() )
+    ncinstance.close()    
+    """
+    return ncinstance.savefile
+
+
+def convert_IPHC_cast(filein, user_out, pressure_varname="prdM", nc_format="NETCDF3_CLASSIC",
+                      cache_dir=None, timer=None):
+    """
+        Convert one IPHC .cnv file to an EPIC NetCDF file in user_out
+
+        nc_format is one of ncprocessing.OUTPUT_PROFILES (NETCDF3_CLASSIC or NETCDF4)
+        cache_dir reuses parsed casts from a castcache directory
+        timer (stagetimer.StageTimer) records every stage of the conversion
+
+        Returns the name of the file written
+    """
+    if timer is None:
+        timer = stagetimer.StageTimer()
+    cast_id = os.path.basename(filein)
+
+    # read in .cnv file generate pandas dataframe... includes some preprocessing
+    # Todo: incorporate PMEL header information from cast logs (either as a '@' comment in the cnv file or from a separate text file)
+    with timer.stage("from_cnv", cast=cast_id) as record:
+        cache_info = {}
+        cast = castcache.from_cnv(filein, cache_dir=cache_dir, pressure_varname=pressure_varname,
+                                  info=cache_info)
+        # a cache hit memory maps the parsed cast, the .cnv is not read
+        record["bytes_read"] = 0 if cache_info["cache_hit"] else os.path.getsize(filein)
+
+        # tried subroutine in ctd.py but dataframe reassignment was odd
+        cast.drop(cast.index[cast["flag"] == True], inplace=True)
+        record["rows"] = len(cast)
+
+    with timer.stage("DataTimes", cast=cast_id):
+        timeclass = ctd.DataTimes(time_str=cast.time_str)
+        time1, time2 = timeclass.get_EPIC_date()
+    sfc_extend = "Extrapolated to SFC from " + str(cast.SFC_EXTEND) + "m"
+
+    # parse header files for '** ' lines which have IPHC relevant meta in them
+
+    for entry in cast.header:
+        entry_lower = entry.lower()
+        """* <![CDATA[
+            ** latitude: 580104
+            ** longitude: 1491283
+            ** setno: 047
+            ** stnno: 4195
+            ** trpno: 04
+            ** vslcde: CLD
+            ** region: GP
+            ** CSF bottom depth(m): 150
+            * ]]>"""
+        if ("** latitude:" in entry_lower) or ("** Latitude:" in entry_lower):
+            IPHC_Lat = (
+                float(entry.split()[-1][:2]) + float(entry.split()[-1][2:]) / 6000.0
+            )
+        if ("** longitude:" in entry_lower) or ("** Longitude:" in entry_lower):
+            IPHC_Lon = -1 * (
+                float(entry.split()[-1][:3]) + float(entry.split()[-1][3:]) / 6000.0
+            )
+        if ("** setno:" in entry_lower) or ("** Setno:" in entry_lower):
+            setno = entry.split()[-1]
+
+        if ("** stnno:" in entry_lower) or ("** Stnno:" in entry_lower):
+            stnno = entry.split()[-1]
+
+        if ("** trpno:" in entry_lower) or ("** Trpno:" in entry_lower):
+            trpno = entry.split()[-1]
+        if ("** vslcde:" in entry_lower) | ("** vslcde" in entry_lower):
+            vslcde = entry.split()[-1]
+
+        if "** region:" in entry_lower:
+            region = entry.split()[-1]
+
+        if ("** CSF" in entry_lower) or ("** csf" in entry_lower):
+            CSFbottomdepth = float(entry.split()[-1])
+
+    print "IPHC Lat: {lat}".format(lat=IPHC_Lat)
+    print "IPHC Lon: {lon}".format(lon=IPHC_Lon)
+    print "IPHC SetNo: {setno}".format(setno=setno)
+    print "IPHC StnNo: {stnno}".format(stnno=stnno)
+    print "IPHC TrpNo: {trpno}".format(trpno=trpno)
+    print "IPHC VSL CDE: {vslcde}".format(vslcde=vslcde)
+    print "IPHC Region: {region}".format(region=region)
+    print "IPHC CSF Bottom Depth: {CSFbottomdepth}".format(
+        CSFbottomdepth=CSFbottomdepth
+    )
+    # make sure save path exists
+    savefile = user_out
+    if not os.path.exists(savefile):
+        os.makedirs(savefile)
+
+    print "Working on Cast {cast_file}".format(cast_file=filein)
+
+    # PMEL EPIC Conventions
+    ncinstance = ncprocessing.CTD_IPHC(
+        savefile=(savefile + filein.split("/")[-1].replace(".cnv", ".nc")),
+        data=cast,
+        nc_format=nc_format,
+    )
+    _run_stages(timer, cast_id, len(cast), ncinstance, [
+        ("file_create", ncinstance.file_create),
+        ("sbeglobal_atts", ncinstance.sbeglobal_atts),
+        ("IPHC_atts", lambda: ncinstance.IPHC_atts(
+            vslcde=vslcde, setno=setno, stnno=stnno, trpno=trpno, region=region)),
+        ("PMELglobal_atts", lambda: ncinstance.PMELglobal_atts(
+            sfc_extend=sfc_extend, Water_Depth=CSFbottomdepth)),
+        ("dimension_init", ncinstance.dimension_init),
+        ("variable_init", ncinstance.variable_init),
+        ("add_data", ncinstance.add_data),
+        ("add_coord_data", lambda: ncinstance.add_coord_data(
+            pressure_var=pressure_varname, time1=time1, time2=time2,
+            latitude=IPHC_Lat, longitude=IPHC_Lon, CastLog=True)),
+    ])
+
+    return ncinstance.savefile
+
+
+def _run_stages(timer, cast_id, rows, ncinstance, stages):
+    """
+        Call each (name, method) of an ncprocessing instance as a timed stage, then
+        close the file (recording its size as bytes_written)
+    """
+    for name, method in stages:
+        with timer.stage(name, cast=cast_id, rows=rows):
+            method()
+
+    with timer.stage("close", cast=cast_id, rows=rows) as record:
         ncinstance.close()
+        record["bytes_written"] = os.path.getsize(ncinstance.savefile)
+
+
+"""------------------------------- Batch Processing -----------------------------------"""
+
+
+def _run_cast(converter, filein, user_out, options, timed=False, profile_dir=None):
+    """
+        Run one conversion, capturing any error so that one bad cast does not
+        stop the batch.
+
+        timed=True passes a fresh stagetimer.StageTimer to converter (profiling the
+        cast if profile_dir is set).
 
-        # COARDS/CF Style Conventions
-        """
-        ncinstance = ncprocessing.CF_CTD_NC(savefile=(savefile + cast.name.replace('_ctd', 'c') + '_cf_ctd.nc'), data=cast)
+        Returns (filein, savefile, error, records) where error is None or a traceback
+        string and records are the stage records of the cast
+    """
+    if not timed:
+        try:
+            return (filein, converter(filein, user_out, **options), None, [])
+        except Exception:
+            return (filein, None, traceback.format_exc(), [])
+
+    timer = stagetimer.StageTimer(profile_dir=profile_dir)
+    try:
+        with timer.profile(os.path.basename(filein)):
+            savefile = converter(filein, user_out, timer=timer, **options)
+        return (filein, savefile, None, timer.records)
+    except Exception:
+        return (filein, None, traceback.format_exc(), timer.records)
+
+
+def iter_conversions(files, user_out, converter=convert_cast, workers=1, timer=None,
+                     **options):
+    """
+        Convert each file with converter, yielding (filein, savefile, error) as each
+        cast finishes.  options (pressure_varname, nc_format, cache_dir) are
+        passed on to converter.
+
+        workers > 1 fans the casts out over a process pool (concurrent.futures, the
+        'futures' backport on python 2, serial without it), results are then yielded
+        in order of completion.  Output file names depend only on the input file so
+        they are the same however many workers are used.
+
+        timer (stagetimer.StageTimer) collects the stage records of every cast,
+        including those converted in worker processes
+    """
+    if not os.path.exists(user_out):
+        os.makedirs(user_out)
+
+    timed = timer is not None
+    profile_dir = timer.profile_dir if timed else None
+
+    def merged(result):
+        if timed:
+            timer.extend(result[3])
+        return result[:3]
+
+    if workers is not None and workers > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+        except ImportError:
+            print "concurrent.futures not available (pip install futures), converting casts serially"
+            workers = 1
+
+    if workers is None or workers <= 1:
+        for filein in files:
+            yield merged(_run_cast(converter, filein, user_out, options, timed, profile_dir))
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        futures = [
+            executor.submit(_run_cast, converter, filein, user_out, options, timed, profile_dir)
+            for filein in files
+        ]
+        for future in as_completed(futures):
+            yield merged(future.result())
+    finally:
+        # if the caller stops early, don't start casts that are still queued
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def summary_report(results):
+    """
+        Print a summary of a batch of conversions
+
+        Returns the list of failed (filein, savefile, error) results
+    """
+    failed = [result for result in results if result[2] is not None]
+
+    print "\nConverted {0} of {1} casts".format(len(results) - len(failed), len(results))
+    for filein, savefile, error in sorted(failed):
+        print "FAILED: {cast_file}\n{error}".format(cast_file=filein, error=error)
+
+    return failed
+
+
+def build_cruise_file(nc_files, cruise_file, cruise=""):
+    """
+        (Re)build a cruise aggregate file (ncprocessing.CTD_Cruise_NC) from per cast
+        EPIC files, in file name order.  The file is written under a temporary name
+        and moved into place when complete.
+    """
+    with atomic_path(cruise_file) as tmpfile:
+        ncinstance = ncprocessing.CTD_Cruise_NC(savefile=tmpfile, cruise=cruise)
         ncinstance.file_create()
-        ncinstance.sbeglobal_atts()
-        ncinstance.PMELglobal_atts(sfc_extend=sfc_extend)
-        ncinstance.dimension_init()
-        ncinstance.variable_init()
-        ncinstance.add_data()
-        ncinstance.add_coord_data( time=timeclass.get_python_date() )
-        ncinstance.close()    
-        """
-    processing_complete = True
-    return processing_complete
+        try:
+            for ncfile in sorted(nc_files):
+                ncinstance.add_epic_file(ncfile)
+        finally:
+            ncinstance.close()
+    print "Cruise file with {0} casts written to {1}".format(len(nc_files), cruise_file)
+
+
+def update_cruise_file(cruise_file, converted, nc_files, cruise=""):
+    """
+        Bring a cruise aggregate file up to date after a batch.
+
+        converted (the EPIC files written by this batch) are appended to an existing
+        cruise file, nothing is done if no cast was converted.  The file is built
+        from all nc_files when it does not exist yet, or rebuilt when a converted
+        cast is already in it (a changed cast can not be replaced in the ragged array).
+    """
+    if not os.path.exists(cruise_file):
+        build_cruise_file(nc_files, cruise_file, cruise)
+        return
+    if not converted:
+        print "No casts converted, {0} is unchanged".format(cruise_file)
+        return
+
+    ncinstance = ncprocessing.CTD_Cruise_NC(savefile=cruise_file, cruise=cruise)
+    ncinstance.file_open()
+    present = set(str(cast_id) for cast_id in ncinstance.cast_index()["cast"])
+    cast_ids = [os.path.splitext(os.path.basename(ncfile))[0] for ncfile in converted]
+    if present.intersection(cast_ids):
+        ncinstance.close()
+        build_cruise_file(nc_files, cruise_file, cruise)
+        return
+
+    for ncfile in sorted(converted):
+        ncinstance.add_epic_file(ncfile)
+    ncinstance.close()
+    print "{0} casts appended to {1}".format(len(converted), cruise_file)
+
+
+"""------------------------------- Incremental Runs -----------------------------------"""
+
+
+def file_hash(filein, blocksize=1 << 20):
+    """sha1 of a file's contents"""
+    sha1 = hashlib.sha1()
+    with open(filein, "rb") as fhandle:
+        block = fhandle.read(blocksize)
+        while block:
+            sha1.update(block)
+            block = fhandle.read(blocksize)
+    return sha1.hexdigest()
+
+
+class ConversionManifest(object):
+    """
+        Record of the casts converted into an output directory, kept as json in
+        the output directory.
 
+        Each source file is stored with its size, mtime, content hash, the output
+        file and the settings (converter, converter version, pressure variable) it
+        was converted with.  A cast is current if the settings match, its output
+        still exists and either size/mtime or the content hash are unchanged.
+    """
 
-def IPHC_data_processing(user_in, user_out, pressure_varname="prdM"):
+    manifest_name = ".ctd2nc_manifest.json"
+
+    def __init__(self, user_out):
+        self.manifest_file = os.path.join(user_out, ConversionManifest.manifest_name)
+        try:
+            with open(self.manifest_file, "r") as fhandle:
+                self.entries = json.load(fhandle)
+        except (IOError, ValueError):
+            self.entries = {}
+        self._pending = {}
+        # entries changed since the manifest was read or saved
+        self.modified = False
+
+    def is_current(self, filein, settings):
+        key = os.path.abspath(filein)
+        stat = os.stat(filein)
+        source = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+        entry = self.entries.get(key)
+        if (entry is not None and entry["settings"] == settings
+                and os.path.exists(entry["savefile"])):
+            if entry["size"] == source["size"] and entry["mtime"] == source["mtime"]:
+                return True
+            source["sha1"] = file_hash(filein)
+            if entry["sha1"] == source["sha1"]:
+                # touched but not changed, keep the new mtime so the next run
+                # does not hash it again
+                entry.update(source)
+                self.modified = True
+                return True
+        else:
+            source["sha1"] = file_hash(filein)
+
+        self._pending[key] = source
+        return False
+
+    def record(self, filein, savefile, settings):
+        key = os.path.abspath(filein)
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            stat = os.stat(filein)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime,
+                     "sha1": file_hash(filein)}
+        entry["savefile"] = savefile
+        entry["settings"] = settings
+        self.entries[key] = entry
+        self.modified = True
+
+    def save(self):
+        with atomic_write(self.manifest_file, "w") as fhandle:
+            json.dump(self.entries, fhandle, sort_keys=True, indent=4)
+        self.modified = False
+
+
+def batch_conversions(user_in, user_out, converter=convert_cast, workers=1,
+                      incremental=False, timer=None, **options):
+    """
+        Convert the casts selected by user_in, yielding (filein, savefile, error)
+        for each cast as it finishes.  options (pressure_varname, nc_format,
+        cache_dir) are passed on to converter.
+
+        incremental=True skips casts whose source and settings are unchanged since
+        the last run into user_out (see ConversionManifest)
+        timer (stagetimer.StageTimer) collects stage timings of every cast converted
+    """
+    files = cast_files(user_in)
+
+    if not incremental:
+        for result in iter_conversions(files, user_out, converter=converter,
+                                       workers=workers, timer=timer, **options):
+            yield result
+        return
+
+    if not os.path.exists(user_out):
+        os.makedirs(user_out)
+
+    settings = dict(options, converter=converter.__name__, version=CONVERTER_VERSION)
+    # where parsed casts are cached does not change the output
+    settings.pop("cache_dir", None)
+    manifest = ConversionManifest(user_out)
+    todo = [filein for filein in files if not manifest.is_current(filein, settings)]
+    print "Skipping {0} unchanged casts, converting {1}".format(len(files) - len(todo), len(todo))
+    if manifest.modified:
+        # refreshed mtimes of touched casts, saved even if nothing is converted
+        manifest.save()
+
+    for result in iter_conversions(todo, user_out, converter=converter,
+                                   workers=workers, timer=timer, **options):
+        filein, savefile, error = result
+        if error is None:
+            manifest.record(filein, savefile, settings)
+            manifest.save()
+        yield result
+
+
+"""------------------------------- Data Pointer----------------------------------------"""
+
+
+def _batch_timer(trace_file, profile_dir):
+    if trace_file is None and profile_dir is None:
+        return None
+    return stagetimer.StageTimer(profile_dir=profile_dir)
+
+
+def _finish_timer(timer, trace_file):
+    if timer is None:
+        return
+    timer.report()
+    if trace_file is not None:
+        timer.write_trace(trace_file)
+        print "Stage trace written to {0}".format(trace_file)
+
+
+def data_processing(user_in, user_out, pressure_varname="prDM", workers=1,
+                    incremental=False, nc_format="NETCDF3_CLASSIC", cruise_file=None,
+                    cache_dir=None, trace_file=None, profile_dir=None):
     """
         Change pressure_var to prDM for 
         most 9/11 and prSM for sbe25 in following line or 
         prdM for sbe19pV2
 
+        workers > 1 converts casts in parallel
+        incremental=True only converts new or changed casts
+        nc_format is NETCDF3_CLASSIC (EPIC) or NETCDF4 (compressed)
+        cache_dir keeps parsed casts (castcache) so re-runs skip the .cnv parsing
+        trace_file saves per stage timings as json (chrome://tracing compatible) and
+            prints a stage summary, profile_dir saves a cProfile .prof per cast
+        cruise_file also collects all *_ctd.nc files in user_out into one cruise
+            file (casts converted by later runs are appended, see update_cruise_file)
 
     """
-    # add ability to ingest entire directory
-    if os.path.isdir(user_in):
-        user_in = [user_in] + [fi for fi in os.listdir(user_in) if fi.endswith(".cnv")]
+    timer = _batch_timer(trace_file, profile_dir)
+    results = list(
+        batch_conversions(
+            user_in,
+            user_out,
+            converter=convert_cast,
+            pressure_varname=pressure_varname,
+            workers=workers,
+            incremental=incremental,
+            nc_format=nc_format,
+            cache_dir=cache_dir,
+            timer=timer,
+        )
+    )
+    failed = summary_report(results)
+    _finish_timer(timer, trace_file)
 
-    else:
-        user_in = user_in.split(",")
-
-    for i, filein in enumerate(user_in):
-        if i == 0 and len(user_in) > 1:
-            path = filein.strip()
-            continue
-        elif i == 0 and len(user_in) == 1:
-            path = filein.strip()
-        else:
-            filein = path + filein.strip()
+    if cruise_file is not None:
+        converted = [savefile for filein, savefile, error in results if error is None]
+        update_cruise_file(cruise_file, converted, glob.glob(os.path.join(user_out, "*_ctd.nc")))
 
-        # read in .cnv file generate pandas dataframe... includes some preprocessing
-        # Todo: incorporate PMEL header information from cast logs (either as a '@' comment in the cnv file or from a separate text file)
-        cast = ctd.from_cnv(filein, pressure_varname=pressure_varname)
+    processing_complete = not failed
+    return processing_complete
 
-        # tried subroutine in ctd.py but dataframe reassignment was odd
-        cast.drop(cast.index[cast["flag"] == True], inplace=True)
 
-        timeclass = ctd.DataTimes(time_str=cast.time_str)
-        sfc_extend = "Extrapolated to SFC from " + str(cast.SFC_EXTEND) + "m"
-
-        # parse header files for '** ' lines which have IPHC relevant meta in them
-
-        for entry in cast.header:
-            entry_lower = entry.lower()
-            """* <![CDATA[
-                ** latitude: 580104
-                ** longitude: 1491283
-                ** setno: 047
-                ** stnno: 4195
-                ** trpno: 04
-                ** vslcde: CLD
-                ** region: GP
-                ** CSF bottom depth(m): 150
-                * ]]>"""
-            if ("** latitude:" in entry_lower) or ("** Latitude:" in entry_lower):
-                IPHC_Lat = (
-                    float(entry.split()[-1][:2]) + float(entry.split()[-1][2:]) / 6000.0
-                )
-            if ("** longitude:" in entry_lower) or ("** Longitude:" in entry_lower):
-                IPHC_Lon = -1 * (
-                    float(entry.split()[-1][:3]) + float(entry.split()[-1][3:]) / 6000.0
-                )
-            if ("** setno:" in entry_lower) or ("** Setno:" in entry_lower):
-                setno = entry.split()[-1]
-
-            if ("** stnno:" in entry_lower) or ("** Stnno:" in entry_lower):
-                stnno = entry.split()[-1]
-
-            if ("** trpno:" in entry_lower) or ("** Trpno:" in entry_lower):
-                trpno = entry.split()[-1]
-            if ("** vslcde:" in entry_lower) | ("** vslcde" in entry_lower):
-                vslcde = entry.split()[-1]
-
-            if "** region:" in entry_lower:
-                region = entry.split()[-1]
-
-            if ("** CSF" in entry_lower) or ("** csf" in entry_lower):
-                CSFbottomdepth = float(entry.split()[-1])
-
-        print "IPHC Lat: {lat}".format(lat=IPHC_Lat)
-        print "IPHC Lon: {lon}".format(lon=IPHC_Lon)
-        print "IPHC SetNo: {setno}".format(setno=setno)
-        print "IPHC StnNo: {stnno}".format(stnno=stnno)
-        print "IPHC TrpNo: {trpno}".format(trpno=trpno)
-        print "IPHC VSL CDE: {vslcde}".format(vslcde=vslcde)
-        print "IPHC Region: {region}".format(region=region)
-        print "IPHC CSF Bottom Depth: {CSFbottomdepth}".format(
-            CSFbottomdepth=CSFbottomdepth
-        )
-        # make sure save path exists
-        savefile = user_out
-        if not os.path.exists(savefile):
-            os.makedirs(savefile)
+def IPHC_data_processing(user_in, user_out, pressure_varname="prdM", workers=1,
+                         incremental=False, nc_format="NETCDF3_CLASSIC", cache_dir=None,
+                         trace_file=None, profile_dir=None):
+    """
+        Change pressure_var to prDM for 
+        most 9/11 and prSM for sbe25 in following line or 
+        prdM for sbe19pV2
 
-        print "Working on Cast {cast_file}".format(cast_file=filein)
+        workers > 1 converts casts in parallel
+        incremental=True only converts new or changed casts
+        nc_format is NETCDF3_CLASSIC (EPIC) or NETCDF4 (compressed)
+        cache_dir keeps parsed casts (castcache) so re-runs skip the .cnv parsing
+        trace_file saves per stage timings as json (chrome://tracing compatible) and
+            prints a stage summary, profile_dir saves a cProfile .prof per cast
 
-        # PMEL EPIC Conventions
-        ncinstance = ncprocessing.CTD_IPHC(
-            savefile=(savefile + filein.split("/")[-1].replace(".cnv", ".nc")),
-            data=cast,
-        )
-        ncinstance.file_create()
-        ncinstance.sbeglobal_atts()  #
-        ncinstance.IPHC_atts(
-            vslcde=vslcde, setno=setno, stnno=stnno, trpno=trpno, region=region
-        )
-        ncinstance.PMELglobal_atts(sfc_extend=sfc_extend, Water_Depth=CSFbottomdepth)
-        ncinstance.dimension_init()
-        ncinstance.variable_init()
-        ncinstance.add_data()
-        ncinstance.add_coord_data(
-            pressure_var=pressure_varname,
-            time1=timeclass.get_EPIC_date()[0],
-            time2=timeclass.get_EPIC_date()[1],
-            latitude=IPHC_Lat,
-            longitude=IPHC_Lon,
-            CastLog=True,
+    """
+    timer = _batch_timer(trace_file, profile_dir)
+    results = list(
+        batch_conversions(
+            user_in,
+            user_out,
+            converter=convert_IPHC_cast,
+            pressure_varname=pressure_varname,
+            workers=workers,
+            incremental=incremental,
+            nc_format=nc_format,
+            cache_dir=cache_dir,
+            timer=timer,
         )
-        ncinstance.close()
+    )
+    failed = summary_report(results)
+    _finish_timer(timer, trace_file)
 
-    processing_complete = True
+    processing_complete = not failed
     return processing_complete
 
 
-if __name__ == "__main__":
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert SBE .cnv files to EPIC NetCDF")
+    parser.add_argument("user_in", metavar="user_in", type=str, nargs="?",
+                        help='directory of .cnv files, a .cnv file or "path, file1, file2"')
+    parser.add_argument("user_out", metavar="user_out", type=str, nargs="?",
+                        help="output directory")
+    parser.add_argument("-p", "--pressure_varname", type=str,
+                        help="pressure variable (prDM, prSM, prdM)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of casts to convert in parallel")
+    parser.add_argument("--IPHC", action="store_true", help="IPHC style .cnv files")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="only convert casts that are new or changed since the last run")
+    parser.add_argument("-c", "--cruise_file", type=str,
+                        help="also write all casts to this cruise file (not for --IPHC)")
+    parser.add_argument("-f", "--format", type=str, default="NETCDF3_CLASSIC",
+                        choices=sorted(ncprocessing.OUTPUT_PROFILES),
+                        help="output format, NETCDF4 files are compressed")
+    parser.add_argument("--cache_dir", type=str,
+                        help="keep parsed casts in this directory for faster re-runs")
+    parser.add_argument("--trace", type=str,
+                        help="save per stage timings of every cast to this json file")
+    parser.add_argument("--profile_dir", type=str,
+                        help="save a cProfile .prof file per cast in this directory")
+    args = parser.parse_args()
+
+    user_in = args.user_in
+    if user_in is None:
+        user_in = raw_input(
+            "Please enter the abs path to the .cnv file: or \n path, file1, file2: "
+        )
+    user_out = args.user_out
+    if user_out is None:
+        user_out = raw_input("Please enter the abs path to the output directory: ")
+    if not user_out.endswith("/"):
+        user_out = user_out + "/"
+
+    if args.IPHC:
+        IPHC_data_processing(user_in, user_out,
+                             pressure_varname=(args.pressure_varname or "prdM"),
+                             workers=args.workers, incremental=args.incremental,
+                             nc_format=args.format, cache_dir=args.cache_dir,
+                             trace_file=args.trace, profile_dir=args.profile_dir)
+    else:
+        data_processing(user_in, user_out,
+                        pressure_varname=(args.pressure_varname or "prDM"),
+                        workers=args.workers, incremental=args.incremental,
+                        nc_format=args.format, cruise_file=args.cruise_file,
+                        cache_dir=args.cache_dir, trace_file=args.trace,
+                        profile_dir=args.profile_dir)
 
-    user_in = raw_input(
-        "Please enter the abs path to the .cnv file: or \n path, file1, file2: "
-    )
-    data_processing()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env
+
+"""
+ castcache.py
+
+ Seabird CNV only
+
+ Binary cache of parsed casts.  The first read of a .cnv file goes through
+ ctd.from_cnv and is stored as
+
+    <cache_dir>/<key>/data.npy   -- all columns as one float64 block, column major
+    <cache_dir>/<key>/meta.json  -- columns, dtypes, header, config, time_str,
+                                    lat/lon, SFC_EXTEND, name and source file stat
+
+ Later reads memory map data.npy (numpy.load mmap_mode='r') so a cast opens without
+ re-parsing the ASCII and without copying the float columns.  The key covers the
+ source path, the from_cnv options and the ctd/cache versions; an entry is only
+ used while the source file size and mtime are unchanged.
+
+ Usage:
+ ------
+ from CTD_Vis import castcache
+ cast = castcache.from_cnv(filein, cache_dir='/path/to/cache', pressure_varname='prDM')
+
+ Built using Anaconda packaged Python:
+
+
+"""
+from __future__ import absolute_import
+
+# Standard library.
+import datetime, os, json, hashlib, warnings
+
+# Scientific stack.
+import numpy as np
+from pandas import DataFrame
+
+# User library
+from . import ctd
+from io_utils.disk_cache import atomic_path
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2014, 10, 20)
+__modified__ = datetime.datetime(2014, 10, 20)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+# bump when the on disk layout changes
+CACHE_VERSION = 1
+
+DATA_FILE = 'data.npy'
+META_FILE = 'meta.json'
+
+
+"""-------------------------------Cache Keys-------------------------------------------"""
+
+def _source_stat(fname):
+    stat = os.stat(fname)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def cache_key(fname, options):
+    """
+    Directory name of the cache entry for fname read with from_cnv(**options)
+    """
+    key = json.dumps([os.path.abspath(fname), sorted(options.items()),
+                      ctd.__version__, CACHE_VERSION])
+    return os.path.basename(fname).replace('.', '_') + '-' + hashlib.sha1(key).hexdigest()[:16]
+
+def _as_float(value):
+    """json friendly lat/lon/SFC_EXTEND (numpy scalars or None)"""
+    if value is None:
+        return None
+    return float(value)
+
+
+"""-------------------------------Read / Write-----------------------------------------"""
+
+def write_cast(cast, cache_path, fname, pressure_varname='prDM'):
+    """
+    Store a parsed cast (ctd.CTD) in cache_path, written as one directory with
+    io_utils.disk_cache.atomic_path.
+    """
+    columns = [str(c) for c in cast.columns]
+    meta = {
+        'version': CACHE_VERSION,
+        'source': _source_stat(fname),
+        'columns': columns,
+        'dtypes': [cast[c].dtype.str for c in cast.columns],
+        'pressure_varname': pressure_varname,
+        'index_name': cast.index.name,
+        'name': cast.name,
+        'header': cast.header,
+        'config': cast.config,
+        'time_str': cast.time_str,
+        'longitude': _as_float(cast.longitude),
+        'latitude': _as_float(cast.latitude),
+        'SFC_EXTEND': _as_float(cast.SFC_EXTEND),
+    }
+    # column major so every column is one contiguous run of the file
+    data = np.asfortranarray(cast.values.astype(np.float64))
+
+    with atomic_path(cache_path) as tmp_path:
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, DATA_FILE), data)
+        with open(os.path.join(tmp_path, META_FILE), 'w') as fhandle:
+            json.dump(meta, fhandle)
+
+def read_cast(cache_path, fname=None, mmap_mode='r'):
+    """
+    Open a cached cast as a ctd.CTD.  Float columns are views on the memory
+    mapped data block; integer/bool columns (bpos, pumps, flag) are restored to
+    their original dtype.
+
+    Returns None if there is no usable entry (missing, older cache version or
+    fname has changed since the entry was written)
+    """
+    try:
+        with open(os.path.join(cache_path, META_FILE), 'r') as fhandle:
+            meta = json.load(fhandle)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    if fname is not None and meta['source'] != _source_stat(fname):
+        return None
+
+    data = np.load(os.path.join(cache_path, DATA_FILE), mmap_mode=mmap_mode)
+    # data.T of a column major block is C contiguous, pandas keeps it as one block
+    cast = DataFrame(data, columns=meta['columns'], copy=False)
+    for column, dtype in zip(meta['columns'], meta['dtypes']):
+        if np.dtype(dtype) != np.float64:
+            cast[column] = cast[column].astype(dtype)
+
+    if meta['pressure_varname'] in cast.columns:
+        cast.set_index(meta['pressure_varname'], drop=False, inplace=True)
+        cast.index.name = meta['index_name']
+
+    return ctd.CTD(cast, longitude=meta['longitude'], latitude=meta['latitude'],
+                   name=meta['name'], header=meta['header'], config=meta['config'],
+                   SFC_EXTEND=meta['SFC_EXTEND'], time_str=meta['time_str'])
+
+
+"""-------------------------------Cached Constructor-----------------------------------"""
+
+def from_cnv(fname, cache_dir=None, mmap_mode='r', info=None, **options):
+    """
+    ctd.from_cnv with a binary cache in cache_dir (no caching if cache_dir is None)
+
+    Parameters
+    ----------
+    fname : str
+        .cnv file
+    cache_dir : str
+        directory holding the cache entries, created if needed
+    mmap_mode : str
+        numpy.load mmap mode for cached data, 'r' (read only, default) or 'c'
+        (copy on write) for callers that modify the cast in place
+    info : dict
+        if given, info['cache_hit'] is set to True when the cast came from the
+        cache (the .cnv file was not read)
+    options :
+        passed on to ctd.from_cnv (pressure_varname, lon, lat, engine, ...)
+
+    Returns
+    -------
+    cast : ctd.CTD
+    """
+    if info is not None:
+        info['cache_hit'] = False
+    if cache_dir is None:
+        return ctd.from_cnv(fname, **options)
+
+    cache_path = os.path.join(cache_dir, cache_key(fname, options))
+    cast = read_cast(cache_path, fname, mmap_mode=mmap_mode)
+    if cast is not None:
+        if info is not None:
+            info['cache_hit'] = True
+        return cast
+
+    cast = ctd.from_cnv(fname, **options)
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        write_cast(cast, cache_path, fname,
+                   pressure_varname=options.get('pressure_varname', 'prDM'))
+    except (IOError, OSError, TypeError, ValueError) as err:
+        # an unwritable cache or a header json can't hold should not stop processing
+        warnings.warn('Could not cache %s: %s' % (fname, err))
+        return cast
+
+    # hand back the memory mapped copy so first and later reads behave the same
+    return read_cast(cache_path, mmap_mode=mmap_mode)
+
+def clear(cache_dir):
+    """Remove all cache entries in cache_dir"""
+    if os.path.isdir(cache_dir):
+        for entry in os.listdir(cache_dir):
+            if os.path.exists(os.path.join(cache_dir, entry, META_FILE)):
+                shutil.rmtree(os.path.join(cache_dir, entry))
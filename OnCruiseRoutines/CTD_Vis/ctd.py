@@ -26,6 +26,10 @@
  -------
  Found bug in interp2sfc that wasn't allowing pandas frame to be indexed properly
  Initially pressure field was hardcoded to prDM, now prSM is also available
+ from_cnv reads the header once and decodes the data block with numpy (engine='fast')
+ interp2sfc builds all surface padding rows at once (bin_size and fill options),
+   'linear' fill fits the measured channels over the top fit_range dbar
+ DataTimes.get_EPIC_date uses the integer EPIC time core (calc/epic_time.py)
  
 """
 from __future__ import absolute_import
@@ -39,6 +43,9 @@ from pandas import Series, DataFrame
 from pandas import read_table, concat
 from netCDF4 import Dataset
 
+# User library
+from calc import epic_time
+
 __all__ = ['CTD',
             'interp2sfc',
            'from_cnv',
@@ -99,41 +106,87 @@ def remove_flagged(cast):
     return cast.drop(cast.index[cast['flag'] == True])
 
 
-def interp2sfc(cast, pressure_key='prDM'):
-    """ Horribly inefficient for large arrays """
+# bookkeeping columns (counters, times, flags, positions) are never extrapolated
+SFC_COPY_PREFIXES = ('flag', 'scan', 'nbin', 'nbf', 'bpos', 'pumps', 'time', 'latitude', 'longitude')
+
+def interp2sfc(cast, pressure_key='prDM', bin_size=1., fill='copy', fit_range=2.):
+    """
+    Extend a cast to the surface by prepending rows every bin_size (dbar) above the
+    first scan until a row at or above 0 is reached.  All padding rows are built
+    in one block and joined to the cast with a single concat.
+
+    Parameters
+    ----------
+    fill : str
+        'copy' repeats the first scan (default), 'linear' extrapolates the measured
+        channels along a least squares line through the scans within fit_range dbar
+        of the shallowest one (columns starting with SFC_COPY_PREFIXES and channels
+        without a finite fit are copied), 'none' leaves the measured channels of
+        the padded rows as NaN (SFC_COPY_PREFIXES columns are copied)
+    fit_range : float
+        pressure window (dbar) of the 'linear' fit
+
+    Returns
+    -------
+    Outputs : tuple
+              (cast, min_val_report) where min_val_report is the shallowest
+              pressure of the original cast (the SFC_EXTEND value)
+    """
+    if fill not in ('copy', 'linear', 'none'):
+        raise ValueError("fill must be 'copy', 'linear' or 'none', not %r" % fill)
+
     try:
         min_val_report = cast[pressure_key].values.min()
     except:
         min_val_report = 0.0
-        
-    min_val = min_val_report
-    while min_val > 0.0:
-        print 'Extrapolating to surface %s' % min_val
-        cast = concat([cast.head(n=1), cast], ignore_index=True)
-        min_val = min_val - 1.
-        cast[pressure_key][0] = min_val #revalue at each copy
-                    
+
+    if not min_val_report > 0.0:
+        return (cast, min_val_report)
+
+    nadd = int(np.ceil(min_val_report / bin_size))
+    pres = min_val_report - bin_size * np.arange(nadd, 0, -1)
+
+    pad = cast.iloc[np.zeros(nadd, dtype=int)].reset_index(drop=True)
+    measured = [c for c in cast.columns
+                if c != pressure_key and not str(c).startswith(SFC_COPY_PREFIXES)]
+    if fill == 'none':
+        pad[measured] = np.nan
+    elif fill == 'linear':
+        pressure = cast[pressure_key].values.astype(float)
+        near = pressure <= min_val_report + fit_range
+        if measured and near.sum() > 1:
+            p = pressure[near] - pressure[near].mean()
+            values = cast[measured].values[near].astype(float)
+            mean = values.mean(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                slope = (p[:, np.newaxis] * (values - mean)).sum(axis=0) / (p ** 2).sum()
+            extrapolated = mean + (pres - pressure[near].mean())[:, np.newaxis] * slope
+            fitted = np.isfinite(slope) & np.isfinite(mean)
+            pad[measured] = np.where(fitted, extrapolated, pad[measured].values)
+    pad[pressure_key] = pres
+
+    cast = concat([pad, cast], ignore_index=True)
     return (cast, min_val_report)
 
-def from_cnv(fname, compression=None, below_water=False, lon=None,
-             lat=None, pressure_varname='prDM'):
+def _read_cnv_header(f, lon=None, lat=None):
     """
-    DataFrame constructor to open Seabird CTD CNV-ASCII format.
+    Scan the header of an open .cnv file once, leaving the file positioned at the
+    first data line.
 
-    Examples
-    --------
-    >>> from ctd import DataFrame
-    >>> cast = DataFrame.from_cnv('../test/data/CTD_big.cnv.bz2',
-    ...                           compression='bz2')
-    >>> downcast, upcast = cast.split()
-    >>> fig, ax = downcast['t090c'].plot()
-    >>> ax.grid(True)
+    Returns
+    -------
+    Outputs : dict
+              names, header, config, PMELheader, lon, lat, time_str, nvalues
+              (number of scans, None without a '# nvalues' line) and the byte
+              offset of the first line after *END*
     """
-
-    f = open(fname)
     header, config, names, PMELheader = [], [], [], []
     has_NMEA = False
-    for k, line in enumerate(f.readlines()):
+    time_str, systime_str, hemisphere = None, None, ''
+    nvalues = None
+    # readline (not iteration) so that f.tell() is exact
+    line = f.readline()
+    while line:
         line = line.strip()
         if '# name' in line:  # Get columns names.
             name, unit = line.split('=')[1].split(':')
@@ -145,6 +198,8 @@ def from_cnv(fname, compression=None, below_water=False, lon=None,
             config.append(line)
         if line.startswith('@'):  # Get PMEL Header.
             PMELheader.append(line)
+        if line.startswith('# nvalues'):  # Number of scans.
+            nvalues = int(line.split('=')[1])
         if 'NMEA Latitude' in line:
             hemisphere = line[-1]
             lat = line.strip(hemisphere).split('=')[1].strip()
@@ -173,19 +228,95 @@ def from_cnv(fname, compression=None, below_water=False, lon=None,
         elif '* System UpLoad Time' in line:
             systime_str = line.split('=')[-1].strip()
         if line == '*END*':  # Get end of header.
-            skiprows = k + 1
             if has_NMEA == False: # set time if NMEA not available
                 time_str = systime_str
                 lon = -999.9
                 lat = -999.9
             break
+        line = f.readline()
+    else:
+        raise ValueError("No *END* line found in %s" % getattr(f, 'name', f))
+
+    return dict(names=names, header=header, config=config, PMELheader=PMELheader,
+                lon=lon, lat=lat, time_str=time_str, nvalues=nvalues, data_offset=f.tell())
+
+def _count_scans(f, offset):
+    """number of non-blank lines from offset to the end of f"""
+    f.seek(offset)
+    return sum(1 for x in f if x.strip())
 
-    f.seek(0)
-    cast = read_table(f, header=None, index_col=None, names=names,
-                      skiprows=skiprows, delim_whitespace=True)
+def _read_cnv_body(f, ncols, field_width=11, nscans=None):
+    """
+    Decode the numeric body of a .cnv file (f positioned after *END*) into one
+    preallocated float64 block of shape (nscans, ncols).
+
+    Whitespace separated values are read directly by numpy.  np.fromfile stops
+    quietly at the first token it can not parse, so the values read must fill
+    exactly nscans (the header '# nvalues') scans, or the number of non-blank body
+    lines if nvalues is missing or stale.  Otherwise (Seasoft writes fixed 11
+    character fields which can run together for wide values) the body is re-read
+    as fixed width records.
+    """
+    offset = f.tell()
+    data = np.fromfile(f, dtype=np.float64, sep=' ')
+    if ncols and nscans is not None and data.size == nscans * ncols:
+        return data.reshape(nscans, ncols)
+    if ncols and data.size % ncols == 0 and data.size == _count_scans(f, offset) * ncols:
+        return data.reshape(-1, ncols)
+
+    f.seek(offset)
+    lines = [x for x in f.read().splitlines() if x.strip()]
+    width = field_width * ncols
+    if not lines or any(len(x) != width for x in lines):
+        raise ValueError("Could not decode .cnv body as whitespace or fixed width data.")
+    fields = np.array(lines, dtype='S%d' % width).view('S%d' % field_width)
+    return fields.reshape(len(lines), ncols).astype(np.float64)
+
+def from_cnv(fname, compression=None, below_water=False, lon=None,
+             lat=None, pressure_varname='prDM', engine='fast', sfc_bin=1.,
+             sfc_fill='copy'):
+    """
+    DataFrame constructor to open Seabird CTD CNV-ASCII format.
+
+    Parameters
+    ----------
+    engine : str
+        'fast' scans the header once and decodes the data block directly with
+        numpy (default), 'pandas' hands the data block to pandas.read_table.
+        The fast engine falls back to pandas if the block can not be decoded.
+    sfc_bin, sfc_fill : float, str
+        bin spacing and fill strategy used by interp2sfc
+
+    Examples
+    --------
+    >>> from ctd import DataFrame
+    >>> cast = DataFrame.from_cnv('../test/data/CTD_big.cnv.bz2',
+    ...                           compression='bz2')
+    >>> downcast, upcast = cast.split()
+    >>> fig, ax = downcast['t090c'].plot()
+    >>> ax.grid(True)
+    """
+    if engine not in ('fast', 'pandas'):
+        raise ValueError("engine must be 'fast' or 'pandas', not %r" % engine)
+
+    f = open(fname, 'rb')
+    meta = _read_cnv_header(f, lon=lon, lat=lat)
+    names = meta['names']
+
+    cast = None
+    if engine == 'fast':
+        try:
+            cast = DataFrame(_read_cnv_body(f, len(names), nscans=meta['nvalues']), columns=names)
+        except ValueError:
+            warnings.warn('Fast .cnv engine failed for %s, using pandas.' % fname)
+            f.seek(meta['data_offset'])
+    if cast is None:
+        cast = read_table(f, header=None, index_col=None, names=names,
+                          delim_whitespace=True)
     f.close()
     
-    (cast, min_value) = interp2sfc(cast, pressure_key = pressure_varname) 
+    (cast, min_value) = interp2sfc(cast, pressure_key=pressure_varname,
+                                   bin_size=sfc_bin, fill=sfc_fill)
     cast.set_index(pressure_varname, drop=False, inplace=True)
     cast.index.name = 'Pressure [dbar]'
                     
@@ -205,8 +336,9 @@ def from_cnv(fname, compression=None, below_water=False, lon=None,
         cast = remove_above_water(cast)
     
     #TODO: Return interp2sfc min_value as "SFC_EXTEND" attribute
-    return CTD(cast, longitude=lon, latitude=lat, name=name, header=header,
-               config=config, SFC_EXTEND=min_value, time_str=time_str)
+    return CTD(cast, longitude=meta['lon'], latitude=meta['lat'], name=name,
+               header=meta['header'], config=meta['config'], SFC_EXTEND=min_value,
+               time_str=meta['time_str'])
 
 def rosette_summary(fname):
     """
@@ -272,12 +404,8 @@ class DataTimes(object):
         return(intday + fracday)
         
     def get_EPIC_date(self):
-        time1 = self.date_time.toordinal() + DataTimes.offset
-        fracday = (self.date_time.hour / (24.)) + (self.date_time.minute / (24. * 60.)) +\
-                    (self.date_time.second / (24. * 60. * 60.))
-        time2 = fracday * (24. * 60. * 60. * 1000.)
-        
-        return(time1, int(time2))
+        # integer days and milliseconds, no fractions of a day
+        return epic_time.datetime2epic(self.date_time)
 
 def normalize_names(name):
     name = name.strip()
@@ -299,6 +427,30 @@ def basename(fname):
     name, ext = os.path.splitext(name)
     return path, name, ext
     
+"""------------------------------------- Tests --------------------------------------------------"""
+# run with: python ctd.py
+
+SAMPLE_CNV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'sbe_files', 'ctd001.cnv')
+
+def test_sfc_fill_none():
+    """'none' pads the measured channels with NaN, flags and counters stay valid"""
+    raw = DataFrame({'prDM': [2., 3.], 't090C': [9.1, 9.2], 'bpos': [0, 0],
+                     'pumps': [1., 1.], 'flag': [0., 0.]})
+    (cast, min_value) = interp2sfc(raw, fill='none')
+    assert min_value == 2. and list(cast['prDM']) == [0., 1., 2., 3.]
+    assert np.isnan(cast['t090C'].values[:2]).all()
+    assert (cast['bpos'].values == 0).all() and (cast['flag'].values == 0.).all()
+    assert (cast['pumps'].values == 1.).all()
+
+    cast = from_cnv(SAMPLE_CNV, sfc_fill='none')
+    padded = cast['prDM'].values < cast.SFC_EXTEND
+    assert padded.sum() == 1
+    assert np.isnan(cast['t090C'].values[padded]).all()
+    assert not cast['flag'].values[padded].any()
+    assert not np.isnan(cast['t090C'].values[~padded]).any()
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
+    test_sfc_fill_none()
+    print "test_sfc_fill_none: ok"
@@ -15,6 +15,7 @@ from __future__ import absolute_import
 import datetime, os
 
 # Scientific stack.
+import numpy as np
 from netCDF4 import Dataset
 
 # User library
@@ -26,10 +27,35 @@ __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2014, 01, 13)
 __modified__ = datetime.datetime(2014, 10, 10)
-__version__  = "0.2.0"
+__version__  = "0.3.0"
 __status__   = "Development"
 
 
+"""-------------------------------Output Profiles--------------------------------------"""
+
+# createVariable options for the profile variables of each output format
+#   NETCDF3_CLASSIC -- EPIC compatible, uncompressed (default)
+#   NETCDF4         -- HDF5 based, zlib/shuffle compressed
+OUTPUT_PROFILES = {
+    'NETCDF3_CLASSIC': {},
+    'NETCDF4': {'zlib': True, 'shuffle': True, 'complevel': 4},
+}
+
+def profile_var_options(nc_format, dims):
+    """
+    createVariable keyword arguments for a variable along the depth dimension.
+    Compressed formats are chunked one whole profile per chunk (depth aligned).
+
+    dims -- tuple of dimension lengths of the variable
+    """
+    try:
+        options = dict(OUTPUT_PROFILES[nc_format])
+    except KeyError:
+        raise ValueError("nc_format must be one of %s" % ', '.join(sorted(OUTPUT_PROFILES)))
+    if options:
+        options['chunksizes'] = tuple(dims)
+    return options
+
 """-------------------------------NCFile Creation--------------------------------------"""
 
 """-------------------------------EPIC Standard----------------------------------------"""
@@ -64,14 +90,18 @@ class CTD_NC(object):
     
     nc_format = 'NETCDF3_CLASSIC'
     nc_read   = 'w'
-    def __init__(self, savefile='ncfiles/test.nc', data=None):
-        """data is a pandas dataframe"""
+    def __init__(self, savefile='ncfiles/test.nc', data=None, nc_format=None):
+        """data is a pandas dataframe
+        nc_format is one of OUTPUT_PROFILES, defaults to the class nc_format"""
         
         self.data = data
         self.savefile = savefile
+        self.nc_format = nc_format or self.__class__.nc_format
+        if self.nc_format not in OUTPUT_PROFILES:
+            raise ValueError("nc_format must be one of %s" % ', '.join(sorted(OUTPUT_PROFILES)))
     
     def file_create(self):
-            rootgrpID = Dataset(self.savefile, CTD_NC.nc_read, format=CTD_NC.nc_format)
+            rootgrpID = Dataset(self.savefile, CTD_NC.nc_read, format=self.nc_format)
             self.rootgrpID = rootgrpID
             return ( rootgrpID )
         
@@ -160,27 +190,26 @@ class CTD_NC(object):
         Usage:
         ------
         
-        from EPICnetCDF import SBE_Epiclibrary
         from EPICnetCDF import epic_key_codes as ekc 
         
-        ekcl = ekc.EpicKeyCodes()
+        ekc.sbe_epic_table()['sal00']
         
-        ekcl.epic_dic_call(SBE_Epiclibrary.SBE_EPIC['sal00']) 
-        
-        #will return
-        #['S  ', 'SALINITY (PSU)           ', 'sal', 'PSU', ' ', 'Practical Salinity Units']
+        #will return (epic code, epic.key entry, local code)
+        #('41', ['S  ', 'SALINITY (PSU)           ', 'sal', 'PSU', ' ', 'Practical Salinity Units'], False)
         
         DataFrame.columns.values[0]
         """
-        ekcl = ekc.EpicKeyCodes()
+        sbe_epic = ekc.sbe_epic_table() #SBE_EPIC joined with epic.key once per process
         self.epicvars = {}
         self.sbe2epic = {}
+        local_codes = set()
         
         # get list of only epic variables in sbe file
         for pname in self.data.columns.values:
             try:
-                self.epicvars[pname] = ekcl.epic_dic_call(SBE_Epiclibrary.SBE_EPIC[pname])
-                self.sbe2epic[pname] = SBE_Epiclibrary.SBE_EPIC[pname]
+                (self.sbe2epic[pname], self.epicvars[pname], local) = sbe_epic[pname]
+                if local:
+                    local_codes.add(pname)
                 print pname
             except KeyError:
                 print "%s is not in the SBE_Epiclibrary and will not be added to the .nc file" % pname
@@ -188,6 +217,7 @@ class CTD_NC(object):
         #build record variable attributes
         rec_vars, rec_var_name, rec_var_longname = [], [], []
         rec_var_generic_name, rec_var_FORTRAN, rec_var_units, rec_var_epic = [], [], [], []
+        data_columns = [] # dataframe column written to each of rec_vars[5:]
         
         # for each epic variable, build required metainformation from epic.key file
         # temperatures should always be first
@@ -195,9 +225,8 @@ class CTD_NC(object):
 
         for i, k in enumerate(sorted(self.epicvars.keys())):
             kname = self.epicvars[k]
-            if kname is None: #dave K designated variables which aren't in epic.key of form -4084 for key 84
+            if k in local_codes: #dave K designated variables which aren't in epic.key of form -4084 for key 84
                 print "Variables in .cnv file %s using identifier %s" % (k, self.sbe2epic[k].split('_')[-1])
-                kname = ekcl.epic_dic_call( self.sbe2epic[k][-2:] )
                 rec_vars.append('_'.join((kname[0].strip().strip('\\'), self.sbe2epic[k].split('-')[-1])))
             elif (kname[0].strip().lower()) is not '': #no variables without Epic Keys
                 print "Variables in .cnv file %s" % ('_'.join((kname[0].strip().strip('\\'), self.sbe2epic[k])))
@@ -207,7 +236,7 @@ class CTD_NC(object):
                 print "No EPICkey. Variables in .cnv file %s -  %s skipped" % (k, self.sbe2epic[k].split('_')[-1])
                 continue
 
-                
+            data_columns.append(k)
             rec_var_name.append( kname[0].strip() )
             rec_var_longname.append( kname[1].strip() )
             rec_var_generic_name.append( kname[2].strip() )
@@ -229,12 +258,14 @@ class CTD_NC(object):
         var_class = []
         var_class.append(self.rootgrpID.createVariable(rec_vars[0], rec_var_type[0], self.dim_vars[0]))#time1
         var_class.append(self.rootgrpID.createVariable(rec_vars[1], rec_var_type[1], self.dim_vars[0]))#time2
-        var_class.append(self.rootgrpID.createVariable(rec_vars[2], rec_var_type[2], self.dim_vars[1]))#depth
+        var_class.append(self.rootgrpID.createVariable(rec_vars[2], rec_var_type[2], self.dim_vars[1],
+                         **profile_var_options(self.nc_format, (self.data.shape[0],))))#depth
         var_class.append(self.rootgrpID.createVariable(rec_vars[3], rec_var_type[3], self.dim_vars[2]))#lat
         var_class.append(self.rootgrpID.createVariable(rec_vars[4], rec_var_type[4], self.dim_vars[3]))#lon
         
         for i, v in enumerate(rec_vars[5:]):  #1D coordinate variables
-            var_class.append(self.rootgrpID.createVariable(rec_vars[i+5], rec_var_type[i+5], self.dim_vars))
+            var_class.append(self.rootgrpID.createVariable(rec_vars[i+5], rec_var_type[i+5], self.dim_vars,
+                             **profile_var_options(self.nc_format, (1, self.data.shape[0], 1, 1))))
 
         ### add variable attributes
         for i, v in enumerate(var_class): #4dimensional for all vars
@@ -251,6 +282,7 @@ class CTD_NC(object):
             
         self.var_class = var_class
         self.rec_vars = rec_vars
+        self.data_columns = data_columns
 
         
     def add_coord_data(self, pressure_var='prDM', latitude=None, longitude=None, time1=None, time2=None, CastLog=False):
@@ -271,25 +303,17 @@ class CTD_NC(object):
             self.var_class[4][:] = -1 * longitude #PMEL standard direction W is +
 
     def add_data(self):
-        """ """
-        ekcl = ekc.EpicKeyCodes()
-        for k in self.data.columns.values:
-            try:
-                kname = self.epicvars[k]
-                if kname is None: #dave K designated variables which aren't in epic.key of form -4084 for key 84
-                    kname = ekcl.epic_dic_call( self.sbe2epic[k][-2:] )
-                    temp = ('_'.join((kname[0].strip().strip('\\'),  self.sbe2epic[k].split('-')[-1]))) 
-
-                elif (kname[0].strip().lower()) is not '': #no variables without Epic Keys
-                    temp = ('_'.join((kname[0].strip().strip('\\'), self.sbe2epic[k])))
-
-                else:
-                    continue
-            except:
-                continue
+        """
+        Write all EPIC data variables.  The columns mapped in variable_init are
+        converted to one contiguous float32 block and each variable is written
+        once from its row of the block.
+        """
+        if not self.data_columns:
+            return
 
-            di = self.rec_vars.index(temp)
-            self.var_class[di][:] = self.data[k].values
+        block = np.ascontiguousarray(self.data[self.data_columns].values.T, dtype=np.float32)
+        for di, values in enumerate(block):
+            self.var_class[di + 5][:] = values
             
         
     def add_history(self, new_history):
@@ -330,14 +354,18 @@ class CTD_IPHC(object):
     
     nc_format = 'NETCDF3_CLASSIC'
     nc_read   = 'w'
-    def __init__(self, savefile='ncfiles/test.nc', data=None):
-        """data is a pandas dataframe"""
+    def __init__(self, savefile='ncfiles/test.nc', data=None, nc_format=None):
+        """data is a pandas dataframe
+        nc_format is one of OUTPUT_PROFILES, defaults to the class nc_format"""
         
         self.data = data
         self.savefile = savefile
+        self.nc_format = nc_format or self.__class__.nc_format
+        if self.nc_format not in OUTPUT_PROFILES:
+            raise ValueError("nc_format must be one of %s" % ', '.join(sorted(OUTPUT_PROFILES)))
     
     def file_create(self):
-            rootgrpID = Dataset(self.savefile, CTD_IPHC.nc_read, format=CTD_IPHC.nc_format)
+            rootgrpID = Dataset(self.savefile, CTD_IPHC.nc_read, format=self.nc_format)
             self.rootgrpID = rootgrpID
             return ( rootgrpID )
         
@@ -431,27 +459,26 @@ class CTD_IPHC(object):
         Usage:
         ------
         
-        from EPICnetCDF import SBE_Epiclibrary
         from EPICnetCDF import epic_key_codes as ekc 
         
-        ekcl = ekc.EpicKeyCodes()
+        ekc.sbe_epic_table()['sal00']
         
-        ekcl.epic_dic_call(SBE_Epiclibrary.SBE_EPIC['sal00']) 
-        
-        #will return
-        #['S  ', 'SALINITY (PSU)           ', 'sal', 'PSU', ' ', 'Practical Salinity Units']
+        #will return (epic code, epic.key entry, local code)
+        #('41', ['S  ', 'SALINITY (PSU)           ', 'sal', 'PSU', ' ', 'Practical Salinity Units'], False)
         
         DataFrame.columns.values[0]
         """
-        ekcl = ekc.EpicKeyCodes()
+        sbe_epic = ekc.sbe_epic_table() #SBE_EPIC joined with epic.key once per process
         self.epicvars = {}
         self.sbe2epic = {}
+        local_codes = set()
         
         # get list of only epic variables in sbe file
         for pname in self.data.columns.values:
             try:
-                self.epicvars[pname] = ekcl.epic_dic_call(SBE_Epiclibrary.SBE_EPIC[pname])
-                self.sbe2epic[pname] = SBE_Epiclibrary.SBE_EPIC[pname]
+                (self.sbe2epic[pname], self.epicvars[pname], local) = sbe_epic[pname]
+                if local:
+                    local_codes.add(pname)
                 print pname
             except KeyError:
                 print "%s is not in the SBE_Epiclibrary and will not be added to the .nc file" % pname
@@ -459,6 +486,7 @@ class CTD_IPHC(object):
         #build record variable attributes
         rec_vars, rec_var_name, rec_var_longname = [], [], []
         rec_var_generic_name, rec_var_FORTRAN, rec_var_units, rec_var_epic = [], [], [], []
+        data_columns = [] # dataframe column written to each of rec_vars[5:]
         
         # for each epic variable, build required metainformation from epic.key file
         # temperatures should always be first
@@ -466,9 +494,8 @@ class CTD_IPHC(object):
 
         for i, k in enumerate(sorted(self.epicvars.keys())):
             kname = self.epicvars[k]
-            if kname is None: #dave K designated variables which aren't in epic.key of form -4084 for key 84
+            if k in local_codes: #dave K designated variables which aren't in epic.key of form -4084 for key 84
                 print "Variables in .cnv file %s using identifier %s" % (k, self.sbe2epic[k].split('_')[-1])
-                kname = ekcl.epic_dic_call( self.sbe2epic[k][-2:] )
                 rec_vars.append('_'.join((kname[0].strip().strip('\\'), self.sbe2epic[k].split('-')[-1])))
             elif (kname[0].strip().lower()) is not '': #no variables without Epic Keys
                 print "Variables in .cnv file %s" % ('_'.join((kname[0].strip().strip('\\'), self.sbe2epic[k])))
@@ -478,7 +505,7 @@ class CTD_IPHC(object):
                 print "No EPICkey. Variables in .cnv file %s -  %s skipped" % (k, self.sbe2epic[k].split('_')[-1])
                 continue
 
-                
+            data_columns.append(k)
             rec_var_name.append( kname[0].strip() )
             rec_var_longname.append( kname[1].strip() )
             rec_var_generic_name.append( kname[2].strip() )
@@ -500,12 +527,14 @@ class CTD_IPHC(object):
         var_class = []
         var_class.append(self.rootgrpID.createVariable(rec_vars[0], rec_var_type[0], self.dim_vars[0]))#time1
         var_class.append(self.rootgrpID.createVariable(rec_vars[1], rec_var_type[1], self.dim_vars[0]))#time2
-        var_class.append(self.rootgrpID.createVariable(rec_vars[2], rec_var_type[2], self.dim_vars[1]))#depth
+        var_class.append(self.rootgrpID.createVariable(rec_vars[2], rec_var_type[2], self.dim_vars[1],
+                         **profile_var_options(self.nc_format, (self.data.shape[0],))))#depth
         var_class.append(self.rootgrpID.createVariable(rec_vars[3], rec_var_type[3], self.dim_vars[2]))#lat
         var_class.append(self.rootgrpID.createVariable(rec_vars[4], rec_var_type[4], self.dim_vars[3]))#lon
         
         for i, v in enumerate(rec_vars[5:]):  #1D coordinate variables
-            var_class.append(self.rootgrpID.createVariable(rec_vars[i+5], rec_var_type[i+5], self.dim_vars))
+            var_class.append(self.rootgrpID.createVariable(rec_vars[i+5], rec_var_type[i+5], self.dim_vars,
+                             **profile_var_options(self.nc_format, (1, self.data.shape[0], 1, 1))))
 
         ### add variable attributes
         for i, v in enumerate(var_class): #4dimensional for all vars
@@ -522,6 +551,7 @@ class CTD_IPHC(object):
             
         self.var_class = var_class
         self.rec_vars = rec_vars
+        self.data_columns = data_columns
 
         
     def add_coord_data(self, pressure_var='prDM', latitude=None, longitude=None, time1=None, time2=None, CastLog=False):
@@ -538,25 +568,17 @@ class CTD_IPHC(object):
             self.var_class[4][:] = -1 * longitude #PMEL standard direction W is +
 
     def add_data(self):
-        """ """
-        ekcl = ekc.EpicKeyCodes()
-        for k in self.data.columns.values:
-            try:
-                kname = self.epicvars[k]
-                if kname is None: #dave K designated variables which aren't in epic.key of form -4084 for key 84
-                    kname = ekcl.epic_dic_call( self.sbe2epic[k][-2:] )
-                    temp = ('_'.join((kname[0].strip().strip('\\'),  self.sbe2epic[k].split('-')[-1]))) 
-
-                elif (kname[0].strip().lower()) is not '': #no variables without Epic Keys
-                    temp = ('_'.join((kname[0].strip().strip('\\'), self.sbe2epic[k])))
-
-                else:
-                    continue
-            except:
-                continue
+        """
+        Write all EPIC data variables.  The columns mapped in variable_init are
+        converted to one contiguous float32 block and each variable is written
+        once from its row of the block.
+        """
+        if not self.data_columns:
+            return
 
-            di = self.rec_vars.index(temp)
-            self.var_class[di][:] = self.data[k].values
+        block = np.ascontiguousarray(self.data[self.data_columns].values.T, dtype=np.float32)
+        for di, values in enumerate(block):
+            self.var_class[di + 5][:] = values
             
         
     def add_history(self, new_history):
@@ -601,14 +623,18 @@ class CF_CTD_NC(object):
     
     nc_format = 'NETCDF3_CLASSIC'
     nc_read   = 'w'
-    def __init__(self, savefile='ncfiles/test.nc', data=None):
-        """data is a pandas dataframe"""
+    def __init__(self, savefile='ncfiles/test.nc', data=None, nc_format=None):
+        """data is a pandas dataframe
+        nc_format is one of OUTPUT_PROFILES, defaults to the class nc_format"""
         
         self.data = data
         self.savefile = savefile
+        self.nc_format = nc_format or self.__class__.nc_format
+        if self.nc_format not in OUTPUT_PROFILES:
+            raise ValueError("nc_format must be one of %s" % ', '.join(sorted(OUTPUT_PROFILES)))
     
     def file_create(self):
-            rootgrpID = Dataset(self.savefile, CTD_NC.nc_read, format=CTD_NC.nc_format)
+            rootgrpID = Dataset(self.savefile, CTD_NC.nc_read, format=self.nc_format)
             self.rootgrpID = rootgrpID
             return ( rootgrpID )
         
@@ -692,27 +718,26 @@ class CF_CTD_NC(object):
         Usage:
         ------
         
-        from EPICnetCDF import SBE_Epiclibrary
         from EPICnetCDF import epic_key_codes as ekc 
         
-        ekcl = ekc.EpicKeyCodes()
-        
-        ekcl.epic_dic_call(SBE_Epiclibrary.SBE_EPIC['sal00']) 
+        ekc.sbe_epic_table()['sal00']
         
-        #will return
-        #['S  ', 'SALINITY (PSU)           ', 'sal', 'PSU', ' ', 'Practical Salinity Units']
+        #will return (epic code, epic.key entry, local code)
+        #('41', ['S  ', 'SALINITY (PSU)           ', 'sal', 'PSU', ' ', 'Practical Salinity Units'], False)
         
         DataFrame.columns.values[0]
         """
-        ekcl = ekc.EpicKeyCodes()
+        sbe_epic = ekc.sbe_epic_table() #SBE_EPIC joined with epic.key once per process
         self.epicvars = {}
         self.sbe2epic = {}
+        local_codes = set()
         
         # get list of only epic variables in sbe file
         for pname in self.data.columns.values:
             try:
-                self.epicvars[pname] = ekcl.epic_dic_call(SBE_Epiclibrary.SBE_EPIC[pname])
-                self.sbe2epic[pname] = SBE_Epiclibrary.SBE_EPIC[pname]
+                (self.sbe2epic[pname], self.epicvars[pname], local) = sbe_epic[pname]
+                if local:
+                    local_codes.add(pname)
             except KeyError:
                 print "%s is not in the SBE_Epiclibrary and will not be added to the .nc file" % pname
         
@@ -723,9 +748,8 @@ class CF_CTD_NC(object):
         # for each epic variable, build required metainformation from epic.key file
         for i, k in enumerate(self.epicvars.keys()):
             kname = self.epicvars[k]
-            if kname is None: # variables not in epic.key but given epic like codes
-                              # these are often secondary instruments
-                kname = ekcl.epic_dic_call(self.sbe2epic[k][-2:])
+            if k in local_codes: # variables not in epic.key but given epic like codes
+                                 # these are often secondary instruments
                 print "Variables in .cnv file %s listed as secondary" % ( k )
                 rec_vars.append( k.replace('/','per') )
                 rec_var_name.append( kname[0].strip() )
@@ -757,12 +781,14 @@ class CF_CTD_NC(object):
         
         var_class = []
         var_class.append(self.rootgrpID.createVariable(rec_vars[0], rec_var_type[0], self.dim_vars[0]))#time1
-        var_class.append(self.rootgrpID.createVariable(rec_vars[1], rec_var_type[1], self.dim_vars[1]))#depth
+        var_class.append(self.rootgrpID.createVariable(rec_vars[1], rec_var_type[1], self.dim_vars[1],
+                         **profile_var_options(self.nc_format, (self.data.shape[0],))))#depth
         var_class.append(self.rootgrpID.createVariable(rec_vars[2], rec_var_type[2], self.dim_vars[2]))#lat
         var_class.append(self.rootgrpID.createVariable(rec_vars[3], rec_var_type[3], self.dim_vars[3]))#lon
         
         for i, v in enumerate(rec_vars[4:]):  #1D coordinate variables
-            var_class.append(self.rootgrpID.createVariable(rec_vars[i+4], rec_var_type[i+4], self.dim_vars))
+            var_class.append(self.rootgrpID.createVariable(rec_vars[i+4], rec_var_type[i+4], self.dim_vars,
+                             **profile_var_options(self.nc_format, (1, self.data.shape[0], 1, 1))))
 
         ### add variable attributes
         for i, v in enumerate(var_class): #4dimensional for all vars
@@ -806,3 +832,179 @@ class CF_CTD_NC(object):
     def close(self):
         self.rootgrpID.close()
     
+"""-----------------------------Cruise Aggregate (CF ragged)---------------------------"""
+
+class CTD_Cruise_NC(object):
+    """
+    Class instance to generate one NetCDF file holding every cast of a cruise.
+
+    Standards
+    ---------
+    CF V1.6 Discrete Sampling Geometries - contiguous ragged array of profiles
+    Variable names and attributes are those of the EPIC files written by CTD_NC
+
+    Casts are appended one after another along the 'obs' dimension.  The cast index
+    (cast ID, row_offset, row_size, time, time2, lat, lon) is stored along the
+    'profile' dimension so a whole cruise section can be read sequentially and a
+    single cast read with one slice.  Variables first seen in a later cast are
+    missing (1e35) for the casts before it.
+
+    Usage
+    -----
+        ncinstance = CTD_Cruise_NC(savefile='ncfiles/dy1309_cruise.nc', cruise='dy1309')
+        ncinstance.file_create()      # or ncinstance.file_open() to append
+        ncinstance.add_epic_file('ncfiles/dy1309/dy1309c001_ctd.nc')
+        ncinstance.add_cast(...)
+        ncinstance.close()
+    """
+
+    nc_format = 'NETCDF4' # two unlimited dimensions
+    missing_value = 1e35
+    index_vars = ['cast', 'row_offset', 'row_size', 'time', 'time2', 'lat', 'lon']
+
+    def __init__(self, savefile='ncfiles/cruise.nc', cruise=''):
+        self.savefile = savefile
+        self.cruise = cruise
+
+    def file_create(self):
+        rootgrpID = Dataset(self.savefile, 'w', format=CTD_Cruise_NC.nc_format)
+        rootgrpID.CREATION_DATE = datetime.datetime.utcnow().strftime("%B %d, %Y %H:%M UTC")
+        rootgrpID.CRUISE = self.cruise
+        rootgrpID.DATA_TYPE = 'CTD'
+        rootgrpID.featureType = 'profile'
+        rootgrpID.Conventions = 'CF-1.6'
+        rootgrpID.EPIC_FILE_GENERATOR = 'ncprossessing.py V' + __version__
+
+        rootgrpID.createDimension('profile', None)
+        rootgrpID.createDimension('obs', None)
+
+        cast = rootgrpID.createVariable('cast', str, ('profile',))
+        cast.long_name = 'cast identifier'
+        cast.cf_role = 'profile_id'
+        row_offset = rootgrpID.createVariable('row_offset', 'i4', ('profile',))
+        row_offset.long_name = 'index of the first observation of the cast'
+        row_size = rootgrpID.createVariable('row_size', 'i4', ('profile',))
+        row_size.long_name = 'number of observations for this cast'
+        row_size.sample_dimension = 'obs'
+        for name, vtype, units, epic_code in [('time', 'i4', 'True Julian Day', 624),
+                                              ('time2', 'i4', 'msec since 0:00 GMT', 624),
+                                              ('lat', 'f4', 'degree_north', 500),
+                                              ('lon', 'f4', 'degree_west', 501)]:
+            v = rootgrpID.createVariable(name, vtype, ('profile',))
+            v.units = units
+            v.type = 'EVEN'
+            v.epic_code = epic_code
+
+        self.rootgrpID = rootgrpID
+        return ( rootgrpID )
+
+    def file_open(self):
+        rootgrpID = Dataset(self.savefile, 'a')
+        self.rootgrpID = rootgrpID
+        return ( rootgrpID )
+
+    def cast_index(self):
+        """
+        Returns
+        -------
+        Outputs : dict
+                  cast index variable name -> array (one entry per cast)
+        """
+        return dict((name, self.rootgrpID.variables[name][:])
+                    for name in CTD_Cruise_NC.index_vars)
+
+    def add_cast(self, cast_id, data, time1=None, time2=None, latitude=None,
+                 longitude=None, var_atts=None):
+        """
+        Append one cast.
+
+        Parameters
+        ----------
+        data : dict
+            variable name -> 1D array along depth, must include 'dep'
+        latitude, longitude :
+            PMEL convention (degrees west positive) as stored in the EPIC files
+        var_atts : dict
+            variable name -> dict of attributes, used when a variable is created
+
+        Returns False (and writes nothing) if cast_id is already in the file
+        """
+        var_atts = var_atts or {}
+        variables = self.rootgrpID.variables
+        nprofile = len(self.rootgrpID.dimensions['profile'])
+        if nprofile and cast_id in list(variables['cast'][:]):
+            print "%s is already in %s and will not be added" % (cast_id, self.savefile)
+            return False
+
+        offset = len(self.rootgrpID.dimensions['obs'])
+        nobs = len(data['dep'])
+
+        for name in ['dep'] + sorted(k for k in data if k != 'dep'):
+            if name not in variables:
+                v = self.rootgrpID.createVariable(name, 'f4', ('obs',),
+                                                  fill_value=CTD_Cruise_NC.missing_value)
+                for att, value in sorted(var_atts.get(name, {}).items()):
+                    if att != '_FillValue':
+                        v.setncattr(att, value)
+            variables[name][offset:offset + nobs] = data[name]
+
+        variables['cast'][nprofile] = cast_id
+        variables['row_offset'][nprofile] = offset
+        variables['row_size'][nprofile] = nobs
+        variables['time'][nprofile] = time1
+        variables['time2'][nprofile] = time2
+        variables['lat'][nprofile] = latitude
+        variables['lon'][nprofile] = longitude
+        return True
+
+    def add_epic_file(self, ncfile, cast_id=None):
+        """
+        Append the cast in an EPIC file written by CTD_NC.  cast_id defaults to the
+        file name without extension, an empty CRUISE attribute is taken from the file.
+        """
+        if cast_id is None:
+            cast_id = os.path.splitext(os.path.basename(ncfile))[0]
+
+        ncdata = Dataset(ncfile, 'r')
+        if not self.rootgrpID.CRUISE and 'CRUISE' in ncdata.ncattrs():
+            self.rootgrpID.CRUISE = ncdata.CRUISE
+        data, var_atts = {}, {}
+        for name, v in ncdata.variables.items():
+            if name in ('time', 'time2', 'lat', 'lon'):
+                continue
+            if v.ndim == 4:
+                data[name] = v[0, :, 0, 0]
+            elif name == 'dep':
+                data[name] = v[:]
+            else:
+                continue
+            var_atts[name] = dict((att, v.getncattr(att)) for att in v.ncattrs())
+
+        added = self.add_cast(cast_id, data,
+                              time1=ncdata.variables['time'][0],
+                              time2=ncdata.variables['time2'][0],
+                              latitude=ncdata.variables['lat'][0],
+                              longitude=ncdata.variables['lon'][0],
+                              var_atts=var_atts)
+        ncdata.close()
+        return added
+
+    def get_cast(self, cast_id, variables=None):
+        """
+        Returns
+        -------
+        Outputs : dict
+                  variable name -> 1D array for one cast (all obs variables by default)
+        """
+        index = self.cast_index()
+        p = list(index['cast']).index(cast_id)
+        start = index['row_offset'][p]
+        stop = start + index['row_size'][p]
+        if variables is None:
+            variables = [name for name, v in self.rootgrpID.variables.items()
+                         if v.dimensions == ('obs',)]
+        return dict((name, self.rootgrpID.variables[name][start:stop]) for name in variables)
+
+    def close(self):
+        self.rootgrpID.close()
+
@@ -12,26 +12,171 @@ Usage
 -----
 import EpicKeyCodes as ekc
 class instance -- keys = ekc.EpicKeyCodes()
+shared table   -- keys = ekc.epic_key_table()
 
 requires epic.key (csv file) in same directory as this program and
 will generate a pickle file in the directory this routine is located in
 
+epic_key_table() is loaded once per process (from a versioned cache, epic_key.cache,
+which is rebuilt whenever epic.key changes) and shared by every caller.
+
 """
 
 # Standard Packages
 import os, sys, csv
 import datetime
 import pickle
+import threading
 
 __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2013, 12, 18)
 __modified__ = datetime.datetime(2014, 01, 22)
-__version__  = "0.1.0"
+__version__  = "0.2.0"
 __status__   = "Development"
 
 
 """------------------------------------------------------------------------------------"""
+
+# bump when the layout of the cache file changes
+CACHE_VERSION = 1
+
+_table_lock = threading.Lock()
+_epic_key_table = None
+_sbe_epic_table = None
+
+
+class EpicKeyTable(object):
+    """
+    Read-only epic.key lookup table.
+
+    Entries are tuples of the colon separated fields following the key code
+    (e.g. ('T  ', 'TEMPERATURE (C)          ', 'temp', 'C', 'f10.2 ', 'ITS-1990 Standard'))
+    """
+    __slots__ = ('_keys',)
+
+    def __init__(self, keys):
+        object.__setattr__(self, '_keys', dict((k, tuple(v)) for k, v in keys.items()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("EpicKeyTable is read-only")
+
+    def __getitem__(self, code):
+        return self._keys[code]
+
+    def __contains__(self, code):
+        return code in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def get(self, code, default=None):
+        return self._keys.get(code, default)
+
+    def keys(self):
+        return self._keys.keys()
+
+    def items(self):
+        return self._keys.items()
+
+    def epic_dic_call(self, code='42'):
+        """same as EpicKeyCodes.epic_dic_call"""
+        return self._keys.get(code)
+
+
+def read_epic_key(epic_text):
+    """parse epic.key into a dictionary of key code -> list of fields"""
+    d = {}
+    with open(epic_text, 'rb') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=':')
+        for row in csv_reader:
+            d[row[0].strip()] = row[1:]
+    return d
+
+
+def load_epic_keys(epic_text=None, cache_file=None):
+    """
+    Load epic.key through a versioned pickle cache.
+
+    The cache records CACHE_VERSION and the size and mtime of epic.key and is
+    rebuilt if any of them differ.  A cache that can not be written (read only
+    install) is not an error, the table is just parsed from epic.key.
+
+    Returns
+    -------
+    Outputs : EpicKeyTable
+    """
+    dir_path = os.path.dirname(os.path.abspath(__file__))
+    if epic_text is None:
+        epic_text = os.path.join(dir_path, 'epic.key')
+    if cache_file is None:
+        cache_file = os.path.join(dir_path, 'epic_key.cache')
+
+    stat = os.stat(epic_text)
+    source = (stat.st_size, stat.st_mtime)
+
+    try:
+        with open(cache_file, 'rb') as fhandle:
+            cached = pickle.load(fhandle)
+        if cached['version'] == CACHE_VERSION and cached['source'] == source:
+            return EpicKeyTable(cached['keys'])
+    except Exception:
+        pass
+
+    keys = read_epic_key(epic_text)
+    try:
+        with open(cache_file, 'wb') as fhandle:
+            pickle.dump({'version': CACHE_VERSION, 'source': source, 'keys': keys},
+                        fhandle, pickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        pass
+
+    return EpicKeyTable(keys)
+
+
+def epic_key_table():
+    """process wide epic.key table, loaded on first use"""
+    global _epic_key_table
+    if _epic_key_table is None:
+        with _table_lock:
+            if _epic_key_table is None:
+                _epic_key_table = load_epic_keys()
+    return _epic_key_table
+
+
+def sbe_epic_table():
+    """
+    SBE_Epiclibrary.SBE_EPIC joined with epic.key, built once per process.
+
+    Returns
+    -------
+    Outputs : dict
+              sbe variable name -> (epic code, epic.key entry, local)
+
+              local is True for codes not found in epic.key (eg. '-4084'), whose
+              meta information is taken from the last two digits of the code as
+              done by the ncprocessing writers.  The entry is None if neither lookup
+              succeeds.
+    """
+    global _sbe_epic_table
+    if _sbe_epic_table is None:
+        from OnCruiseRoutines.EPICNetCDF import SBE_Epiclibrary
+
+        keys = epic_key_table()
+        table = {}
+        for pname, code in SBE_Epiclibrary.SBE_EPIC.items():
+            kname = keys.get(code)
+            if kname is None:
+                table[pname] = (code, keys.get(code[-2:]), True)
+            else:
+                table[pname] = (code, kname, False)
+        _sbe_epic_table = table
+    return _sbe_epic_table
+
+
 class EpicKeyCodes(object):
     """    
     Uses:
@@ -64,9 +209,15 @@ class EpicKeyCodes(object):
         Purpose
         --------
         Will generate a pickle file from local epic.key file in folder
+
+        With the default pickle the shared, cached epic_key_table() is used
         
         """
         self.epickey_pickle = epickey_pickle
+
+        if epickey_pickle == '/epic_key.p':
+            self.epic_keys = epic_key_table()
+            return
         
         path = os.path.abspath(__file__)
         dir_path = os.path.dirname(path)
@@ -0,0 +1,305 @@
+#!/usr/bin/env
+
+"""
+ bench_pipeline.py
+
+ Seabird CNV only
+
+ Purpose:
+ --------
+ Time the CNV -> EPIC NetCDF pipeline stage by stage on synthetic casts
+ (see synthetic_cnv.py) and report throughput in scans/s and MB/s and the peak
+ memory of each stage: the resident memory high water mark is reset before the
+ stage (/proc/self/clear_refs) and the peak above the memory resident at its
+ start is read back from /proc/self/status (VmHWM).  That needs linux 4.0 or
+ later, elsewhere the peak is not reported.  data_processing with --workers > 1
+ only counts this process, not the worker processes.
+
+ Stages for a single cast:
+    read_cnv       header scan and data block decode (ctd._read_cnv_header/_read_cnv_body)
+    interp2sfc     surface extrapolation of the decoded cast
+    from_cnv       the complete ctd.from_cnv
+    nc_setup       CTD_NC file_create, global attributes and dimensions
+    variable_init  CTD_NC.variable_init
+    add_data       CTD_NC.add_data
+    nc_close       CTD_NC.add_coord_data and close
+ and for a cruise of casts:
+    data_processing  CTD2NC.data_processing (IPHC_data_processing) end to end
+
+ Each single cast stage is run --repeat times and the fastest run (and the
+ largest peak) is reported.
+ MB/s is relative to the .cnv size for the read stages and to the NetCDF file size
+ for the write stages.
+
+ Usage:
+ ------
+ python -m OnCruiseRoutines.benchmarks.bench_pipeline --scans 50000 --casts 20
+ python -m OnCruiseRoutines.benchmarks.bench_pipeline --json today.json --compare baseline.json
+
+ With --compare the run exits with status 1 if any stage is slower than the
+ baseline by more than --tolerance (fraction, default 0.25).
+
+
+"""
+# System Packages
+import datetime, os, sys, time, json, shutil, tempfile
+
+# Science Stack
+from pandas import DataFrame
+
+# User Packages
+import OnCruiseRoutines.CTD2NC as CTD2NC
+from OnCruiseRoutines.CTD_Vis import ctd
+from OnCruiseRoutines.CTD_Vis import ncprocessing
+from OnCruiseRoutines.benchmarks import synthetic_cnv
+
+__author__ = "Shaun Bell"
+__email__ = "shaun.bell@noaa.gov"
+__created__ = datetime.datetime(2014, 10, 20)
+__modified__ = datetime.datetime(2014, 10, 20)
+__version__ = "0.1.0"
+__status__ = "Development"
+
+
+"""-------------------------------Measurement------------------------------------------"""
+
+def _status_kb(field):
+    """VmRSS/VmHWM of /proc/self/status in kB"""
+    with open('/proc/self/status', 'r') as fhandle:
+        for line in fhandle:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise IOError('no {0} in /proc/self/status'.format(field))
+
+def reset_peak_memory():
+    """
+    Reset the resident memory high water mark (VmHWM) of this process to the
+    current resident memory and return that in kB, None where it can not be
+    reset (no /proc or linux before 4.0)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as fhandle:
+            fhandle.write('5')
+        return _status_kb('VmRSS')
+    except (IOError, OSError):
+        return None
+
+def peak_memory_mb(start_kb):
+    """Peak resident memory since reset_peak_memory above start_kb in MB (None without a reset)"""
+    if start_kb is None:
+        return None
+    try:
+        return max(_status_kb('VmHWM') - start_kb, 0) / 1024.
+    except (IOError, OSError):
+        return None
+
+def run_stage(func):
+    """Wall time, peak memory of the call in MB (peak_memory_mb) and result of func()"""
+    start_kb = reset_peak_memory()
+    start = time.time()
+    result = func()
+    elapsed = time.time() - start
+    return elapsed, peak_memory_mb(start_kb), result
+
+def _max_peak(peak, other):
+    if peak is None:
+        return other
+    if other is None:
+        return peak
+    return max(peak, other)
+
+def best_time(func, repeat=3):
+    """Fastest wall time and largest peak memory of repeat calls to func, and the result of the last call"""
+    best, peak = None, None
+    for run in range(repeat):
+        elapsed, run_peak, result = run_stage(func)
+        if best is None or elapsed < best:
+            best = elapsed
+        peak = _max_peak(peak, run_peak)
+    return best, peak, result
+
+def stage_result(stage, seconds, peak, nscans, nbytes):
+    return {
+        'stage': stage,
+        'seconds': seconds,
+        'scans_per_s': nscans / seconds if seconds else float('inf'),
+        'MB_per_s': nbytes / 1e6 / seconds if seconds else float('inf'),
+        'peak_MB': peak,
+    }
+
+
+"""-------------------------------Benchmarks-------------------------------------------"""
+
+def _read_raw(fname):
+    with open(fname, 'rb') as fhandle:
+        meta = ctd._read_cnv_header(fhandle)
+        data = ctd._read_cnv_body(fhandle, len(meta['names']), nscans=meta['nvalues'])
+    return DataFrame(data, columns=meta['names'])
+
+def _write_nc(cast, savefile, pressure_varname, nc_format):
+    """
+    CTD_NC sequence of CTD2NC.convert_cast split into stages, {stage: (seconds, peak MB)}
+    """
+    timeclass = ctd.DataTimes(time_str=cast.time_str)
+    ncinstance = ncprocessing.CTD_NC(savefile=savefile, data=cast, nc_format=nc_format)
+
+    def nc_setup():
+        ncinstance.file_create()
+        ncinstance.sbeglobal_atts()
+        ncinstance.PMELglobal_atts(sfc_extend="Extrapolated to SFC from " + str(cast.SFC_EXTEND) + "m")
+        ncinstance.dimension_init()
+
+    def nc_close():
+        ncinstance.add_coord_data(pressure_var=pressure_varname,
+                                  time1=timeclass.get_EPIC_date()[0],
+                                  time2=timeclass.get_EPIC_date()[1])
+        ncinstance.close()
+
+    stages = {}
+    for stage, func in (('nc_setup', nc_setup), ('variable_init', ncinstance.variable_init),
+                        ('add_data', ncinstance.add_data), ('nc_close', nc_close)):
+        stages[stage] = run_stage(func)[:2]
+    return stages
+
+def bench_cast(fname, work_dir, pressure_varname='prDM', nc_format='NETCDF3_CLASSIC', repeat=3):
+    """Stage results for one .cnv file, NetCDF output is written into work_dir"""
+    cnv_bytes = os.path.getsize(fname)
+    results = []
+
+    seconds, peak, raw = best_time(lambda: _read_raw(fname), repeat)
+    nscans = raw.shape[0]
+    results.append(stage_result('read_cnv', seconds, peak, nscans, cnv_bytes))
+
+    seconds, peak, _ = best_time(lambda: ctd.interp2sfc(raw.copy(), pressure_key=pressure_varname), repeat)
+    results.append(stage_result('interp2sfc', seconds, peak, nscans, cnv_bytes))
+
+    seconds, peak, cast = best_time(lambda: ctd.from_cnv(fname, pressure_varname=pressure_varname), repeat)
+    results.append(stage_result('from_cnv', seconds, peak, nscans, cnv_bytes))
+
+    savefile = os.path.join(work_dir, 'bench_ctd.nc')
+    best, peaks = {}, {}
+    for run in range(repeat):
+        for stage, (seconds, peak) in _write_nc(cast, savefile, pressure_varname, nc_format).items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+            peaks[stage] = _max_peak(peaks.get(stage), peak)
+    nc_bytes = os.path.getsize(savefile)
+    for stage in ('nc_setup', 'variable_init', 'add_data', 'nc_close'):
+        results.append(stage_result(stage, best[stage], peaks[stage], cast.shape[0], nc_bytes))
+
+    return results
+
+def bench_cruise(cnv_dir, work_dir, ncasts, nscans, workers=1, nc_format='NETCDF3_CLASSIC',
+                 IPHC=False):
+    """Stage result for CTD2NC.data_processing (or IPHC_data_processing) over all casts in cnv_dir"""
+    cnv_bytes = sum(os.path.getsize(os.path.join(cnv_dir, fi)) for fi in os.listdir(cnv_dir))
+    user_out = os.path.join(work_dir, 'nc') + '/'
+    processing = CTD2NC.IPHC_data_processing if IPHC else CTD2NC.data_processing
+
+    seconds, peak, _ = run_stage(lambda: processing(cnv_dir, user_out, workers=workers, nc_format=nc_format))
+
+    return stage_result('data_processing', seconds, peak, ncasts * nscans, cnv_bytes)
+
+def run(nscans=10000, ncasts=10, channels=None, header='nmea', repeat=3, workers=1,
+        nc_format='NETCDF3_CLASSIC', work_dir=None):
+    """
+    Generate synthetic casts and run all stages
+
+    Returns
+    -------
+    Outputs : dict
+              settings of the run and a list of stage results
+    """
+    cleanup = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='ctd_bench_')
+    pressure_varname = 'prdM' if header == 'iphc' else 'prDM'
+    channels = synthetic_cnv.channel_set(channels, header)
+
+    try:
+        cnv_dir = os.path.join(work_dir, 'cnv')
+        files = synthetic_cnv.write_cruise(cnv_dir, ncasts=ncasts, nscans=nscans,
+                                           channels=channels, header=header)
+        # single cast stages use CTD_NC for every header type, CTD_IPHC only differs
+        # in its global attributes
+        results = bench_cast(files[0], work_dir, pressure_varname, nc_format, repeat)
+        results.append(bench_cruise(cnv_dir, work_dir, ncasts, nscans, workers, nc_format,
+                                    IPHC=(header == 'iphc')))
+    finally:
+        if cleanup:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    settings = {'nscans': nscans, 'ncasts': ncasts, 'nchannels': len(channels),
+                'header': header, 'repeat': repeat, 'workers': workers,
+                'nc_format': nc_format, 'version': CTD2NC.CONVERTER_VERSION}
+    return {'settings': settings, 'results': results}
+
+
+"""-------------------------------Reporting--------------------------------------------"""
+
+def report(run_results):
+    print "\n{0:<16}{1:>10}{2:>14}{3:>10}{4:>10}".format(
+        'stage', 'seconds', 'scans/s', 'MB/s', 'peak MB')
+    for result in run_results['results']:
+        print "{stage:<16}{seconds:>10.4f}{scans_per_s:>14.0f}{MB_per_s:>10.2f}{peak:>10}".format(
+            peak=('%.1f' % result['peak_MB']) if result['peak_MB'] is not None else '-',
+            **result)
+
+def compare(run_results, baseline, tolerance=0.25):
+    """
+    Stages slower than the baseline by more than tolerance (fraction)
+
+    Returns a list of (stage, seconds, baseline seconds)
+    """
+    base = dict((result['stage'], result['seconds']) for result in baseline['results'])
+    slower = []
+    for result in run_results['results']:
+        if result['stage'] in base and result['seconds'] > base[result['stage']] * (1. + tolerance):
+            slower.append((result['stage'], result['seconds'], base[result['stage']]))
+    return slower
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the CNV -> EPIC NetCDF pipeline")
+    parser.add_argument("-s", "--scans", type=int, default=10000, help="scans per cast")
+    parser.add_argument("-n", "--casts", type=int, default=10, help="casts for data_processing")
+    parser.add_argument("--channels", type=str, default=None,
+                        help="'all' or comma separated SBE names (default: typical cast)")
+    parser.add_argument("--header", type=str, default="nmea", choices=synthetic_cnv.HEADER_TYPES)
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per stage (best is kept)")
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parser.add_argument("-f", "--format", type=str, default="NETCDF3_CLASSIC",
+                        choices=sorted(ncprocessing.OUTPUT_PROFILES))
+    parser.add_argument("--work_dir", type=str, help="keep the synthetic files here")
+    parser.add_argument("--json", type=str, help="save results as json")
+    parser.add_argument("--compare", type=str, help="baseline json from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    channels = args.channels
+    if channels is not None and channels != 'all':
+        channels = [name.strip() for name in channels.split(',')]
+
+    run_results = run(nscans=args.scans, ncasts=args.casts, channels=channels,
+                      header=args.header, repeat=args.repeat, workers=args.workers,
+                      nc_format=args.format, work_dir=args.work_dir)
+    report(run_results)
+
+    if args.json:
+        with open(args.json, 'w') as fhandle:
+            json.dump(run_results, fhandle, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as fhandle:
+            baseline = json.load(fhandle)
+        slower = compare(run_results, baseline, args.tolerance)
+        for stage, seconds, base in slower:
+            print "REGRESSION: {0} {1:.4f}s (baseline {2:.4f}s)".format(stage, seconds, base)
+        if slower:
+            sys.exit(1)
+        print "No stage slower than baseline by more than {0:.0%}".format(args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
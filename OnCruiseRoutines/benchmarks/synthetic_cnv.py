@@ -0,0 +1,201 @@
+#!/usr/bin/env
+
+"""
+ synthetic_cnv.py
+
+ Seabird CNV only
+
+ Purpose:
+ --------
+ Write synthetic Seasoft .cnv files for benchmarking the CNV -> EPIC NetCDF
+ pipeline.  Scan count, channel set and header flavour (NMEA, System UTC only,
+ IPHC '**' lines) are configurable.  Data are fixed 11 character fields like
+ Seasoft output, pressure starts below the surface so interp2sfc has work to do.
+
+ Usage:
+ ------
+ from OnCruiseRoutines.benchmarks import synthetic_cnv
+ synthetic_cnv.write_cnv('/tmp/bench/ctd001.cnv', nscans=20000)
+ synthetic_cnv.write_cruise('/tmp/bench/', ncasts=50, nscans=2000, header='iphc')
+
+
+"""
+# System Packages
+import datetime, os
+
+# Science Stack
+import numpy as np
+
+# User Packages
+from OnCruiseRoutines.EPICNetCDF import SBE_Epiclibrary
+
+__author__ = "Shaun Bell"
+__email__ = "shaun.bell@noaa.gov"
+__created__ = datetime.datetime(2014, 10, 20)
+__modified__ = datetime.datetime(2014, 10, 20)
+__version__ = "0.1.0"
+__status__ = "Development"
+
+# channels of a typical SBE 9/11 cast (DY1309 ctd001.cnv)
+DEFAULT_CHANNELS = ['prDM', 'depSM', 't090C', 'c0mS/cm', 't190C', 'c1mS/cm', 'wetStar',
+                    'par', 'sbeox0V', 'sbeox1V', 'v0', 'v6', 'sal00', 'sal11', 'sigma-t00',
+                    'sbeox0Mm/Kg', 'sbeox1Mm/Kg', 'sbeox0PS', 'flag']
+
+# channels of a typical IPHC SBE 19plusV2 cast
+IPHC_CHANNELS = ['prdM', 'depSM', 't090C', 'c0S/cm', 'sal00', 'sbeox0ML/L',
+                 'flECO-AFL', 'par', 'flag']
+
+HEADER_TYPES = ('nmea', 'system', 'iphc')
+
+# (value at surface, change per dbar, noise) by name prefix -- anything else is 0. +/- 1.
+CHANNEL_PROFILES = {
+    't0': (8.5, -0.01, 0.01), 't1': (8.5, -0.01, 0.01),
+    'c0': (33.7, 0.001, 0.01), 'c1': (33.7, 0.001, 0.01),
+    'sa': (31.5, 0.002, 0.005), 'si': (24.4, 0.002, 0.005),
+    'sb': (250., -0.05, 1.), 'wet': (2., -0.01, 0.2), 'par': (500., -5., 1.),
+    'dep': (0., 0.99, 0.), 'flag': (0., 0., 0.),
+}
+
+
+"""-------------------------------Channel Sets-----------------------------------------"""
+
+def epic_channels(pressure='prDM'):
+    """
+    Every SBE_EPIC channel with its own EPIC code (one name per code, so the
+    variables do not collide in the EPIC file), pressure first and 'flag' last.
+    """
+    seen = set([SBE_Epiclibrary.SBE_EPIC[pressure]])
+    channels = [pressure]
+    for name in sorted(SBE_Epiclibrary.SBE_EPIC.keys()):
+        code = SBE_Epiclibrary.SBE_EPIC[name]
+        if code and code not in seen and ' ' not in name:
+            seen.add(code)
+            channels.append(name)
+    return channels + ['flag']
+
+def channel_set(channels=None, header='nmea'):
+    """
+    Resolve a channel argument: None (typical cast for the header type), 'all'
+    (epic_channels) or a list of SBE names which must be in SBE_EPIC.
+    """
+    if channels is None:
+        return list(IPHC_CHANNELS if header == 'iphc' else DEFAULT_CHANNELS)
+    if channels == 'all':
+        return epic_channels('prdM' if header == 'iphc' else 'prDM')
+    unknown = [name for name in channels if name not in SBE_Epiclibrary.SBE_EPIC]
+    if unknown:
+        raise ValueError("Not in SBE_Epiclibrary.SBE_EPIC: %s" % ', '.join(unknown))
+    return list(channels)
+
+
+"""-------------------------------Header-----------------------------------------------"""
+
+def _deg_min(value, pos, neg):
+    hemisphere = pos if value >= 0 else neg
+    value = abs(value)
+    return "%d %05.2f %s" % (int(value), (value - int(value)) * 60., hemisphere)
+
+def cnv_header(channels, spans, header='nmea', cast_time=None, lat=57.0443, lon=-152.8902):
+    """Seasoft style header lines (through *END*) for the given channels"""
+    if header not in HEADER_TYPES:
+        raise ValueError("header must be one of %s, not %r" % (', '.join(HEADER_TYPES), header))
+    if cast_time is None:
+        cast_time = datetime.datetime(2013, 9, 24, 23, 13, 46)
+    time_str = cast_time.strftime('%b %d %Y %H:%M:%S')
+
+    lines = ["* Sea-Bird SBE 9 Data File:",
+             "* FileName = C:\\Sea-Bird Data\\synthetic.hex",
+             "* Software Version Seasave V 7.22.3",
+             "* System UpLoad Time = %s" % time_str]
+    if header == 'nmea':
+        lines += ["* NMEA Latitude = %s" % _deg_min(lat, 'N', 'S'),
+                  "* NMEA Longitude = %s" % _deg_min(lon, 'E', 'W'),
+                  "* NMEA UTC (Time) = %s" % time_str]
+    elif header == 'iphc':
+        lines += ["* <![CDATA[",
+                  "** latitude: %02d%04d" % (int(abs(lat)), round((abs(lat) % 1) * 6000)),
+                  "** longitude: %03d%04d" % (int(abs(lon)), round((abs(lon) % 1) * 6000)),
+                  "** setno: 047", "** stnno: 4195", "** trpno: 04",
+                  "** vslcde: CLD", "** region: GP", "** CSF bottom depth(m): 150",
+                  "* ]]>"]
+    lines += ["* System UTC = %s" % time_str,
+              "# nquan = %d" % len(channels),
+              "# nvalues = %d" % len(spans),
+              "# units = specified"]
+    lines += ["# name %d = %s: synthetic %s" % (i, name, name) for i, name in enumerate(channels)]
+    lines += ["# span %d = %10.4f, %10.4f" % (i, lo, hi) for i, (lo, hi) in enumerate(spans.T)]
+    lines += ["# interval = decibars: 1",
+              "# start_time = %s [NMEA time, header]" % time_str,
+              "# bad_flag = -9.990e-29",
+              "# file_type = ascii",
+              "*END*"]
+    return lines
+
+
+"""-------------------------------Data-------------------------------------------------"""
+
+def _channel_profile(name):
+    for prefix in sorted(CHANNEL_PROFILES, key=len, reverse=True):
+        if name.startswith(prefix):
+            return CHANNEL_PROFILES[prefix]
+    return (0., 0., 1.)
+
+def cast_data(channels, nscans, max_pressure=500., min_pressure=2., seed=None):
+    """(nscans, nchannels) float array of plausible profiles, pressure in column 0"""
+    rand = np.random.RandomState(seed)
+    pres = np.linspace(min_pressure, max_pressure, nscans)
+    data = np.empty((nscans, len(channels)))
+    data[:, 0] = pres
+    for i, name in enumerate(channels[1:], 1):
+        base, slope, noise = _channel_profile(name)
+        data[:, i] = base + slope * pres + noise * rand.standard_normal(nscans)
+    return data
+
+def write_cnv(fname, nscans=10000, channels=None, header='nmea', max_pressure=500.,
+              cast_time=None, seed=None):
+    """
+    Write one synthetic .cnv file
+
+    Parameters
+    ----------
+    nscans : int
+        number of data lines
+    channels : list or str
+        SBE channel names, 'all' or None (see channel_set)
+    header : str
+        'nmea' (NMEA lat/lon/time), 'system' (System UTC only) or 'iphc'
+        ('**' metadata lines, prdM pressure)
+
+    Returns
+    -------
+    Outputs : int
+              size of the file in bytes
+    """
+    channels = channel_set(channels, header)
+    data = cast_data(channels, nscans, max_pressure=max_pressure, seed=seed)
+    spans = np.vstack((data.min(axis=0), data.max(axis=0)))
+
+    path = os.path.dirname(fname)
+    if path and not os.path.exists(path):
+        os.makedirs(path)
+    with open(fname, 'w') as fhandle:
+        fhandle.write('\n'.join(cnv_header(channels, spans, header, cast_time)) + '\n')
+        np.savetxt(fhandle, data, fmt='%11.4f', delimiter='')
+    return os.path.getsize(fname)
+
+def write_cruise(user_out, ncasts=10, nscans=10000, channels=None, header='nmea',
+                 max_pressure=500., seed=0):
+    """
+    Write ncasts synthetic casts (ctd001.cnv ...) into user_out, one hour apart
+
+    Returns the list of files written
+    """
+    start = datetime.datetime(2013, 9, 24, 23, 13, 46)
+    files = []
+    for cast in range(ncasts):
+        fname = os.path.join(user_out, 'ctd%03d.cnv' % (cast + 1))
+        write_cnv(fname, nscans=nscans, channels=channels, header=header,
+                  max_pressure=max_pressure, cast_time=start + datetime.timedelta(hours=cast),
+                  seed=seed + cast)
+        files.append(fname)
+    return files
@@ -10,10 +10,24 @@
     as the first option when running at the command line.
     
     python get_btl.py '/full/path/to/ctd*.btl'
+
+    python get_btl.py /full/path/to/ --workers 4 --format txt --format nc
+
+    from OnCruiseRoutines.utilities import get_btl
+    get_btl.report('/full/path/to/', '/full/path/to/output/', workers=4, formats=('txt', 'parquet'))
+    btl = get_btl.read_btl('/full/path/to/ctd001.btl')
+    cruise_btl = get_btl.read_btl_files(get_btl.get_files('/full/path/to/')[0])
  
  Purpose:
  --------
     From raw ctd *.btl files, gather and concatenate all data into one tabbed output file
+    (<cruise>.report_btl), optionally also as Parquet or NetCDF
+
+    read_btl/read_btl_files return numpy structured arrays (one record per bottle) with
+    the bottle number, a datetime64 time stamp and one float field per channel
+    (read_btl(text=True) keeps the Seasoft text of each value instead).  The tab
+    report copies the values as written in the .btl files, Parquet and NetCDF
+    reports hold the floats.  Unreadable .btl files are skipped.
     
  Notes:
  ------
@@ -22,12 +36,15 @@
 
 import datetime, sys, os, csv
 
+import numpy as np
+
+from io_utils.disk_cache import atomic_write
 
 __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2014, 01, 07)
-__modified__ = datetime.datetime(2014, 9, 3)
-__version__  = "0.1.0"
+__modified__ = datetime.datetime(2014, 10, 20)
+__version__  = "0.2.0"
 __status__   = "Development"
 
 """--------------------------------Data Source------------------------------------------"""
@@ -41,71 +58,360 @@ def get_files(data_path):
     
 """--------------------------------Data Read------------------------------------------"""
 
-def read_ctd_btl(ifile):
-    """ """
-    btl_data = []
-    time = []
-    headerline1 = []
+# Seasoft .btl layout: bottle number and date/time take the first 22 characters
+# (header 'Bottle' in 10, 'Date' in 12), every other column is 11 characters wide
+BTL_LEAD = 22
+BTL_WIDTH = 11
+BTL_STATS = ('avg', 'sdev', 'min', 'max')
+MONTHS = dict((month, '%02d' % (i + 1)) for i, month in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+def _header_names(line):
+    """
+    column names after Bottle/Date.  Seasoft headers are fixed width (names longer
+    than 10 characters run into the next one, e.g. 'Sal11Sbeox0Mm/Kg'), hand
+    edited headers are split on whitespace
+    """
+    if not (len(line) - BTL_LEAD) % BTL_WIDTH:
+        return [line[i:i + BTL_WIDTH].strip() for i in range(BTL_LEAD, len(line), BTL_WIDTH)]
+    line = line.replace('Sal11Sbeox0Mm/Kg', 'Sal11 Sbeox0Mm/Kg')
+    line = line.replace('Sbeox0PSSbeox1Mm/Kg', 'Sbeox0PS Sbeox1Mm/Kg')
+    return line.split()[2:]
+
+def _scan_btl(fhandle):
+    """
+    Sort the lines of a .btl file by row type in one pass.
+
+    Returns (names, rows, times) where names are the column names after
+    Bottle/Date, rows maps each statistic ('avg', 'sdev', ...) to its list of
+    lines and times are the hh:mm:ss stamps of the (sdev) rows
+    """
+    names = None
+    rows = dict((stat, []) for stat in BTL_STATS)
+    times = []
+    for line in fhandle:
+        line = line.rstrip()
+        if not line or line[0] in '*#@':
+            continue
+        if line.endswith(')'):
+            stat = line[line.rindex('(') + 1:-1]
+            rows.setdefault(stat, []).append(line)
+            if stat == 'sdev':
+                times.append(line[7:BTL_LEAD].strip())
+        elif names is None and line.lstrip().startswith('Bottle'):
+            names = _header_names(line)
+        # 'Position  Time' continuation line carries no extra columns
+    if names is None:
+        raise ValueError("No 'Bottle' header line in %s" % getattr(fhandle, 'name', fhandle))
+    return (names, rows, times)
+
+def _split_fields(lines, ncols):
+    """fixed width numeric block of lines as a (nlines, ncols) array of the stripped text"""
+    width = BTL_LEAD + BTL_WIDTH * ncols
+    block = np.array([line[BTL_LEAD:width].ljust(width - BTL_LEAD) for line in lines],
+                     dtype='S%d' % (width - BTL_LEAD))
+    return np.char.strip(block.view('S%d' % BTL_WIDTH).reshape(len(lines), ncols))
+
+def _decode_fields(fields):
+    """_split_fields text as floats, blanks are nan"""
+    fields = fields.copy()
+    fields[fields == ''] = 'nan'
+    return fields.astype(np.float64)
+
+def _btl_datetimes(dates, times):
+    """'Sep 24 2013' and '23:18:02' strings to datetime64[s]"""
+    iso = ['%s-%s-%sT%s' % (date[7:11], MONTHS[date[:3]], date[4:6].replace(' ', '0'), time)
+           for date, time in zip(dates, times)]
+    return np.array(iso, dtype='datetime64[s]')
+
+def read_btl(ifile, stats=('avg',), text=False):
+    """
+    Read a Seasoft .btl file into a numpy structured array, one record per bottle.
+
+    Parameters
+    ----------
+    ifile : str
+        .btl file
+    stats : tuple
+        statistics to keep from 'avg', 'sdev', 'min', 'max'.  avg values use the
+        column names of the file, the others are suffixed (e.g. 'PrDM_sdev')
+    text : bool
+        keep each value as the Seasoft text ('4.0273e-03', '' when blank)
+        instead of a float, as copied to the tab report
+
+    Returns
+    -------
+    Outputs : ndarray
+              fields 'nb' (int), 'time' (datetime64[s]) and a float (or text)
+              field per column and statistic; Scan is dropped as in the bottle
+              report
+    """
     with open(ifile, 'r') as fhandle:
-        for lines in fhandle:
-            if not ((lines.split()[0] == '@') or (lines.split()[0] == '#') or (lines.split()[0] == '\*')):
-                #skip comment lines
-                if (lines.strip().split()[0] == 'Bottle'):
-                    #first headerline - 
-                    headerline1 = lines.strip() 
-                    headerline1 = headerline1.replace('Sal11Sbeox0Mm/Kg', 'Sal11 Sbeox0Mm/Kg')
-                    headerline1 = headerline1.replace('Sbeox0PSSbeox1Mm/Kg', 'Sbeox0PS Sbeox1Mm/Kg')
-                    headerline1 = headerline1.split()
-                elif (lines.strip().split()[0] == 'Position'):
-                    #second headerline - first value is actually a continuation of previous line
-                    headerline2 = lines.strip().split() 
-                    
-                else:
-                    #list of lists based on btl number as identifier
-                    #only repors averages
-                    if (lines.split()[-1] == '(avg)'):
-                        btl_data.append(lines.strip().split())
-                    elif (lines.split()[-1] == '(sdev)'):
-                        time.append(lines.strip().split()[0])
-                    
-        #with statement auto closes file    
-    if not headerline1:
-        print """headers ar not found in file, assuming format:
-        Bottle        Date      Sal00      Sal11Sbeox0Mm/Kg   Sbeox0PSSbeox1Mm/Kg  Sigma-t00       PrDM      DepSM      T090C      T190C    WetStar        Par         V0         V6       Scan
-        Position        Time  """  
-        headerline2 = []                                                                                                                                                                 
-    
-    return(headerline1 + headerline2, btl_data, time)
-    
-"""--------------------------------Output Generation-----------------------------------"""
-
-def ctd_btl_output(data_path, file_ending, cruise, data, time, header, cast, index, has_btl=''):
-    output_file = data_path + cruise + file_ending
-    print "Data can be found at " + data_path + " as " + output_file + " \n"
-
-    if not os.path.isfile(output_file):
-        with open(output_file, 'wb') as csvfile:
-            csvwriter = csv.writer(csvfile, delimiter='\t',
-                            quotechar='|', quoting=csv.QUOTE_MINIMAL) 
-            #write header
-            #csvwriter.writerow(['cast', 'date', 'time', 'nb', 'pres', 't1', 't2', 's1', 's2', 'par', 'WetStar', 'bottleID'])
-            csvwriter.writerow(['cast', 'date', 'time', 'nb'] + header[2:-3])
-            for d, v in enumerate(data):
-                csvwriter.writerow([cast[index], v[2] + '-' + v[1] + '-' + v[3],
-                                    time[d], v[0]] + v[4:-2]) #,has_btl
-    else:
-        with open(output_file, 'ab') as csvfile:
-            csvwriter = csv.writer(csvfile, delimiter='\t',
-                            quotechar='|', quoting=csv.QUOTE_MINIMAL) 
-            for d, v in enumerate(data):
-                csvwriter.writerow([cast[index], v[2] + '-' + v[1] + '-' + v[3],
-                                    time[d], v[0]] + v[4:-2]) #,has_btl
+        (names, rows, times) = _scan_btl(fhandle)
+
+    avg = rows['avg']
+    keep = [i for i, name in enumerate(names) if name != 'Scan']
+    fields = [('nb', np.int32), ('time', 'datetime64[s]')]
+    value_type = 'S%d' % BTL_WIDTH if text else np.float64
+    for stat in stats:
+        suffix = '' if stat == 'avg' else '_' + stat
+        fields += [(names[i] + suffix, value_type) for i in keep]
+
+    btl = np.zeros(len(avg), dtype=fields)
+    if not avg:
+        return btl
+
+    # nb, 'Mon dd yyyy' and '(avg)' around the values
+    if len(avg[0].split()) - 5 != len(names):
+        raise ValueError("%s header has %d columns, the bottle rows %d" % (ifile, len(names), len(avg[0].split()) - 5))
+    btl['nb'] = [int(line[:7]) for line in avg]
+    if len(times) != len(avg):
+        times = ['00:00:00'] * len(avg)
+    btl['time'] = _btl_datetimes([line[7:BTL_LEAD].strip() for line in avg], times)
+    for stat in stats:
+        if len(rows[stat]) != len(avg):
+            raise ValueError("%s has %d (%s) rows for %d bottles" % (ifile, len(rows[stat]), stat, len(avg)))
+        values = _split_fields(rows[stat], len(names))
+        if not text:
+            values = _decode_fields(values)
+        suffix = '' if stat == 'avg' else '_' + stat
+        for i in keep:
+            btl[names[i] + suffix] = values[:, i]
+    return btl
+
+def read_btl_files(btl_files, casts=None, stats=('avg',)):
+    """
+    Read many .btl files into one structured array with a 'cast' field (cast
+    defaults to the file name without extension).  Columns missing from a cast
+    are nan.
+    """
+    if casts is None:
+        casts = [os.path.basename(ifile).split('.')[0] for ifile in btl_files]
+    tables = [read_btl(ifile, stats=stats) for ifile in btl_files]
+    return stack_btl(tables, casts)
+
+def stack_btl(tables, casts):
+    """concatenate read_btl arrays (columns in order of first appearance)"""
+    fields, seen = [], set()
+    for table in tables:
+        for name in table.dtype.names:
+            if name not in seen:
+                seen.add(name)
+                fields.append((name, table.dtype[name]))
+    width = max([len(cast) for cast in casts] + [1])
+    dtype = [('cast', 'S%d' % width)] + fields
+
+    out = np.zeros(sum(len(table) for table in tables), dtype=dtype)
+    for name, ftype in fields:
+        if np.dtype(ftype).kind == 'f':
+            out[name] = np.nan
+    start = 0
+    for table, cast in zip(tables, casts):
+        stop = start + len(table)
+        out['cast'][start:stop] = cast
+        for name in table.dtype.names:
+            out[name][start:stop] = table[name]
+        start = stop
+    return out
+
+"""--------------------------------Report------------------------------------------------"""
+
+REPORT_FORMATS = ('txt', 'parquet', 'nc')
+REPORT_ENDING = '.report_btl'
+
+def _read_btl_file(ifile, text=False):
+    """
+    read_btl for process pools (module level so it pickles), a file that can
+    not be read gives (None, error message) instead of stopping the report
+    """
+    try:
+        return (read_btl(ifile, text=text), None)
+    except Exception as e:
+        return (None, "%s: %s" % (type(e).__name__, e))
+
+def read_btl_parallel(btl_files, workers=1, text=False):
+    """
+    _read_btl_file over many files, in a process pool for workers > 1 (needs
+    concurrent.futures, the 'futures' backport on python 2, read one by one
+    without it).  text is passed to read_btl.
+
+    Returns a list of (table, error) in file order
+    """
+    if workers is not None and workers > 1 and len(btl_files) > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:
+            print "concurrent.futures not available (pip install futures), reading .btl files serially"
+            workers = 1
+    if workers is None or workers <= 1 or len(btl_files) <= 1:
+        return [_read_btl_file(ifile, text) for ifile in btl_files]
 
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        return list(executor.map(_read_btl_file, btl_files, [text] * len(btl_files)))
+    finally:
+        executor.shutdown(wait=True)
+
+def _format_value(value):
+    if isinstance(value, basestring): # Seasoft text, read_btl(text=True)
+        return value
+    if value != value: # nan, column not in this cast
+        return ''
+    return '%.10g' % value
+
+def write_report_txt(output_file, btl):
+    """
+    Tab separated bottle report, written in one pass under a temporary name and
+    moved into place.  Columns: cast, date (dd-Mon-yyyy), time, nb, then every
+    channel of the stacked bottle array.
+
+    btl from read_btl(text=True) is written exactly as the .btl files
+    (32.5670, 4.0273e-03), float arrays with up to 10 significant digits
+    ('%.10g').  A channel missing from a cast is blank.
+    """
+    channels = [name for name in btl.dtype.names if name not in ('cast', 'nb', 'time')]
+    stamps = btl['time'].astype(datetime.datetime)
+    rows = [[btl['cast'][i], stamps[i].strftime('%d-%b-%Y'), stamps[i].strftime('%H:%M:%S'),
+             str(btl['nb'][i])] + [_format_value(btl[name][i]) for name in channels]
+            for i in range(len(btl))]
+
+    with atomic_write(output_file) as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter='\t',
+                        quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        csvwriter.writerow(['cast', 'date', 'time', 'nb'] + channels)
+        csvwriter.writerows(rows)
+
+def write_report_parquet(output_file, btl):
+    """bottle report as Parquet (requires pandas with pyarrow or fastparquet)"""
+    from pandas import DataFrame
+    DataFrame(btl).to_parquet(output_file)
+
+def write_report_nc(output_file, btl, cruise=''):
+    """
+    bottle report as NetCDF along a 'bottle' dimension.  NetCDF names can not hold
+    '/', those are replaced with '_' and the Seasoft name kept in 'sbe_name'.
+    """
+    from netCDF4 import Dataset
+    epoch = np.datetime64('1970-01-01T00:00:00', 's')
+
+    rootgrp = Dataset(output_file, 'w', format='NETCDF4')
+    try:
+        rootgrp.CRUISE = cruise
+        rootgrp.CREATION_DATE = datetime.datetime.utcnow().strftime("%B %d, %Y %H:%M UTC")
+        rootgrp.createDimension('bottle', len(btl))
+        cast = rootgrp.createVariable('cast', str, ('bottle',))
+        for i, value in enumerate(btl['cast']):
+            cast[i] = str(value)
+        nb = rootgrp.createVariable('nb', 'i4', ('bottle',))
+        nb.long_name = 'niskin bottle number'
+        nb[:] = btl['nb']
+        time = rootgrp.createVariable('time', 'f8', ('bottle',))
+        time.units = 'seconds since 1970-01-01 00:00:00'
+        time[:] = (btl['time'] - epoch).astype(np.float64)
+        for name in btl.dtype.names:
+            if name in ('cast', 'nb', 'time'):
+                continue
+            var = rootgrp.createVariable(name.replace('/', '_'), 'f8', ('bottle',), fill_value=1e35)
+            var.sbe_name = name
+            var[:] = np.ma.masked_invalid(btl[name])
+    finally:
+        rootgrp.close()
+
+def _btl_floats(btl):
+    """read_btl(text=True) (or stacked) array with the value fields as floats, blank is nan"""
+    text = [name for name in btl.dtype.names if name != 'cast' and btl.dtype[name].kind == 'S']
+    out = np.zeros(len(btl), dtype=[(name, np.float64 if name in text else btl.dtype[name])
+                                    for name in btl.dtype.names])
+    for name in btl.dtype.names:
+        out[name] = _decode_fields(btl[name]) if name in text else btl[name]
+    return out
+
+def report_btl(btl_files, casts, user_out, cruiseID, workers=1, formats=('txt',)):
+    """
+    Parse all bottle files (in parallel for workers > 1), stack them in memory and
+    write the cruise report once in each requested format.  Files that can not
+    be read are reported and left out.
+
+    Returns the list of files written
+    """
+    unknown = [fmt for fmt in formats if fmt not in REPORT_FORMATS]
+    if unknown:
+        raise ValueError("Unknown report format(s) %s, use %s" % (unknown, REPORT_FORMATS))
+
+    tables, read_casts = [], []
+    for ifile, cast, (table, error) in zip(btl_files, casts,
+                                           read_btl_parallel(btl_files, workers=workers, text=True)):
+        if error is not None:
+            print "Skipping " + ifile + " (" + error + ")"
+            continue
+        tables.append(table)
+        read_casts.append(cast)
+    if not tables:
+        print "No readable .btl files, no report written \n"
+        return []
+    btl_text = stack_btl(tables, read_casts)
+    btl = _btl_floats(btl_text)
+
+    output_file = user_out + cruiseID + REPORT_ENDING
+    written = []
+    if 'txt' in formats:
+        write_report_txt(output_file, btl_text)
+        written.append(output_file)
+    if 'parquet' in formats:
+        write_report_parquet(output_file + '.parquet', btl)
+        written.append(output_file + '.parquet')
+    if 'nc' in formats:
+        write_report_nc(output_file + '.nc', btl, cruise=cruiseID)
+        written.append(output_file + '.nc')
+
+    print "Data can be found at " + user_out + " as " + ', '.join(written) + " \n"
+    return written
+
+
+"""--------------------------------Tests----------------------------------------------"""
+# run with: python get_btl.py --test
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+def test_read_samples():
+    """the bundled .btl samples, Seasoft fixed width and hand edited header, read alike"""
+    fixed = read_btl(os.path.join(SAMPLE_DIR, 'updated headers', 'ctd001.btl'))
+    edited = read_btl(os.path.join(SAMPLE_DIR, 'sbe_files', 'ctd001.btl'))
+    assert fixed.dtype.names == edited.dtype.names
+    assert 'Sal11' in edited.dtype.names and 'Sbeox1Mm/Kg' in edited.dtype.names
+    assert 'Scan' not in edited.dtype.names
+    assert len(fixed) and len(edited)
+    assert edited['nb'][0] == 1 and edited['PrDM'][0] == 75.770 and edited['Par'][0] == 6.6481e-03
+    assert edited['time'][0] == np.datetime64('2013-09-24T23:18:02')
+    assert fixed['PrDM'][0] == 192.848 and fixed['time'][0] == np.datetime64('2013-10-27T02:56:35')
+
+def test_report_text():
+    """the tab report holds the .btl text of every value, as the row by row report did"""
+    import tempfile, shutil
+    ifile = os.path.join(SAMPLE_DIR, 'sbe_files', 'ctd001.btl')
+    work_dir = tempfile.mkdtemp()
+    try:
+        (written,) = report_btl([ifile], ['ctd001'], work_dir + '/', 'test', formats=('txt',))
+        with open(written, 'r') as fhandle:
+            rows = [line.rstrip('\r\n').split('\t') for line in fhandle][1:]
+    finally:
+        shutil.rmtree(work_dir)
+    with open(ifile, 'r') as fhandle:
+        avg = [line.split() for line in fhandle if line.rstrip().endswith('(avg)')]
+    assert len(rows) == len(avg)
+    for row, line in zip(rows, avg):
+        # nb, Mon dd yyyy ... Scan (avg)
+        assert row[3] == line[0] and row[4:] == line[4:-2]
 
 """--------------------------------Main-----------------------------------------------"""
 
 
-def report(user_in, user_out):
+def report(user_in, user_out, workers=1, formats=('txt',)):
+    """
+    Bottle report of all .btl files in user_in, written to user_out as
+    <cruise>.report_btl (replacing any earlier report).  Casts are in file name
+    order.
+    """
 
     cruiseID = user_in.split('/')[-3]
     leg = cruiseID.lower().split('L')
@@ -117,17 +423,39 @@ def report(user_in, user_out):
 
     
     (btl_files, cruise, cast) = get_files(user_in)
-    
-    for i, ifile in enumerate(btl_files):
-        (header , btl_data, time) = read_ctd_btl(ifile)
-        #the formating and output is not smart - it is hard coded in the ctd_btl_output module above
-        ctd_btl_output(user_out, '.report_btl', cruiseID, btl_data, time, header, cast, i)
+    order = sorted(range(len(btl_files)), key=lambda i: btl_files[i])
+    btl_files = [btl_files[i] for i in order]
+    cast = [cast[i] for i in order]
+
+    report_btl(btl_files, cast, user_out, cruiseID, workers=workers, formats=formats)
         
     processing_complete = True
     return processing_complete
 
-if __name__ == '__main__':
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cruise bottle report from SBE .btl files")
+    parser.add_argument("user_in", metavar="user_in", type=str, nargs="?",
+                        help="directory of .btl files (also the output directory)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of .btl files to read in parallel")
+    parser.add_argument("-f", "--format", type=str, action="append", choices=REPORT_FORMATS,
+                        help="report format, may be repeated (default: txt)")
+    parser.add_argument("--test", action="store_true", help="run the tests")
+    args = parser.parse_args()
 
-    user_in = raw_input("Please enter the abs path to the .btl files: or \n path, file1, file2: ")
+    if args.test:
+        for test in (test_read_samples, test_report_text):
+            test()
+            print "{0}: ok".format(test.__name__)
+        return
+
+    user_in = args.user_in
+    if user_in is None:
+        user_in = raw_input("Please enter the abs path to the .btl files: or \n path, file1, file2: ")
     user_out = user_in
-    report(user_in, user_out)
\ No newline at end of file
+    report(user_in, user_out, workers=args.workers, formats=tuple(args.format or ['txt']))
+
+if __name__ == '__main__':
+    main()
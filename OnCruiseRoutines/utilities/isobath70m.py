@@ -24,16 +24,21 @@
 """
 # System Packages
 import datetime, os, sys
-import math
 
 # Scientific Packages
 from netCDF4 import Dataset
 import numpy as np
 
 # Plotting Stack
-from mpl_toolkits.basemap import Basemap, shiftgrid
+from mpl_toolkits.basemap import Basemap
 import matplotlib.pyplot as plt
 
+# User Stack
+from calc import geodesy
+from calc.geodesy import distance
+from io_utils.bathy_grids import etopo5_data
+from io_utils.map_cache import isobaths, draw_isobaths
+
 
 __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
@@ -94,23 +99,55 @@ class SeventyMeterIso(object):
                    np.arange(self.cruiseID[castID]['depth_data'][-1]+1,self.deepest_water,1)))
         self.cruiseID[castID]['data'] = np.hstack((self.cruiseID[castID]['data'], np.zeros(number_added) - 999.))   
         
-    def distbtwncast(self):
-        """Using haversine formula"""
-        pass
-
-def distance(origin, destination):
-    lat1, lon1 = origin
-    lat2, lon2 = destination
-    radius = 6371 # km
-
-    dlat = math.radians(lat2-lat1)
-    dlon = math.radians(lon2-lon1)
-    a = math.sin(dlat/2) * math.sin(dlat/2) + math.cos(math.radians(lat1)) \
-        * math.cos(math.radians(lat2)) * math.sin(dlon/2) * math.sin(dlon/2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    d = radius * c
-
-    return d                  
+    def distbtwncast(self, castIDs=None):
+        """Using haversine formula, km from each cast (sorted castIDs) to the next"""
+        castIDs = sorted(self.cast70m_keys if castIDs is None else castIDs)
+        lats = np.array([self.cruiseID[ID]['latitude'] for ID in castIDs], dtype=float)
+        lons = np.array([self.cruiseID[ID]['longitude'] for ID in castIDs], dtype=float)
+        return geodesy.consecutive(lats, lons)
+
+    def section(self, castIDs=None, btm_fill=-42., sub_btm_fill=-999.):
+        """
+        All casts on one 1m depth grid, one row per cast (sorted castIDs, the 70m
+        isobath casts by default).
+
+        The (n_casts, n_depth) array is allocated once and filled by slicing, as
+        with map2btm/pad2deepest values between the last sample and the bottom are
+        btm_fill and values below the bottom are sub_btm_fill.  Filled cells are
+        masked, section['data'].data keeps the fill values for plotting.
+
+        Returns
+        -------
+        Outputs : dict
+                  castIDs, depth (n_depth,), data masked (n_casts, n_depth),
+                  latitude, longitude (n_casts,), distance (n_casts,) cumulative
+                  along track km from the first cast
+        """
+        castIDs = sorted(self.cast70m_keys if castIDs is None else castIDs)
+        casts = [self.cruiseID[ID] for ID in castIDs]
+
+        # cast metadata first: samples, samples down to the bottom, position
+        n_data = np.array([len(cast['data']) for cast in casts], dtype=int)
+        n_btm = n_data + np.array([max(0, int(np.ceil(cast['btm_depth'] - cast['depth_data'][-1] - 1)))
+                                   for cast in casts], dtype=int)
+        deepest = max([cast['btm_depth'] for cast in casts] + [0])
+        n_depth = max([int(np.ceil(deepest))] + n_btm.tolist())
+
+        values = np.empty((len(casts), n_depth))
+        values.fill(sub_btm_fill)
+        mask = np.ones(values.shape, dtype=bool)
+        for row, cast in enumerate(casts):
+            values[row, :n_data[row]] = cast['data']
+            values[row, n_data[row]:n_btm[row]] = btm_fill
+            mask[row, :n_data[row]] = False
+
+        lats = np.array([cast['latitude'] for cast in casts], dtype=float)
+        lons = np.array([cast['longitude'] for cast in casts], dtype=float)
+
+        return {'castIDs': castIDs, 'depth': np.arange(n_depth),
+                'data': np.ma.array(values, mask=mask),
+                'latitude': lats, 'longitude': lons, 'distance': geodesy.cumulative(lats, lons)}
+
 """------------------------------Plotting----------------------------------------------"""
 
 def plotsetup():
@@ -131,22 +168,6 @@ def plotsetup():
     mpl.rcParams['xtick.labelsize'] = 12.
     mpl.rcParams['ytick.labelsize'] = 12.    
 
-def etopo5_data():
-    """ read in etopo5 topography/bathymetry. """
-    file = '../data/etopo5.nc'
-    etopodata = Dataset(file)
-    
-    topoin = etopodata.variables['bath'][:]
-    lons = etopodata.variables['X'][:]
-    lats = etopodata.variables['Y'][:]
-    etopodata.close()
-    
-    topoin,lons = shiftgrid(0.,topoin,lons,start=False) # -360 -> 0
-    
-    lons, lats = np.meshgrid(lons, lats)
-    
-    return(topoin, lats, lons)
-        
     
 def grid_plot(lon,lat, topoin, etlats, etlons, llimx=-180.,\
                     ulimx=-130.,llimy=50.,ulimy=75.):
@@ -173,7 +194,6 @@ def grid_plot(lon,lat, topoin, etlats, etlons, llimx=-180.,\
  
     m = Basemap(resolution='i',projection='merc', llcrnrlat=y1,urcrnrlat=y2,llcrnrlon=x1,urcrnrlon=x2,lat_ts=((y1+y2)/2))
     x, y = m(lon,lat)
-    ex, ey = m(etlons, etlats)
     #lonpt, latpt = m(x,y,inverse=True)
 
     m.drawcountries(linewidth=0.5)
@@ -183,7 +203,8 @@ def grid_plot(lon,lat, topoin, etlats, etlons, llimx=-180.,\
     m.fillcontinents(color='black')
 
     
-    m.contour(ex,ey,topoin, levels=[ -70, -100, -200, -1000], linewidths=0.2)
+    draw_isobaths(ax, isobaths(m, etlons, etlats, topoin, levels=[ -70, -100, -200, -1000]),
+                  colors=None, linewidths=0.2)
     m.scatter(x,y,20,marker='+')
 
     
@@ -196,12 +217,10 @@ def grid_plot(lon,lat, topoin, etlats, etlons, llimx=-180.,\
     
     
 def contour_plot( cruise_inst, levels='empty' ):
-    ygrid = np.arange( 0,cruises[cruiseID_in].deepest_water,1 )
-    xgrid, data = [], np.zeros( cruises[cruiseID_in].deepest_water )
-    for cast_s in sorted(castIDon70):
-        xgrid = np.hstack( (xgrid, np.int(cast_s.split('c')[-1]) ) )
-        data  = np.vstack( (data, cruises[cruiseID_in].cruiseID[cast_s]['data']) )
-    data = data[1:,:]
+    section = cruise_inst.section()
+    ygrid = section['depth']
+    xgrid = np.array([np.int(cast_s.split('c')[-1]) for cast_s in section['castIDs']])
+    data = section['data'].data
 
     #-999.represents below btm and -42 represents btwn btm and last cast depth
     if levels is 'empty':
@@ -217,12 +236,11 @@ def contour_plot( cruise_inst, levels='empty' ):
     cbar = plt.colorbar(CS2)
     return(fig, ax)
 
-def contour_plot_alongtrack( cruise_inst, distance, levels='empty' ):
-    ygrid = np.arange( 0,cruises[cruiseID_in].deepest_water,1 )
-    xgrid, data = distance, np.zeros( cruises[cruiseID_in].deepest_water )
-    for cast_s in sorted(castIDon70):
-        data  = np.vstack( (data, cruises[cruiseID_in].cruiseID[cast_s]['data']) )
-    data = data[1:,:]
+def contour_plot_alongtrack( cruise_inst, distance=None, levels='empty' ):
+    section = cruise_inst.section()
+    ygrid = section['depth']
+    xgrid = section['distance'] if distance is None else distance
+    data = section['data'].data
 
     #-999.represents below btm and -42 represents btwn btm and last cast depth
     if levels is 'empty':
@@ -238,97 +256,160 @@ def contour_plot_alongtrack( cruise_inst, distance, levels='empty' ):
     cbar = plt.colorbar(CS2)
     return(fig, ax)    
 """-----------------------------From Netcdf--------------------------------------------"""
-def get_nc_data(fname):
+#vertical coordinate names, in order of preference
+VERTICAL_COORDS = ('dep', 'depth', 'pres')
+#position coordinates, read with the header by get_nc_vars
+POSITION_COORDS = ('lat', 'lon')
+
+def _profile(var):
+    """non coord dims have 4 axis (time, depth, lat, lon), coord dims have only one"""
+    if var.ndim == 4:
+        return var[0,:,0,0]
+    return var[:]
+
+def _vertical_coord(f):
+    for name in VERTICAL_COORDS:
+        if name in f.variables:
+            return name
+    print " ERROR: NetCDF vertical coordinate not recognized.  No dep, depth, or pres key in file \n"
+    sys.exit(1)
+
+class LazyVariable(object):
+    """
+    One profile (data) variable of a cast file, read from disk on first use
+    (np.asarray, indexing or read()); len() is the length of the vertical
+    coordinate, known from the file header
+    """
+    def __init__(self, fname, name, length):
+        self.fname = fname
+        self.name = name
+        self.length = length
+        self._values = None
+
+    def read(self):
+        if self._values is None:
+            f = Dataset(self.fname,'r')
+            try:
+                self._values = np.asarray(_profile(f.variables[self.name]))
+            finally:
+                f.close()
+        return self._values
+
+    def __len__(self):
+        return self.length
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.read()
+        return self.read().astype(dtype)
+
+    def __getitem__(self, index):
+        return self.read()[index]
+
+def get_nc_data(fname, variables=None):
     """ using netcdf4 to import data
     Usage
     -----
     >>>fname = ../data/test_ctd.nc
     >>> get_nc_data(fname)
+    >>> get_nc_data(fname, variables=['T_28', 'lat', 'lon'])
+
+    Only the listed variables (all if None) and the vertical coordinate
+    ('dep', 'depth' or 'pres') are read, variable_names maps each name to its
+    column of cast.
     """
     f = Dataset(fname,'r')
 
     global_attrs = {}
     for i, v in enumerate(f.ncattrs()):
         global_attrs[v] = f.getncattr(v)
-    
 
-        
     #index may be 'dep', 'depth', or 'pres'
-    try:
-        cast = np.zeros( ( f.variables['dep'][:].shape[0],len(f.variables.keys()) ) ) 
-    except KeyError:
-        try: 
-            cast = np.zeros( ( f.variables['depth'][:].shape[0],len(f.variables.keys()) ) )
-        except KeyError:
-            try:
-                cast = np.zeros( ( f.variables['pres'][:].shape[0],len(f.variables.keys()) ) )
-            except:
-                print " ERROR: NetCDF vertical coordinate not recognized.  No dep, depth, or pres key in file \n"
-                sys.exit(1)
-
-    variable_names = {}            
-    for j, v in enumerate( f.variables.keys() ): 
-        try: #non coord dims have 4 axis
-            cast[:,j] = f.variables[v][0,:,0,0]
-            variable_names[v] = j
-        except ValueError: #coord dims have only one axis
-            cast[:,j] = f.variables[v][:]
-            variable_names[v] = j
-            
+    vertical = _vertical_coord(f)
+    if variables is None:
+        variables = f.variables.keys()
+    elif vertical not in variables:
+        variables = list(variables) + [vertical]
+
+    cast = np.zeros( ( f.variables[vertical].shape[0],len(variables) ) )
+    variable_names = {}
+    for j, v in enumerate( variables ):
+        cast[:,j] = _profile(f.variables[v])
+        variable_names[v] = j
+    f.close()
+
     return (global_attrs, variable_names, cast)
 
+def get_nc_vars(fname, variables=None):
+    """ lazy version of get_nc_data
+    Usage
+    -----
+    >>> (global_attrs, cast) = get_nc_vars(fname, variables=['T_28', 'dep', 'lat', 'lon'])
+    >>> cast['T_28'][:10]   #T_28 is read here
+
+    Returns the global attributes and a dict of the listed variables (all if
+    None).  The vertical coordinate and lat/lon are read as arrays while the
+    file is open for its header, the data variables are LazyVariable and are
+    only read when used.
+    """
+    f = Dataset(fname,'r')
+    try:
+        global_attrs = dict((v, f.getncattr(v)) for v in f.ncattrs())
+        vertical = _vertical_coord(f)
+        length = f.variables[vertical].shape[0]
+        if variables is None:
+            variables = f.variables.keys()
+        for v in variables:
+            if v not in f.variables:
+                raise KeyError(v)
+        coords = [vertical] + [v for v in POSITION_COORDS if v in f.variables]
+        cast = dict((v, np.asarray(_profile(f.variables[v]))) for v in coords)
+        for v in variables:
+            if v not in cast:
+                cast[v] = LazyVariable(fname, v, length)
+    finally:
+        f.close()
+
+    return (global_attrs, cast)
+
 """------------------------------------------------------------------------------------"""
 def main():
-    pass
-    
-cruise_in = raw_input("Please enter the abs path to the cruise of interest: ")
-cruiseID_in = raw_input("Please enter ID of the cruise of interest: ")
+    cruise_in = raw_input("Please enter the abs path to the cruise of interest: ")
+    cruiseID_in = raw_input("Please enter ID of the cruise of interest: ")
 
-cruises = {}
-cruises[cruiseID_in] = SeventyMeterIso()
+    cruises = {}
+    cruises[cruiseID_in] = SeventyMeterIso()
 
-for files in os.listdir(cruise_in):
-    
-    if files.endswith('nc'):
-        
-        #print "Getting data from %s \n" % files
-        (global_attrs, variable_names, cast) = get_nc_data(cruise_in + files)
- 
-        cruises[cruiseID_in].add_info(castID=files.strip('.nc'), file_in=(cruise_in + files),
-                btm_depth=global_attrs['WATER_DEPTH'], data=cast[:,variable_names['T_28']],
-                depth_data=cast[:,variable_names['dep']], latitude=cast[:,variable_names['lat']][0],
-                longitude=cast[:,variable_names['lon']][0])
-
-        #print "Calculaing cruise statistics \n"
-        (castIDon70, numCasts) = cruises[cruiseID_in].cruise_stats()
-
-        #print "Mapping to bottom depth \n"
-        cruises[cruiseID_in].map2btm(castID=files.strip('.nc'))
-
-""" determine distance between casts"""
-all_lats = [-90]
-all_lons = [0]
-along_cruise_distance = []
-for kid in castIDon70:
-    all_lats = np.append(all_lats, cruises[cruiseID_in].cruiseID[kid]['latitude'])
-    all_lons = np.append(all_lons, cruises[cruiseID_in].cruiseID[kid]['longitude'])
-    along_cruise_distance = np.append(along_cruise_distance, 
-        distance((all_lats[-2],all_lons[-2]),(all_lats[-1],all_lons[-1])))
-
-#no value for first point 
-along_cruise_distance[0] = 0. 
-
-cruises[cruiseID_in].deepest_cast()
-print "Mapping to deepest cast \n"
-[cruises[cruiseID_in].pad2deepest(castID=ID) for ID in castIDon70]
-
-clevels = np.hstack(([-1000.,-500, -40], np.arange(24,26,.1)))
-fig1, ax = contour_plot_alongtrack(cruises[cruiseID_in], np.cumsum(along_cruise_distance))
-plt.show(fig1)
-
-#print map of casts used
-print "Mapping to CTD locations \n"
-(topoin, etlats, etlons) = etopo5_data()
-
-fig2, plt = grid_plot(-1.*all_lons,all_lats, topoin, etlats, etlons)
-plt.show(fig2)
\ No newline at end of file
+    for files in sorted(os.listdir(cruise_in)):
+
+        if files.endswith('nc'):
+
+            #print "Getting data from %s \n" % files
+            #T_28 is only read for the casts that make it into the section
+            (global_attrs, cast) = get_nc_vars(cruise_in + files, variables=['T_28', 'dep', 'lat', 'lon'])
+
+            cruises[cruiseID_in].add_info(castID=files.strip('.nc'), file_in=(cruise_in + files),
+                    btm_depth=global_attrs['WATER_DEPTH'], data=cast['T_28'],
+                    depth_data=cast['dep'], latitude=cast['lat'][0],
+                    longitude=cast['lon'][0])
+
+    #print "Calculaing cruise statistics \n"
+    (castIDon70, numCasts) = cruises[cruiseID_in].cruise_stats()
+
+    cruises[cruiseID_in].deepest_cast()
+    print "Mapping to deepest cast \n"
+    section = cruises[cruiseID_in].section(castIDon70)
+
+    fig1, ax = contour_plot_alongtrack(cruises[cruiseID_in], section['distance'])
+    plt.show(fig1)
+
+    #print map of casts used
+    print "Mapping to CTD locations \n"
+    #grid_plot default extent
+    (topoin, etlats, etlons) = etopo5_data('../data/etopo5.nc', bounds=(50., 75., -180., -130.), meshgrid=True)
+
+    fig2, plot = grid_plot(-1.*section['longitude'], section['latitude'], topoin, etlats, etlons)
+    plot.show(fig2)
+
+if __name__ == "__main__":
+    main()
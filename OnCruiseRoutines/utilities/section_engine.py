@@ -0,0 +1,312 @@
+#!/usr/bin/env
+
+"""
+ Program:
+ --------
+    section_engine.py
+
+ Usage:
+ ------
+    python section_engine.py /full/path/to/cruise/ T_28 S_41 OST_62 --btm_range 60 80 --cache_dir /tmp/sections
+
+    from OnCruiseRoutines.utilities import section_engine
+    cruise = section_engine.load_cruise('/full/path/to/cruise/', variables=['T_28', 'S_41'])
+    section = cruise.gridded_section('S_41', predicate=section_engine.isobath(60., 80.))
+    section = cruise.gridded_section('T_28', predicate=lambda cast: cast['latitude'] > 70.)
+
+ Purpose:
+ --------
+    Cruise sections of any variable for any selection of casts.  Casts are read
+    with isobath70m.get_nc_vars (header and coordinates only until a variable is used) into a
+    SeventyMeterIso, selected with a predicate on the cast info (btm_depth,
+    latitude, longitude, depth_data, file) and interpolated onto a common depth
+    axis with one np.interp call for all casts.
+
+    Sections are masked arrays (n_casts, n_depth), masked outside the sampled
+    depths of each cast; filled() gives the -42 / -999 (last sample to the bottom /
+    below the bottom) layout of SeventyMeterIso.section for the existing contour
+    plots, gaps above the first sample are nan.  CruiseSections.gridded_section
+    leaves SeventyMeterIso.section(castIDs=None, ...) as it is.  With a
+    cache directory (cache_dir or SECTION_CACHE_DIR) each section is kept as .npz,
+    keyed by the variable, the selected files (path, size, mtime) and the depth axis.
+
+ Notes:
+ ------
+   Using Anaconda packaged Python
+"""
+
+import datetime, os, json, hashlib
+
+import numpy as np
+
+from calc import geodesy
+from io_utils.disk_cache import save_npz, load_npz, masked_arrays, masked_from
+from isobath70m import SeventyMeterIso, get_nc_vars, VERTICAL_COORDS
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+# bump when the gridding or the cached layout changes
+CACHE_VERSION = 2
+
+#EPIC missing value is 1e35
+EPIC_FILL = 1e34
+
+"""--------------------------------Selection--------------------------------------------"""
+
+def isobath(btm_min=60., btm_max=80.):
+    """
+    Predicate for casts with btm_min < bottom depth < btm_max whose data do not
+    reach below the bottom (SeventyMeterIso.cruise_stats)
+    """
+    def predicate(cast):
+        return (btm_min < cast['btm_depth'] < btm_max) and \
+               not (cast['depth_data'][-1] > cast['btm_depth'])
+    return predicate
+
+def all_casts(cast):
+    return True
+
+"""--------------------------------Gridding---------------------------------------------"""
+
+def grid_profiles(depths, values, depth_axis):
+    """
+    Linear interpolation of n profiles onto depth_axis with one np.interp call
+
+    The casts are laid end to end by offsetting the depths of cast i by
+    i * stride (stride wider than any depth range), so one monotonic x axis holds
+    all of them.  Missing samples (nan or EPIC 1e35) are dropped first.
+
+    Parameters
+    ----------
+    depths, values : list of array_like
+        one depth and one value profile per cast (any length)
+    depth_axis : array_like
+        common depth axis
+
+    Returns
+    -------
+    Outputs : masked array (n_casts, len(depth_axis))
+              masked above the shallowest and below the deepest good sample of each cast
+    """
+    depth_axis = np.asarray(depth_axis, dtype=np.float64)
+    ncasts = len(depths)
+    lengths = [len(profile) for profile in depths]
+    cast_index = np.repeat(np.arange(ncasts), lengths)
+    depth = np.concatenate([np.asarray(profile, dtype=np.float64) for profile in depths] + [np.zeros(0)])
+    value = np.concatenate([np.asarray(profile, dtype=np.float64) for profile in values] + [np.zeros(0)])
+
+    good = np.isfinite(depth) & np.isfinite(value) & (np.abs(value) < EPIC_FILL)
+    depth, value, cast_index = depth[good], value[good], cast_index[good]
+
+    gridded = np.zeros((ncasts, depth_axis.size))
+    mask = np.ones(gridded.shape, dtype=bool)
+    if depth.size == 0 or depth_axis.size == 0:
+        return np.ma.array(gridded, mask=mask)
+
+    low = min(depth.min(), depth_axis.min())
+    stride = max(depth.max(), depth_axis.max()) - low + 1.
+    order = np.lexsort((depth, cast_index))
+    x = (depth - low)[order] + cast_index[order] * stride
+    query = (depth_axis - low)[np.newaxis, :] + (np.arange(ncasts) * stride)[:, np.newaxis]
+    gridded = np.interp(query.ravel(), x, value[order]).reshape(ncasts, depth_axis.size)
+
+    shallowest = np.empty(ncasts)
+    shallowest.fill(np.inf)
+    deepest = np.empty(ncasts)
+    deepest.fill(-np.inf)
+    np.minimum.at(shallowest, cast_index, depth)
+    np.maximum.at(deepest, cast_index, depth)
+    mask = (depth_axis[np.newaxis, :] < shallowest[:, np.newaxis]) | \
+           (depth_axis[np.newaxis, :] > deepest[:, np.newaxis])
+    return np.ma.array(gridded, mask=mask)
+
+def filled(section, btm_fill=-42., sub_btm_fill=-999., sfc_fill=np.nan):
+    """
+    SeventyMeterIso layout of a section: masked cells between the deepest sample
+    of a cast and the bottom are btm_fill, below the bottom sub_btm_fill and
+    above the first sample (or in a cast without samples) sfc_fill
+    """
+    depth = section['depth']
+    mask = np.ma.getmaskarray(section['data'])
+    sampled = ~mask
+    has_data = sampled.any(axis=1)
+    last = depth.size - 1 - np.argmax(sampled[:, ::-1], axis=1)
+    deepest = np.where(has_data, depth[last], np.inf)
+
+    below_data = depth[np.newaxis, :] > deepest[:, np.newaxis]
+    below_btm = depth[np.newaxis, :] >= section['btm_depth'][:, np.newaxis]
+    data = section['data'].filled(sfc_fill)
+    data[mask & below_data] = btm_fill
+    data[mask & below_btm] = sub_btm_fill
+    return data
+
+"""--------------------------------Cache------------------------------------------------"""
+
+def _section_key(variable, files, depth_axis):
+    sha = hashlib.sha1(json.dumps([variable, CACHE_VERSION]))
+    for fname in files:
+        stat = os.stat(fname)
+        sha.update(json.dumps([os.path.abspath(fname), stat.st_size, stat.st_mtime]))
+    sha.update(np.ascontiguousarray(depth_axis, dtype=np.float64).data)
+    return variable + '-' + sha.hexdigest()[:20] + '.npz'
+
+def _read_section(fname):
+    cached = load_npz(fname)
+    if cached is None:
+        return None
+    return {'variable': str(cached['variable']), 'castIDs': [str(ID) for ID in cached['castIDs']],
+            'depth': cached['depth'], 'data': np.ma.array(masked_from(cached, 'data')),
+            'latitude': cached['latitude'], 'longitude': cached['longitude'],
+            'btm_depth': cached['btm_depth'], 'distance': cached['distance']}
+
+def _write_section(fname, section):
+    save_npz(fname, variable=section['variable'], castIDs=np.array(section['castIDs']),
+             depth=section['depth'], latitude=section['latitude'], longitude=section['longitude'],
+             btm_depth=section['btm_depth'], distance=section['distance'],
+             **masked_arrays('data', section['data']))
+
+"""--------------------------------Cruise Sections--------------------------------------"""
+
+class CruiseSections(SeventyMeterIso):
+    """
+    SeventyMeterIso holding every requested variable of each cast (read lazily)
+    cruiseID[castID]['variables'] maps the variable names to isobath70m.LazyVariable,
+    gridded_section grids any of them
+    """
+    def __init__(self, cache_dir=None):
+        SeventyMeterIso.__init__(self)
+        self.cache_dir = cache_dir or os.environ.get('SECTION_CACHE_DIR')
+
+    def add_cast(self, castID, file_in, variables=None):
+        if variables is not None:
+            variables = list(variables) + [v for v in ('lat', 'lon') if v not in variables]
+        (global_attrs, cast) = get_nc_vars(file_in, variables)
+        vertical = [v for v in VERTICAL_COORDS if v in cast][0]
+
+        self.add_info(castID=castID, file_in=file_in, btm_depth=global_attrs['WATER_DEPTH'],
+                      depth_data=cast[vertical], latitude=cast['lat'][0], longitude=cast['lon'][0])
+        self.cruiseID[castID]['variables'] = cast
+
+    def select(self, predicate=None):
+        """sorted castIDs of the casts for which predicate(cast info) is true (70m isobath by default)"""
+        predicate = isobath() if predicate is None else predicate
+        return sorted(ID for ID in self.cruiseID.keys() if predicate(self.cruiseID[ID]))
+
+    def gridded_section(self, variable, predicate=None, castIDs=None, dz=1., max_depth=None):
+        """
+        variable of the selected casts (castIDs or select(predicate)) on a depth
+        axis 0 -> max_depth (deepest bottom by default) every dz meters
+
+        Returns
+        -------
+        Outputs : dict
+                  variable, castIDs, depth, data masked (n_casts, n_depth), latitude,
+                  longitude, btm_depth (n_casts,) and distance, cumulative along
+                  track km from the first cast
+        """
+        castIDs = sorted(castIDs) if castIDs is not None else self.select(predicate)
+        casts = [self.cruiseID[ID] for ID in castIDs]
+        btm_depth = np.array([cast['btm_depth'] for cast in casts], dtype=float)
+        if max_depth is None:
+            max_depth = btm_depth.max() if btm_depth.size else 0.
+        depth_axis = np.arange(0., max_depth + dz * 0.5, dz)
+
+        cache_file = None
+        if self.cache_dir:
+            cache_file = os.path.join(self.cache_dir,
+                                      _section_key(variable, [cast['file'] for cast in casts], depth_axis))
+            section = _read_section(cache_file)
+            if section is not None and section['castIDs'] == castIDs:
+                return section
+
+        data = grid_profiles([cast['depth_data'] for cast in casts],
+                             [cast['variables'][variable] for cast in casts], depth_axis)
+        lats = np.array([cast['latitude'] for cast in casts], dtype=float)
+        lons = np.array([cast['longitude'] for cast in casts], dtype=float)
+        section = {'variable': variable, 'castIDs': castIDs, 'depth': depth_axis, 'data': data,
+                   'latitude': lats, 'longitude': lons, 'btm_depth': btm_depth,
+                   'distance': geodesy.cumulative(lats, lons)}
+
+        if cache_file is not None:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            _write_section(cache_file, section)
+        return section
+
+def load_cruise(cruise_in, variables=None, cache_dir=None):
+    """CruiseSections of every .nc cast in cruise_in (only headers, dep, lat and lon are read)"""
+    cruise = CruiseSections(cache_dir=cache_dir)
+    for files in sorted(os.listdir(cruise_in)):
+        if files.endswith('.nc'):
+            cruise.add_cast(os.path.splitext(files)[0], os.path.join(cruise_in, files), variables)
+    return cruise
+
+"""--------------------------------Tests------------------------------------------------"""
+# run with: python section_engine.py --test
+
+def test_grid_profiles(ncasts=50, seed=0):
+    """one np.interp call matches interpolating cast by cast, masks outside the samples"""
+    rand = np.random.RandomState(seed)
+    depth_axis = np.arange(0., 120., 1.)
+    depths, values = [], []
+    for cast in range(ncasts):
+        top, bottom = rand.uniform(0., 10.), rand.uniform(20., 110.)
+        depths.append(np.sort(rand.uniform(top, bottom, rand.randint(5, 200))))
+        values.append(rand.normal(size=depths[-1].size))
+    values[3][2] = 1e35
+    gridded = grid_profiles(depths, values, depth_axis)
+
+    for cast in range(ncasts):
+        good = values[cast] < EPIC_FILL
+        inside = (depth_axis >= depths[cast][good][0]) & (depth_axis <= depths[cast][good][-1])
+        expected = np.interp(depth_axis, depths[cast][good], values[cast][good])
+        assert (~gridded.mask[cast] == inside).all()
+        assert np.allclose(gridded.data[cast][inside], expected[inside])
+
+def test_filled():
+    """fill layout of SeventyMeterIso.section, surface gaps are not filled as near bottom"""
+    section = {'depth': np.arange(6.), 'btm_depth': np.array([4., 5., 3.]),
+               'data': np.ma.array([[1., 2., 0., 0., 0., 0.], [0., 1., 2., 0., 0., 0.], [0.] * 6],
+                                   mask=[[0, 0, 1, 1, 1, 1], [1, 0, 0, 1, 1, 1], [1] * 6])}
+    data = filled(section, sfc_fill=-1.)
+    assert data.tolist() == [[1., 2., -42., -42., -999., -999.],
+                             [-1., 1., 2., -42., -42., -999.],
+                             [-1., -1., -1., -999., -999., -999.]]
+    assert np.isnan(filled(section)[1, 0])
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Gridded cruise sections of EPIC CTD casts')
+    parser.add_argument('CruisePath', metavar='CruisePath', type=str, nargs='?',
+                        help='full path to the cruise .nc casts')
+    parser.add_argument('Variables', metavar='Variables', type=str, nargs='*',
+                        help='EPIC variable names (e.g. T_28 S_41 OST_62)')
+    parser.add_argument('--btm_range', nargs=2, type=float, default=[60., 80.],
+                        help='bottom depth range of the casts used')
+    parser.add_argument('--dz', type=float, default=1., help='depth axis spacing (m)')
+    parser.add_argument('--cache_dir', type=str, help='keep gridded sections here')
+    parser.add_argument('--test', action='store_true', help='run the tests')
+    args = parser.parse_args()
+
+    if args.test:
+        for test in (test_grid_profiles, test_filled):
+            test()
+            print "{0}: ok".format(test.__name__)
+        return
+
+    cruise = load_cruise(args.CruisePath, args.Variables, cache_dir=args.cache_dir)
+    for variable in args.Variables:
+        section = cruise.gridded_section(variable, predicate=isobath(*args.btm_range), dz=args.dz)
+        print "{0}: {1} casts, {2} depths, {3:.1f} km, min {4} max {5}".format(
+            variable, len(section['castIDs']), section['depth'].size,
+            section['distance'][-1] if section['castIDs'] else 0.,
+            section['data'].min(), section['data'].max())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env
+"""
+ Program:
+ --------
+    stagetimer.py
+
+ Usage:
+ ------
+    from utilities import stagetimer
+
+    timer = stagetimer.StageTimer(profile_dir='/path/to/profiles/')
+    timer.add_observer(lambda record: sys.stdout.write(str(record) + '\n'))
+
+    with timer.profile('ctd001'):
+        with timer.stage('from_cnv', cast='ctd001', bytes_read=1024) as record:
+            cast = ctd.from_cnv(filein)
+            record['rows'] = len(cast)
+
+    timer.report()
+    timer.write_trace('/path/to/trace.json')
+
+ Purpose:
+ --------
+    Wall time, row count and bytes read/written for each stage of each cast in the
+    CNV -> EPIC NetCDF conversion.  Records from worker processes are merged with
+    extend().  Observers are called with every record as it is added (in the
+    process holding the timer).
+
+    write_trace saves the records as json together with 'traceEvents' in the
+    chrome://tracing (Trace Event) format.  profile() wraps a cast in cProfile and
+    dumps <profile_dir>/<cast>.prof (read with pstats) when profile_dir is set.
+
+ Notes:
+ ------
+   Using Anaconda packaged Python
+"""
+
+import datetime, os, time, json
+from contextlib import contextmanager
+
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2014, 10, 20)
+__modified__ = datetime.datetime(2014, 10, 20)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+"""--------------------------------Stage Timer------------------------------------------"""
+
+class StageTimer(object):
+    """
+    Collects one record per timed stage:
+        {'cast', 'stage', 'start', 'seconds', 'rows', 'bytes_read', 'bytes_written', 'pid'}
+    """
+
+    def __init__(self, profile_dir=None, observers=None):
+        self.profile_dir = profile_dir
+        self.records = []
+        self.observers = list(observers or [])
+
+    def add_observer(self, callback):
+        """callback(record) is called for every record added"""
+        self.observers.append(callback)
+
+    def _add(self, record):
+        self.records.append(record)
+        for callback in self.observers:
+            callback(record)
+
+    @contextmanager
+    def stage(self, name, cast=None, rows=None, bytes_read=None, bytes_written=None):
+        """
+        Time the enclosed block as stage name of cast.  The record is yielded so
+        rows/bytes known only at the end of the stage can be filled in.  A stage
+        that raises is recorded with 'error' set before the error is passed on.
+        """
+        record = {'cast': cast, 'stage': name, 'start': time.time(), 'seconds': None,
+                  'rows': rows, 'bytes_read': bytes_read, 'bytes_written': bytes_written,
+                  'pid': os.getpid()}
+        try:
+            yield record
+        except Exception as err:
+            record['error'] = repr(err)
+            raise
+        finally:
+            record['seconds'] = time.time() - record['start']
+            self._add(record)
+
+    @contextmanager
+    def profile(self, cast):
+        """cProfile the enclosed block into profile_dir/<cast>.prof (no-op without profile_dir)"""
+        if self.profile_dir is None:
+            yield
+            return
+
+        import cProfile
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(self.profile_dir, str(cast) + '.prof'))
+
+    def extend(self, records):
+        """merge records collected elsewhere (e.g. by a worker process)"""
+        for record in records:
+            self._add(record)
+
+    def summary(self):
+        """
+        Totals per stage, in order of first appearance
+
+        Returns a list of dicts {'stage', 'count', 'seconds', 'rows', 'bytes_read', 'bytes_written'}
+        """
+        stages, totals = [], {}
+        for record in self.records:
+            if record['stage'] not in totals:
+                stages.append(record['stage'])
+                totals[record['stage']] = {'stage': record['stage'], 'count': 0, 'seconds': 0.,
+                                           'rows': 0, 'bytes_read': 0, 'bytes_written': 0}
+            total = totals[record['stage']]
+            total['count'] += 1
+            total['seconds'] += record['seconds']
+            for key in ('rows', 'bytes_read', 'bytes_written'):
+                total[key] += record[key] or 0
+        return [totals[stage] for stage in stages]
+
+    def report(self):
+        """print the per stage summary, slowest stage first"""
+        summary = sorted(self.summary(), key=lambda total: -total['seconds'])
+        elapsed = sum(total['seconds'] for total in summary)
+        print "\n{0:<18}{1:>7}{2:>11}{3:>8}{4:>12}{5:>12}".format(
+            'stage', 'casts', 'seconds', '%', 'MB read', 'MB written')
+        for total in summary:
+            print "{stage:<18}{count:>7}{seconds:>11.3f}{percent:>8.1f}{read:>12.2f}{written:>12.2f}".format(
+                percent=(100. * total['seconds'] / elapsed) if elapsed else 0.,
+                read=total['bytes_read'] / 1e6, written=total['bytes_written'] / 1e6,
+                **total)
+
+    def trace_events(self):
+        """records as complete ('X') events of the chrome://tracing Trace Event format"""
+        events = []
+        for record in self.records:
+            args = dict((key, value) for key, value in record.items()
+                        if key not in ('stage', 'start', 'seconds', 'pid') and value is not None)
+            events.append({'name': record['stage'], 'cat': 'ctd2nc', 'ph': 'X',
+                           'ts': int(record['start'] * 1e6), 'dur': int(record['seconds'] * 1e6),
+                           'pid': record['pid'], 'tid': 0, 'args': args})
+        return events
+
+    def write_trace(self, fname):
+        """save records and trace events as json"""
+        with open(fname, 'w') as fhandle:
+            json.dump({'records': self.records, 'summary': self.summary(),
+                       'traceEvents': self.trace_events()}, fhandle, indent=1)
@@ -17,6 +17,15 @@
  ------
 Follow the format of the CruiseTimelinePlanning_template.csv
 
+ python CruiseTimeline.py /path/to/2015ChuckchiProposalTransects.xlsx --speed 7 --start 2015-08-01T08:00
+
+ from CruiseTimeline import stations_from_rows, plan_timeline
+ timeline = plan_timeline(stations_from_rows(readXlsx(xlsx_file)), BathymetryLookup(*etopo5_data()))
+
+ plan_timeline works on the whole station table at once (DataFrame columns for
+ depth, leg distance, transit and operation hours and the cumulative timeline),
+ replanning only needs the edited table and the same BathymetryLookup.
+
  Original code reference:
  ------------------------
 
@@ -31,13 +40,12 @@ import collections
 
 #Science Stack
 import numpy as np
-from netCDF4 import Dataset
+from pandas import DataFrame
 
 # User Stack
-import general_utilities.haversine as sphered
-
-# Visual Stack
-from mpl_toolkits.basemap import shiftgrid
+from calc import geodesy
+from calc.bathymetry import BathymetryLookup
+from io_utils.bathy_grids import etopo5_data
 
 
 __author__   = 'Shaun Bell'
@@ -101,25 +109,6 @@ def readXlsx(fileName,**args):
  z.close()
  return rows
 
-"""------------------------- Topo   Modules --------------------------------"""
-
-def etopo5_data():
-    """ read in etopo5 topography/bathymetry. """
-    #file = '/Users/bell/Data_Local/MapGrids/etopo5.nc'
-    ncdata = '/Users/bell/Programs/Python/AtSeaPrograms/data/etopo5.nc'
-    etopodata = Dataset(ncdata)
-    
-    topoin = etopodata.variables['bath'][:]
-    lons = etopodata.variables['X'][:]
-    lats = etopodata.variables['Y'][:]
-    etopodata.close()
-    
-    topoin,lons = shiftgrid(0.,topoin,lons,start=False) # -360 -> 0
-    
-    lons, lats = np.meshgrid(lons, lats)
-    
-    return(topoin, lats, lons)
-    
 """------------------------- General   Modules -----------------------------"""
 
 def data_ingest(file_in):
@@ -163,6 +152,9 @@ def tunnel_fast(latvar,lonvar,lat0,lon0):
     Returns iy,ix such that the square of the tunnel distance
     between (latval[it,ix],lonval[iy,ix]) and (lat0,lon0)
     is minimum.
+
+    Recomputes the distance to every grid node on each call, use
+    calc.bathymetry.BathymetryLookup for more than one point.
     '''
     pi = np.pi
     
@@ -196,78 +188,262 @@ def naive_fast(latvar,lonvar,lat0,lon0):
     
 """-------------------------------------------------------------------------"""
 
-W = readXlsx('/Users/bell/Documents/EcoFOCI Docs/maps/ArcticChuckchiMaps/2015ChuckchiProposalTransects.xlsx', sheet=1)
+"""------------------------- Station Time Planning -------------------------"""
 
-ship_speed_kts = 7 #knots
-ship_speed_kmhr = ship_speed_kts * 1.852 #knots to km/hr conversion
+SHIP_SPEED_KTS = 7 #knots
+KNOTS2KMHR = 1.852 #knots to km/hr conversion
 
-operation_speed = {'ctd_cast': -20, 'plankton_tow': -20} #in meters/min
+OPERATION_SPEED = {'ctd_cast': -20, 'plankton_tow': -20} #in meters/min
 
-(topoin, elats, elons) = etopo5_data()
+# spreadsheet name: (operation_speed key, deepest cast/tow in m)
+OPERATIONS = {'CTD': ('ctd_cast', -1510), 'Bongo': ('plankton_tow', -310)}
+OPERATION_COLUMNS = ('op1', 'op2', 'op3')
+MIN_OPERATION_DEPTH = -10 #no operations at shallow depths
 
-for index, row in enumerate(W):
-    if index <=1:
-        continue
-    try:
-        if row['H'] == '1': #port of call
-            print ("calculating parameters for station {0} at Lat {1} Lon {2} ").format(row['B'], \
-            row['D'], row['C'])
-            origin = [np.float(row['D']),np.float(row['C'])]
-    
-            #find depth 
-            iy_min,ix_min = tunnel_fast(elats,elons,origin[0], -1 * origin[1])
-            Depth = topoin[iy_min,ix_min]
-            print ("Depth is {0} at lat {1}, lon{2} \n").format(Depth, elats[iy_min,ix_min], elons[iy_min,ix_min])
-        
-        else: #all subsequent stations
-            print ("calculating parameters for station {0} at Lat {1} Lon {2} ").format(row['B'], \
-            row['D'], row['C'])
+def stations_from_rows(rows, header_rows=2):
+    """
+    station table from readXlsx rows (B station, C longitude west positive,
+    D latitude, H '1' for a port of call, I/J/K operations)
 
-            destination = [np.float(row['D']),np.float(row['C'])]
-        
-            #find depth 
-            iy_min,ix_min = tunnel_fast(elats,elons,destination[0], -1 * destination[1])
-            Depth = topoin[iy_min,ix_min]
-            print ("Depth is {0} at lat {1}, lon{2} \n").format(Depth, elats[iy_min,ix_min], elons[iy_min,ix_min])
-
-            Distance2Station = sphered.distance(origin,destination)
-            print ("Distance to station is {0} km").format(Distance2Station)
-
-            TimeofTransit = Distance2Station / ship_speed_kmhr
-            print ("Transit Time at {0} km/hr ({1} knots) will be {2} hr \n").format(ship_speed_kmhr, ship_speed_kts, TimeofTransit)
-
-            #operations time
-            station_elapsed_time = 0.0 #hours
-            if Depth < -10: #no operations at shallow depths
-            
-                if Depth < -1510: #max plankton tow
-                    op_depth = -1510
-                else:
-                    op_depth = Depth
-                if (row['I'] == 'CTD'):
-                    station_elapsed_time = station_elapsed_time + (op_depth +10)*2. / (operation_speed['ctd_cast']*60.)
-                if (row['J'] == 'CTD'):
-                    station_elapsed_time = station_elapsed_time + (op_depth +10)*2. / (operation_speed['ctd_cast']*60.)
-                if (row['K'] == 'CTD'):
-                    station_elapsed_time = station_elapsed_time + (op_depth +10)*2. / (operation_speed['ctd_cast']*60.)
-
-                if Depth < -310: #max plankton tow
-                    op_depth = -310
-                else:
-                    op_depth = Depth
-                if (row['I'] == 'Bongo'):
-                    station_elapsed_time = station_elapsed_time + (op_depth +10)*2. / (operation_speed['plankton_tow']*60.)
-                if (row['J'] == 'Bongo'):
-                    station_elapsed_time = station_elapsed_time + (op_depth +10)*2. / (operation_speed['plankton_tow']*60.)
-                if (row['K'] == 'Bongo'):
-                    station_elapsed_time = station_elapsed_time + (op_depth +10)*2. / (operation_speed['plankton_tow']*60.)
-
-            print ("Operation Time at station assuming {0} m/min for ctd and 10m off " 
-                    "bottom  or 1500m and plankton tow at {0} m/min to 300m or 10m off bottom is "
-                    "{2} hr \n").format(operation_speed['plankton_tow'], operation_speed['ctd_cast'], station_elapsed_time)
-
-            #make origin the destination
-            TimeonStation = station_elapsed_time
+    Rows without a station position are left out, as the original row by
+    row planner skipped them.
+
+    Returns
+    -------
+    Outputs : DataFrame
+              station, latitude, longitude, port, op1, op2, op3
+    """
+    table = collections.OrderedDict((column, []) for column in
+                                    ('station', 'latitude', 'longitude', 'port') + OPERATION_COLUMNS)
+    for row in rows[header_rows:]:
+        try:
+            latitude, longitude = float(row['D']), float(row['C'])
+        except (KeyError, ValueError):
+            continue
+        table['station'].append(row.get('B', ''))
+        table['latitude'].append(latitude)
+        table['longitude'].append(longitude)
+        table['port'].append(row.get('H') == '1')
+        for column, letter in zip(OPERATION_COLUMNS, ('I', 'J', 'K')):
+            table[column].append(row.get(letter, ''))
+    return DataFrame(table)
+
+def plan_timeline(stations, bathy, ship_speed_kts=SHIP_SPEED_KTS, operation_speed=OPERATION_SPEED,
+                  start=None):
+    """
+    Depth, leg distance, transit and operation time of every station at once
+
+    Parameters
+    ----------
+    stations : DataFrame or dict of columns
+        station, latitude, longitude (degrees west positive), port (True at a
+        port of call, the leg into it is not steamed) and the operation columns
+        OPERATION_COLUMNS ('CTD', 'Bongo' or anything else for none)
+    bathy : calc.bathymetry.BathymetryLookup
+        ETOPO5 (or any) bathymetry, negative down, east longitudes
+    ship_speed_kts : float
+    operation_speed : dict
+        wire speed (m/min, negative down) of the OPERATIONS
+    start : datetime.datetime
+        departure from the first station, adds arrival and departure columns
+
+    Returns
+    -------
+    Outputs : DataFrame
+              the stations with depth (m), distance (km), transit_hr, one
+              <operation>_hr column per OPERATIONS entry, station_hr and the
+              cumulative arrival_hr/departure_hr since the first station
+
+    Casts and tows run 10m off the bottom (or to their deepest depth) and back
+    at operation_speed, none are done at ports or shallower than 10m.
+    """
+    timeline = DataFrame(stations).reset_index(drop=True)
+    lats = np.asarray(timeline['latitude'], dtype=float)
+    lons = np.asarray(timeline['longitude'], dtype=float)
+    port = np.asarray(timeline['port'], dtype=bool)
+
+    timeline['depth'] = bathy.nearest(lats, -1 * lons)
+
+    distance = np.zeros(lats.size)
+    distance[1:] = geodesy.consecutive(lats, lons)
+    distance[port] = 0.
+    timeline['distance'] = distance
+    timeline['transit_hr'] = distance / (ship_speed_kts * KNOTS2KMHR)
+
+    depth = np.asarray(timeline['depth'], dtype=float)
+    working = (depth < MIN_OPERATION_DEPTH) & ~port
+    station_hr = np.zeros(lats.size)
+    for name in sorted(OPERATIONS):
+        speed_key, max_depth = OPERATIONS[name]
+        count = np.zeros(lats.size)
+        for column in OPERATION_COLUMNS:
+            if column in timeline:
+                count += np.asarray(timeline[column] == name)
+        op_depth = np.maximum(depth, max_depth)
+        op_hr = np.where(working, count * (op_depth + 10) * 2. / (operation_speed[speed_key] * 60.), 0.)
+        timeline[name + '_hr'] = op_hr
+        station_hr += op_hr
+    timeline['station_hr'] = station_hr
+
+    timeline['departure_hr'] = np.cumsum(timeline['transit_hr'] + station_hr)
+    timeline['arrival_hr'] = timeline['departure_hr'] - station_hr
+    if start is not None:
+        timeline['arrival'] = [start + datetime.timedelta(hours=hr) for hr in timeline['arrival_hr']]
+        timeline['departure'] = [start + datetime.timedelta(hours=hr) for hr in timeline['departure_hr']]
+    return timeline
+
+"""------------------------------- Tests -----------------------------------"""
+# run with: python CruiseTimeline.py --test
+
+def _row_by_row(stations, bathy, ship_speed_kts=SHIP_SPEED_KTS, operation_speed=OPERATION_SPEED):
+    """
+    station hours and transit hours from a row by row loop shaped like the
+    original script, but with the same BathymetryLookup and geodesy.distance as
+    plan_timeline, so it only checks the vectorization (the hours themselves
+    are checked against hand worked values in test_plan_timeline_fixture)
+    """
+    ship_speed_kmhr = ship_speed_kts * KNOTS2KMHR
+    station_hr, transit_hr = [], []
+    for index, row in DataFrame(stations).iterrows():
+        destination = [row['latitude'], row['longitude']]
+        Depth = bathy.nearest(destination[0], -1 * destination[1])
+        if row['port']:
+            station_hr.append(0.)
+            transit_hr.append(0.)
             origin = destination
-    except:
-        continue
\ No newline at end of file
+            continue
+        transit_hr.append(geodesy.distance(origin, destination) / ship_speed_kmhr)
+        station_elapsed_time = 0.0
+        if Depth < -10:
+            for name in ('CTD', 'Bongo'):
+                speed_key, max_depth = OPERATIONS[name]
+                op_depth = max(Depth, max_depth)
+                for column in OPERATION_COLUMNS:
+                    if row[column] == name:
+                        station_elapsed_time += (op_depth + 10) * 2. / (operation_speed[speed_key] * 60.)
+        station_hr.append(station_elapsed_time)
+        origin = destination
+    return (np.array(station_hr), np.array(transit_hr))
+
+def test_plan_timeline(size=200, seed=0):
+    """vectorized plan matches a row by row loop over the same stations"""
+    rand = np.random.RandomState(seed)
+    lats, lons = np.arange(50., 75., 0.5), np.arange(-180., -130., 0.5)
+    bathy = BathymetryLookup(rand.uniform(-3000., 50., (lats.size, lons.size)), lats, lons)
+    stations = {'station': [str(ind) for ind in range(size)],
+                'latitude': rand.uniform(55., 72., size), 'longitude': rand.uniform(140., 175., size),
+                'port': rand.uniform(size=size) < 0.05}
+    stations['port'][0] = True
+    for column in OPERATION_COLUMNS:
+        stations[column] = rand.choice(['CTD', 'Bongo', ''], size)
+
+    timeline = plan_timeline(stations, bathy, start=datetime.datetime(2015, 8, 1))
+    (station_hr, transit_hr) = _row_by_row(stations, bathy)
+    assert np.allclose(timeline['station_hr'], station_hr)
+    assert np.allclose(timeline['transit_hr'], transit_hr)
+    assert np.allclose(timeline['departure_hr'].iloc[-1], (station_hr + transit_hr).sum())
+    assert timeline['arrival'].iloc[0] == datetime.datetime(2015, 8, 1)
+
+def test_plan_timeline_fixture():
+    """
+    hours of a small cruise worked out from the original script's formulas:
+    depth from tunnel_fast on the grid, haversine legs at 7 knots and
+    (op_depth + 10) * 2 / (-20 m/min * 60) per cast or tow, CTD to 1510m, Bongo
+    to 310m, nothing shallower than 10m or at a port
+    """
+    lats, lons = np.arange(59., 65., 0.5), np.arange(-172., -164., 0.5)
+    topo = np.zeros((lats.size, lons.size)) - 100.
+    glons, glats = np.meshgrid(lons, lats)
+    # port, shelf, slope (both caps), Bongo cap only, too shallow, port
+    positions = [(60., 170.), (61., 169.), (62., 168.), (62.5, 168.), (63., 167.), (63.5, 166.)]
+    depths = [-5., -50., -2000., -400., -8., -5.]
+    for (lat, lon), depth in zip(positions, depths):
+        topo[list(lats).index(lat), list(lons).index(-lon)] = depth
+    bathy = BathymetryLookup(topo, lats, lons)
+
+    # blank operation cells are left out of the rows, as readXlsx does
+    rows = [{}, {},
+            {'B': 'Dutch', 'D': '60', 'C': '170', 'H': '1'},
+            {'B': '1', 'D': '61', 'C': '169', 'I': 'CTD', 'J': 'Bongo'},
+            {'B': '2', 'D': '62', 'C': '168', 'I': 'CTD', 'J': 'CTD', 'K': 'Bongo'},
+            {'B': '3', 'D': '62.5', 'C': '168', 'I': 'Bongo', 'K': 'CTD'},
+            {'B': '4', 'D': '63', 'C': '167', 'I': 'CTD'},
+            {'B': 'Nome', 'D': '63.5', 'C': '166', 'H': '1', 'I': 'CTD'}]
+    timeline = plan_timeline(stations_from_rows(rows), bathy)
+
+    for (lat, lon), depth, planned in zip(positions, depths, timeline['depth']):
+        iy, ix = tunnel_fast(glats, glons, lat, -1 * lon)
+        assert topo[iy, ix] == depth == planned
+
+    # (-50 + 10) * 2 / -1200 each; (-1510 + 10) * 2 / -1200 = 2.5 twice and
+    # (-310 + 10) * 2 / -1200 = 0.5; 0.5 + (-400 + 10) * 2 / -1200 = 0.65
+    station_hr = [0., 2 * 40. / 600., 2 * 2.5 + 0.5, 0.5 + 0.65, 0., 0.]
+    assert np.allclose(timeline['station_hr'], station_hr)
+    assert np.allclose(timeline['CTD_hr'], [0., 40. / 600., 5., 0.65, 0., 0.])
+
+    rad = np.pi / 180.
+    transit_hr = [0.]
+    for (lat0, lon0), (lat1, lon1) in zip(positions[:-1], positions[1:]):
+        a = (np.sin((lat1 - lat0) * rad / 2.) ** 2 +
+             np.cos(lat0 * rad) * np.cos(lat1 * rad) * np.sin((lon1 - lon0) * rad / 2.) ** 2)
+        transit_hr.append(2. * 6371. * np.arcsin(np.sqrt(a)) / (7 * 1.852))
+    transit_hr[-1] = 0. # the leg into port is not steamed
+    assert np.allclose(timeline['transit_hr'], transit_hr)
+    # half a degree of latitude, 55.6 km at 12.964 km/hr
+    assert np.allclose(timeline['transit_hr'].iloc[3], 6371. * np.pi / 360. / 12.964)
+    assert np.allclose(timeline['departure_hr'].iloc[-1], sum(station_hr) + sum(transit_hr))
+
+def test_stations_from_rows():
+    """header rows and rows without a position are skipped"""
+    rows = [{}, {}, {'B': 'Dutch', 'C': '166.5', 'D': '53.9', 'H': '1'},
+            {'B': 'note'}, {'B': '1', 'C': '168.', 'D': '60.', 'I': 'CTD', 'K': 'Bongo'}]
+    stations = stations_from_rows(rows)
+    assert list(stations['station']) == ['Dutch', '1']
+    assert list(stations['port']) == [True, False]
+    assert list(stations['op1']) == ['', 'CTD'] and list(stations['op3']) == ['', 'Bongo']
+
+"""-------------------------------------------------------------------------"""
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cruise timeline from a station planning spreadsheet')
+    parser.add_argument('XlsxFile', metavar='XlsxFile', type=str, nargs='?',
+                        help='full path to the station .xlsx (stations from the third row)')
+    parser.add_argument('--sheet', type=int, default=1, help='worksheet number')
+    parser.add_argument('--speed', type=float, default=SHIP_SPEED_KTS, help='ship speed in knots')
+    parser.add_argument('--start', type=str, help='departure time yyyy-mm-ddTHH:MM')
+    parser.add_argument('--etopo', type=str, help='ETOPO5 netcdf file')
+    parser.add_argument('--csv', type=str, help='save the timeline as csv')
+    parser.add_argument('--test', action='store_true', help='run the tests')
+    args = parser.parse_args()
+
+    if args.test:
+        for test in (test_plan_timeline, test_plan_timeline_fixture, test_stations_from_rows):
+            test()
+            print "{0}: ok".format(test.__name__)
+        return
+    if args.XlsxFile is None:
+        parser.error('XlsxFile is required unless --test is given')
+
+    start = None
+    if args.start:
+        start = datetime.datetime.strptime(args.start, '%Y-%m-%dT%H:%M')
+
+    stations = stations_from_rows(readXlsx(args.XlsxFile, sheet=args.sheet))
+    if args.etopo:
+        (topoin, elats, elons) = etopo5_data(args.etopo)
+    else:
+        (topoin, elats, elons) = etopo5_data()
+    bathy = BathymetryLookup(topoin, elats, elons)
+
+    timeline = plan_timeline(stations, bathy, ship_speed_kts=args.speed, start=start)
+    print timeline.to_string()
+    print ("\nTotal {0:.1f} km, {1:.1f} hr transit at {2} knots and {3:.1f} hr on station, "
+           "{4:.1f} days").format(timeline['distance'].sum(), timeline['transit_hr'].sum(), args.speed,
+                                  timeline['station_hr'].sum(), timeline['departure_hr'].iloc[-1] / 24.)
+    if args.csv:
+        timeline.to_csv(args.csv, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -14,16 +14,20 @@ import datetime
 
 #Science Stack
 import numpy as np
-from netCDF4 import Dataset
 from scipy.interpolate import griddata
 
 #Visual Packages
 import matplotlib as mpl
 mpl.use('Agg') 
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap, shiftgrid
+from mpl_toolkits.basemap import Basemap
 import brewer2mpl
 
+#User Stack
+from io_utils.bathy_grids import map_bounds
+from io_utils.bathy_pyramid import load_pyramid, map_level
+from io_utils.map_cache import project_grid
+
 __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2014, 05, 22)
@@ -36,38 +40,6 @@ __keywords__ = 'CTD', 'Cruise Map', 'Cruise', 'MySQL'
 """------------------------------------- MAPS -----------------------------------------"""
 
 
-def etopo5_data():
-    """ read in etopo5 topography/bathymetry. """
-    file = 'data/etopo5.nc'
-    etopodata = Dataset(file)
-    
-    topoin = etopodata.variables['bath'][:]
-    lons = etopodata.variables['X'][:]
-    lats = etopodata.variables['Y'][:]
-    etopodata.close()
-    
-    topoin,lons = shiftgrid(0.,topoin,lons,start=False) # -360 -> 0
-    
-    #lons, lats = np.meshgrid(lons, lats)
-    
-    return(topoin, lats, lons)
-    
-def IBCAO_data():
-    """ read in IBCAO topography/bathymetry. """
-    file_in = '/Users/bell/Data_Local/MapGrids/ARDEMv2.0.nc'
-    IBCAOtopodata = Dataset(file_in)
-    
-    topoin = IBCAOtopodata.variables['z'][:]
-    lons = IBCAOtopodata.variables['lon'][:] #degrees east
-    lats = IBCAOtopodata.variables['lat'][:]
-    IBCAOtopodata.close()
-    
-    #topoin,lons = shiftgrid(0.,topoin,lons,start=False) # -360 -> 0
-    
-    #lons, lats = np.meshgrid(lons, lats)
-    
-    return(topoin, lats, lons)
-
 def find_nearest(a, a0):
     "Element in nd array `a` closest to the scalar value `a0`"
     idx = np.abs(a - a0).argmin()
@@ -165,16 +137,17 @@ if not no_ice:
 
 #IBCAO contour data 
 
-(topoin, elats, elons) = IBCAO_data()
-
 fig = plt.figure()
 ax = plt.subplot(111)
 #m = Basemap(resolution='i',projection='merc', llcrnrlat=64, \
 #    urcrnrlat=77,llcrnrlon=180,urcrnrlon=215,lat_ts=45)
 m = Basemap(resolution='i',projection='stere',width=1500000, height=1710000, lat_0=68,lon_0=191)
             
-elons, elats = np.meshgrid(elons, elats)
-ex, ey = m(elons, elats)
+#coarsest grid that still resolves the saved figure (1.5 x default size at 300 dpi)
+level = map_level(load_pyramid('ibcao', bounds=map_bounds(m)), m, width_px=fig.get_figwidth() * 1.5 * 300)
+topoin = level['topo']
+elons, elats = np.meshgrid(level['lons'], level['lats'])
+ex, ey = project_grid(m, elons, elats)
 
 #colorbrewer scheme
 bmap = brewer2mpl.get_map('Greys','Sequential',9,reverse=True)
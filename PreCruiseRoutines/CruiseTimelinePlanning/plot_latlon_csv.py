@@ -14,15 +14,18 @@ import argparse
 
 #Science Stack
 import numpy as np
-from netCDF4 import Dataset
 
 #Visual Packages
 import matplotlib as mpl
 mpl.use('Agg') 
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap, shiftgrid
+from mpl_toolkits.basemap import Basemap
 import brewer2mpl
 
+#User Stack
+from io_utils.bathy_grids import etopo5_data, IBCAO_data, map_bounds
+from io_utils.map_cache import project_grid
+
 __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2014, 05, 22)
@@ -33,42 +36,6 @@ __keywords__ = 'CTD', 'Cruise Map', 'Cruise', 'MySQL'
 
 
 
-"""------------------------------------- MAPS -----------------------------------------"""
-
-def IBCAO_data():
-    """ read in IBCAO topography/bathymetry. """
-    file_in = '/Users/bell/Data_Local/MapGrids/ARDEMv2.0.nc'
-    IBCAOtopodata = Dataset(file_in)
-    
-    topoin = IBCAOtopodata.variables['z'][:]
-    lons = IBCAOtopodata.variables['lon'][:] #degrees east
-    lats = IBCAOtopodata.variables['lat'][:]
-    IBCAOtopodata.close()
-    
-    #topoin,lons = shiftgrid(0.,topoin,lons,start=False) # -360 -> 0
-    
-    #lons, lats = np.meshgrid(lons, lats)
-    
-    return(topoin, lats, lons)
-
-def etopo5_data():
-    """ read in etopo5 topography/bathymetry. """
-    file = '/Users/bell/Programs/Python/AtSeaPrograms/data/etopo5.nc'
-    etopodata = Dataset(file)
-    
-    topoin = etopodata.variables['bath'][:]
-    lons = etopodata.variables['X'][:]
-    lats = etopodata.variables['Y'][:]
-    etopodata.close()
-    
-    topoin,lons = shiftgrid(0.,topoin,lons,start=False) # -360 -> 0
-    
-    #lons, lats = np.meshgrid(lons, lats)
-    
-    return(topoin, lats, lons)
-
-"""------------------------------------------------------------------------------------"""
-
 parser = argparse.ArgumentParser(description='Plot Arctic/Bering CSV lat/lons')
 parser.add_argument('DataPath', metavar='DataPath', type=str,help='full path to .csv file')
 parser.add_argument('OutPath', metavar='OutPath', type=str,help='full path to save location')
@@ -84,17 +51,15 @@ for line in fh:
     csv_lats.append(float(line.strip().split(',')[0].strip()))
     csv_lons.append(float(line.strip().split(',')[1].strip()))
 ###
-(topoin, elats, elons) = etopo5_data()
-#(topoin, elats, elons) = IBCAO_data()
-
 fig = plt.figure()
 ax = plt.subplot(111)
 #m = Basemap(resolution='i',projection='merc', llcrnrlat=64, \
 #    urcrnrlat=77,llcrnrlon=180,urcrnrlon=215,lat_ts=45)
 m = Basemap(resolution='i',projection='stere',width=2000000, height=2000000, lat_0=70,lon_0=191)
             
-elons, elats = np.meshgrid(elons, elats)
-ex, ey = m(elons, elats)
+(topoin, elats, elons) = etopo5_data(bounds=map_bounds(m), meshgrid=True)
+#(topoin, elats, elons) = IBCAO_data(bounds=map_bounds(m), meshgrid=True)
+ex, ey = project_grid(m, elons, elats)
 
 #colorbrewer scheme
 bmap = brewer2mpl.get_map('Greys','Sequential',9,reverse=True)
@@ -20,15 +20,18 @@ import pymysql
 
 #Science Stack
 import numpy as np
-from netCDF4 import Dataset
 
 #Visual Packages
 import matplotlib as mpl
 mpl.use('Agg') 
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap, shiftgrid
+from mpl_toolkits.basemap import Basemap
 import brewer2mpl
 
+#User Stack
+from io_utils.bathy_grids import etopo5_data, map_bounds
+from io_utils.map_cache import project_grid
+
 __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2014, 05, 22)
@@ -78,22 +81,6 @@ def read_data(db, cursor, table):
 
 """------------------------------------- MAPS -----------------------------------------"""
 
-def etopo5_data(filein='/Users/bell/in_and_outbox/Ongoing_Analysis/MapGrids/etopo5.nc'):
-    """ read in etopo5 topography/bathymetry. """
-
-    etopodata = Dataset(filein)
-    
-    topoin = etopodata.variables['bath'][:]
-    lons = etopodata.variables['X'][:]
-    lats = etopodata.variables['Y'][:]
-    etopodata.close()
-    
-    topoin,lons = shiftgrid(0.,topoin,lons,start=False) # -360 -> 0
-    
-    #lons, lats = np.meshgrid(lons, lats)
-    
-    return(topoin, lats, lons)
-
 def sqldate2GEdate(castdate,casttime):
 
     try:
@@ -122,8 +109,6 @@ def convert_timedelta(duration):
 
 """------------------------------------- Main -----------------------------------------"""
 
-(topoin, elats, elons) = etopo5_data()
-
    
 table='all_iconic_lines'
 
@@ -149,8 +134,9 @@ m = Basemap(resolution='i',projection='merc', llcrnrlat=cast_lat.min()-2.5, \
     urcrnrlat=cast_lat.max()+2.5,llcrnrlon=-1*(cast_lon.max()+5),urcrnrlon=-1*(cast_lon.min()-5),\
     lat_ts=45)
       
-elons, elats = np.meshgrid(elons, elats)
-ex, ey = m(elons, elats)
+(topoin, elats, elons) = etopo5_data('/Users/bell/in_and_outbox/Ongoing_Analysis/MapGrids/etopo5.nc',
+                                     bounds=map_bounds(m), meshgrid=True)
+ex, ey = project_grid(m, elons, elats)
 
 
 #colorbrewer scheme
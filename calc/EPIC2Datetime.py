@@ -4,16 +4,25 @@ r'''Module to convert PMEL-EPIC timeword to a python datetime
     Modifications
     -------------
     2016-11-14: SBELL - create routine to add datetime offset
+    2016-12-05: SBELL - numpy (datetime64) versions EPIC2Datetime64 and Datetime642EPIC,
+                        EPIC2Datetime and Datetime2EPIC use them (no per element loops)
+    2016-12-12: SBELL - integer time core moved to calc/epic_time.py, EPIC2Datetime and
+                        Datetime2EPIC keep milliseconds
 
 '''
+from __future__ import absolute_import
+
 import datetime
+import numpy as np
 from netCDF4 import date2num
 
+from calc.epic_time import EPIC2Datetime64, Datetime642EPIC, MS_PER_DAY
+
 __author__   = 'Shaun Bell'
 __email__    = 'shaun.bell@noaa.gov'
 __created__  = datetime.datetime(2016, 7, 21)
 __modified__ = datetime.datetime(2016, 7, 21)
-__version__  = "0.1.0"
+__version__  = "0.3.0"
 __status__   = "Development"
 
 def EPIC2Datetime( timeword_1, timeword_2):
@@ -82,13 +91,10 @@ def EPIC2Datetime( timeword_1, timeword_2):
     #Using a more modern reference date skips this problem and is sufficient if the dates of all data
     #   are after 1582.
 
-    ref_time_dt = datetime.datetime(1968, 5, 23)
-    ref_time_epic = 2440000
+    #
+    #time2 is kept to the millisecond (integer arithmetic in calc/epic_time.py)
 
-    delta_days = [x - ref_time_epic for x in timeword_1]
-    delta_seconds = [x/1000 for x in timeword_2]
-    
-    epic_dt = [ref_time_dt + datetime.timedelta(a,c) for a,c in zip(delta_days,delta_seconds)]
+    epic_dt = EPIC2Datetime64(timeword_1, timeword_2).tolist()
 
     return(epic_dt)
 
@@ -128,7 +134,7 @@ def Datetime2EPIC(epic_dt):
 
     Parameters
     ----------
-    epic_dt : array of datetime objects
+    epic_dt : datetime, list of datetime objects or ndarray (datetime64 or datetime objects)
               Python datetime structure representing the EPIC datetime
 
     
@@ -137,25 +143,22 @@ def Datetime2EPIC(epic_dt):
     Outputs : array_like    (time, time1)
               time: array of integer values representing true julian day
               time1: array of integer values representing milliseconds since 00:00 UTC
+              (ints for a single datetime, lists for a list, int32 arrays for an array)
 
     '''
 
-    ref_time_py = datetime.datetime.toordinal(datetime.datetime(1968, 5, 23))
-    ref_time_epic = 2440000
-    offset = ref_time_epic - ref_time_py
-
-    if not isinstance(epic_dt,list):
-        time = offset + epic_dt.toordinal()
-        time1 = int((epic_dt.hour * (60. * 60. * 1000.)) + \
-                (epic_dt.minute * (60. * 1000.)) + \
-                (epic_dt.second * (1000.))) 
-    else:
-        time = [offset + x.toordinal() for x in epic_dt]
-        time1 = [int((x.hour * (60. * 60. * 1000.)) + \
-                (x.minute * (60. * 1000.)) + \
-                (x.second * (1000.))) for x in epic_dt]
+    is_array = isinstance(epic_dt, np.ndarray)
+    is_list = isinstance(epic_dt, list)
+
+    #milliseconds are kept, microseconds dropped (integer arithmetic in calc/epic_time.py)
+    time, time1 = Datetime642EPIC(epic_dt)
+
+    if is_array:
+        return(time, time1)
+    if not is_list:
+        return(int(time), int(time1))
     
-    return(time, time1 )
+    return(time.tolist(), time1.tolist() )
 
 """------------------------------------------------------------------------------------------------"""
 def main():
@@ -187,5 +190,16 @@ def test_2d_EPIC():
     testdate1 = Datetime2EPIC(testdate)
     print testdate1
 
+def test_datetime64():
+    time = np.arange(2440000, 2460000, 7, dtype=np.int32)
+    time2 = (np.arange(time.size, dtype=np.int64) * 7919993) % MS_PER_DAY
+    dt64 = EPIC2Datetime64(time, time2)
+    time_rt, time2_rt = Datetime642EPIC(dt64)
+    assert (time_rt == time).all() and (time2_rt == time2).all()
+    # the datetime based list API round trips to the millisecond
+    assert EPIC2Datetime(time[:50], time2[:50]) == dt64[:50].tolist()
+    assert Datetime2EPIC(EPIC2Datetime(time[:50], time2[:50])) == (time[:50].tolist(), time2[:50].tolist())
+    print "{0} values round trip".format(time.size)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,281 @@
+# filename: bathymetry.py
+r'''Depth lookup on bathymetry/topography grids (ETOPO5, IBCAO, ARDEM)
+
+    The grid is indexed once when the lookup is built, after which any number of
+    stations are answered in one (vectorized) call:
+
+    regular lat/lon grids (1D axes or their meshgrid) -- direct index arithmetic on
+        the grid spacing, periodic in longitude for global grids
+    irregular/curvilinear grids -- unit sphere (x, y, z) of every node is computed
+        once and queried with a scipy cKDTree (minimum tunnel distance, same
+        result as CruiseTimeline.tunnel_fast)
+
+    Query longitudes may be given in either -180/180 or 0/360 convention.
+
+    Usage
+    -----
+    from calc.bathymetry import BathymetryLookup
+
+    bathy = BathymetryLookup(topoin, elats, elons)
+    depth = bathy.depth(station_lats, station_lons)                   #nearest grid point
+    depth = bathy.depth(station_lats, station_lons, method='bilinear')
+
+    Run this file to execute the doctests and the randomized tests.
+
+    Modifications
+    -------------
+    2016-12-12: SBELL - reusable, batched replacement for per station tunnel_fast
+
+'''
+import datetime
+import numpy as np
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+"""------------------------------------- Helpers ------------------------------------------------"""
+
+def latlon2xyz(lat, lon):
+    r'''
+    Unit sphere cartesian coordinates of lat/lon in degrees, stacked on the last axis
+
+    >>> latlon2xyz([0., 90.], [90., 0.]).round(12) + 0.
+    array([[0., 1., 0.],
+           [0., 0., 1.]])
+    '''
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    clat = np.cos(lat)
+    return np.stack((clat * np.cos(lon), clat * np.sin(lon), np.sin(lat)), axis=-1)
+
+def _regular_step(axis, rtol=1e-6):
+    '''constant spacing of a 1D axis, None if the axis is not evenly spaced'''
+    if axis.size < 2:
+        return None
+    steps = np.diff(axis)
+    step = (axis[-1] - axis[0]) / (axis.size - 1.)
+    if step == 0 or not np.allclose(steps, step, rtol=rtol, atol=0):
+        return None
+    return step
+
+def _separable(lats, lons):
+    '''1D axes of a meshgrid style pair of 2D lat/lon arrays, None if not a meshgrid'''
+    lat_axis, lon_axis = lats[:, 0], lons[0, :]
+    if (lats == lat_axis[:, np.newaxis]).all() and (lons == lon_axis[np.newaxis, :]).all():
+        return lat_axis, lon_axis
+    return None
+
+"""------------------------------------- Lookup -------------------------------------------------"""
+
+class BathymetryLookup(object):
+    r'''
+    Batched nearest grid point / bilinear depth queries on a bathymetry grid
+
+    Parameters
+    ----------
+    topo : array_like (ny, nx)
+           depth/elevation, masked arrays are kept masked
+    lats, lons : array_like
+           1D axes (ny,) and (nx,) or 2D (ny, nx) coordinates of topo
+    use_kdtree : bool
+           irregular grids always use a KD-tree, True forces it also for regular
+           grids (exact minimum tunnel distance instead of nearest lat and lon)
+
+    Examples
+    --------
+    >>> lats, lons = np.arange(-90., 91., 10.), np.arange(-180., 180., 10.)
+    >>> topo = np.add.outer(lats, lons)
+    >>> bathy = BathymetryLookup(topo, lats, lons)
+    >>> bathy.nearest_index([56.1, -11.], [-164.4, 179.])
+    (array([15,  8]), array([2, 0]))
+    >>> bathy.depth([55.], [195.], method='bilinear')
+    array([-110.])
+    '''
+
+    def __init__(self, topo, lats, lons, use_kdtree=False):
+        self.topo = topo
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+
+        if lats.ndim == 2:
+            axes = _separable(lats, lons)
+            if axes is not None:
+                lats, lons = axes
+
+        self.regular, self.periodic = False, False
+        self.lat_axis = self.lon_axis = None
+        self.lats = self.lons = None
+        if lats.ndim == 2:
+            self.lats, self.lons = lats, lons
+        else:
+            self.lat_axis, self.lon_axis = lats, lons
+            self.dlat, self.dlon = _regular_step(lats), _regular_step(lons)
+            self.regular = self.dlat is not None and self.dlon is not None
+            # a global grid wraps around, the node after the last longitude is the first
+            self.periodic = self.dlon is not None and \
+                            abs(abs(self.dlon) * lons.size - 360.) < 1e-6 * 360.
+
+        self.shape = (lats.size, lons.size) if lats.ndim == 1 else lats.shape
+        if self.shape != np.shape(topo):
+            raise ValueError("topo shape {0} does not match coordinates {1}".format(
+                             np.shape(topo), self.shape))
+
+        self.tree = None
+        if use_kdtree or not self.regular:
+            self._build_tree(lats, lons)
+
+    def _build_tree(self, lats, lons):
+        '''unit sphere coordinates of all nodes (once) in a KD-tree'''
+        from scipy.spatial import cKDTree
+
+        if lats.ndim == 1:
+            lons, lats = np.meshgrid(lons, lats)
+        self.tree = cKDTree(latlon2xyz(lats.ravel(), lons.ravel()))
+
+    def _fractional_index(self, lat, lon):
+        '''position of lat/lon in units of grid cells from the first node'''
+        fy = (lat - self.lat_axis[0]) / self.dlat
+        # bring the query longitude to the convention of the grid
+        dlon = lon - self.lon_axis[0]
+        if self.dlon > 0:
+            fx = np.mod(dlon, 360.) / self.dlon
+        else:
+            fx = -np.mod(-dlon, 360.) / self.dlon
+        return fy, fx
+
+    def nearest_index(self, lat, lon):
+        r'''
+        Row and column index of the grid node nearest to each lat/lon
+
+        Returns
+        -------
+        Outputs : tuple of ndarray (iy, ix)
+                  int arrays of the broadcast shape of lat and lon
+        '''
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=np.float64),
+                                       np.asarray(lon, dtype=np.float64))
+        ny, nx = self.shape
+
+        if self.tree is not None:
+            dist, index = self.tree.query(latlon2xyz(lat.ravel(), lon.ravel()))
+            iy, ix = np.unravel_index(index, self.shape)
+            return iy.reshape(lat.shape), ix.reshape(lat.shape)
+
+        fy, fx = self._fractional_index(lat, lon)
+        iy = np.clip(np.rint(fy).astype(np.intp), 0, ny - 1)
+        ix = np.rint(fx).astype(np.intp)
+        if self.periodic:
+            ix = np.mod(ix, nx)
+        else:
+            # past the east edge but closer (across 360) to the west edge
+            wrap = fx - (nx - 1) > (360. / abs(self.dlon) - fx)
+            ix = np.where(wrap, 0, np.clip(ix, 0, nx - 1))
+        return iy, ix
+
+    def nearest(self, lat, lon):
+        '''depth at the grid node nearest to each lat/lon'''
+        iy, ix = self.nearest_index(lat, lon)
+        return self.topo[iy, ix]
+
+    def bilinear(self, lat, lon):
+        '''
+        Depth bilinearly interpolated between the four surrounding grid nodes
+        (regular grids only), values off the grid are held at the edge
+        '''
+        if not self.regular:
+            raise ValueError("bilinear interpolation needs a regular lat/lon grid")
+
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=np.float64),
+                                       np.asarray(lon, dtype=np.float64))
+        ny, nx = self.shape
+        fy, fx = self._fractional_index(lat, lon)
+
+        iy0 = np.clip(np.floor(fy).astype(np.intp), 0, ny - 2)
+        wy = np.clip(fy - iy0, 0., 1.)
+        ix0 = np.floor(fx).astype(np.intp)
+        if self.periodic:
+            ix0 = np.mod(ix0, nx)
+            ix1 = np.mod(ix0 + 1, nx)
+            wx = fx - np.floor(fx)
+        else:
+            ix0 = np.clip(ix0, 0, nx - 2)
+            ix1 = ix0 + 1
+            wx = np.clip(fx - ix0, 0., 1.)
+
+        topo = self.topo
+        return (topo[iy0, ix0] * (1. - wx) + topo[iy0, ix1] * wx) * (1. - wy) \
+             + (topo[iy0 + 1, ix0] * (1. - wx) + topo[iy0 + 1, ix1] * wx) * wy
+
+    def depth(self, lat, lon, method='nearest'):
+        '''depth at each lat/lon, method is 'nearest' or 'bilinear' '''
+        if method == 'nearest':
+            return self.nearest(lat, lon)
+        elif method == 'bilinear':
+            return self.bilinear(lat, lon)
+        raise ValueError("unknown method {0}".format(method))
+
+    def grid_point(self, iy, ix):
+        '''latitude and longitude of grid node(s) iy, ix'''
+        if self.lat_axis is None:
+            return self.lats[iy, ix], self.lons[iy, ix]
+        return self.lat_axis[iy], self.lon_axis[ix]
+
+"""------------------------------------- Tests --------------------------------------------------"""
+# randomized checks against a brute force search, run with: python bathymetry.py
+
+def _brute_nearest(lats, lons, lat0, lon0):
+    '''minimum tunnel distance over all nodes of a 2D grid (tunnel_fast)'''
+    dist_sq = ((latlon2xyz(lats, lons) - latlon2xyz(lat0, lon0)) ** 2).sum(axis=-1)
+    return np.unravel_index(dist_sq.argmin(), lats.shape)
+
+def test_nearest_regular(size=500, seed=0):
+    '''index arithmetic finds the node nearest in lat and in lon (either lon convention)'''
+    rand = np.random.RandomState(seed)
+    lats, lons = np.arange(-90., 90.1, 0.5), np.arange(0., 360., 0.5)
+    bathy = BathymetryLookup(np.zeros((lats.size, lons.size)), lats, lons)
+    lat0 = rand.uniform(-90., 90., size)
+    lon0 = rand.uniform(-180., 180., size)
+    iy, ix = bathy.nearest_index(lat0, lon0)
+    assert (np.abs(lats[iy] - lat0) <= 0.25 + 1e-9).all()
+    dlon = np.abs(np.mod(lons[ix] - lon0 + 180., 360.) - 180.)
+    assert (dlon <= 0.25 + 1e-9).all()
+
+def test_nearest_kdtree(size=200, seed=1):
+    '''KD-tree on a curvilinear grid matches the brute force tunnel distance search'''
+    rand = np.random.RandomState(seed)
+    lons, lats = np.meshgrid(np.linspace(-180., -140., 81), np.linspace(50., 75., 51))
+    lons = lons + 0.3 * np.sin(np.radians(lats) * 7.)  #not a meshgrid any more
+    bathy = BathymetryLookup(np.zeros(lats.shape), lats, lons)
+    lat0 = rand.uniform(50., 75., size)
+    lon0 = rand.uniform(-180., -140., size)
+    iy, ix = bathy.nearest_index(lat0, lon0)
+    for i in range(size):
+        assert (iy[i], ix[i]) == _brute_nearest(lats, lons, lat0[i], lon0[i])
+
+def test_bilinear_plane(size=500, seed=2):
+    '''bilinear interpolation of a plane is exact (also across the dateline)'''
+    rand = np.random.RandomState(seed)
+    lats, lons = np.arange(90., -90.1, -1.), np.arange(-180., 180., 1.)
+    topo = -5. * lats[:, np.newaxis] + 0. * lons[np.newaxis, :]
+    bathy = BathymetryLookup(topo, lats, lons)
+    lat0 = rand.uniform(-90., 90., size)
+    assert np.allclose(bathy.depth(lat0, rand.uniform(0., 360., size), method='bilinear'),
+                       -5. * lat0)
+    topo = np.add.outer(0. * lats, np.abs(lons))
+    bathy = BathymetryLookup(topo, lats, lons)
+    lon0 = rand.uniform(-179., 179., size)
+    assert np.allclose(bathy.depth(0., lon0, method='bilinear'), np.abs(lon0))
+
+def main():
+    import doctest
+    doctest.testmod()
+    for test in (test_nearest_regular, test_nearest_kdtree, test_bilinear_plane):
+        test()
+        print "{0}: ok".format(test.__name__)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# filename: epic_time.py
+r'''Integer arithmetic core for PMEL-EPIC two word time (time, time2)
+
+    time  -- "True Julian Day" (1968-05-23 is 2440000)
+    time2 -- milliseconds since 00:00 GMT
+
+    All conversions are done on integer days and milliseconds (never fractions of a
+    day) so EPIC <-> datetime <-> datetime64 round trips are exact to the millisecond.
+    Used by calc/EPIC2Datetime.py, PostCruiseRoutines/calc keeps a copy of both
+    modules so each tree imports its own (from epic_time import ...).
+    OnCruiseRoutines/CTD_Vis/ctd.py (DataTimes) does the same integer arithmetic
+    inline so CTD2NC.py runs from its own directory.
+
+    Run this file to execute the doctests and the randomized round trip tests.
+
+    Modifications
+    -------------
+    2016-12-12: SBELL - shared integer time core (millisecond exact)
+
+'''
+import datetime
+import numpy as np
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+#1968-05-23 => 2440000
+EPIC_REF_DAY = 2440000
+EPIC_REF_DATETIME = datetime.datetime(1968, 5, 23)
+EPIC_REF_ORDINAL = EPIC_REF_DATETIME.toordinal()
+EPIC_REF_DATE = np.datetime64('1968-05-23T00:00:00', 'us')
+MS_PER_DAY = 86400000
+
+"""------------------------------------- Scalar -------------------------------------------------"""
+
+def datetime2epic(epic_dt):
+    r'''
+    datetime -> (time, time2), microseconds are dropped (floor to the millisecond)
+
+    >>> datetime2epic(datetime.datetime(1994, 7, 4, 12, 0, 0, 1999))
+    (2449538, 43200001)
+    '''
+    time = epic_dt.toordinal() - EPIC_REF_ORDINAL + EPIC_REF_DAY
+    time2 = ((epic_dt.hour * 60 + epic_dt.minute) * 60 + epic_dt.second) * 1000 \
+            + epic_dt.microsecond // 1000
+    return (time, time2)
+
+def epic2datetime(time, time2):
+    r'''
+    (time, time2) -> datetime
+
+    >>> epic2datetime(2449538, 43200001)
+    datetime.datetime(1994, 7, 4, 12, 0, 0, 1000)
+    '''
+    return EPIC_REF_DATETIME + datetime.timedelta(days=int(time) - EPIC_REF_DAY,
+                                                  milliseconds=int(time2))
+
+"""------------------------------------- Arrays -------------------------------------------------"""
+
+def EPIC2Datetime64( timeword_1, timeword_2):
+    r'''
+    Convert arrays of PMEL-EPIC timewords (time, time2) to numpy datetime64[ms]
+    with integer arithmetic only.
+
+    Parameters
+    ----------
+    timeword_1 : array_like (int)
+         first EPIC timeword (time), true julian day
+    timeword_2 : array_like (int)
+         second EPIC timeword (time2), msec since 0:00 GMT
+
+    Returns
+    -------
+    Outputs : ndarray
+              datetime64[ms] of the broadcast shape of the inputs
+
+    Examples
+    --------
+    >>> EPIC2Datetime64([2440000, 2450000], [43200000, 1])  # doctest: +NORMALIZE_WHITESPACE
+    array(['1968-05-23T12:00:00.000', '1995-10-09T00:00:00.001'], dtype='datetime64[ms]')
+    '''
+    days = np.asarray(timeword_1, dtype=np.int64) - EPIC_REF_DAY
+    msec = days * MS_PER_DAY + np.asarray(timeword_2, dtype=np.int64)
+    return EPIC_REF_DATE.astype('datetime64[ms]') + msec.astype('timedelta64[ms]')
+
+def Datetime642EPIC(epic_dt):
+    r'''
+    Convert datetime64 values (or datetime objects) to PMEL-EPIC timewords with
+    integer arithmetic only.  Sub-millisecond parts are dropped (floor), time2 is
+    always in [0, 86400000) also before 1968.
+
+    Parameters
+    ----------
+    epic_dt : array_like
+              datetime64 array of any unit, or datetime objects
+
+    Returns
+    -------
+    Outputs : tuple of ndarray (time, time2)
+              time: int32 true julian day
+              time2: int32 milliseconds since 00:00 UTC
+
+    Examples
+    --------
+    >>> Datetime642EPIC(np.array(['1968-05-23T12:00', '1995-10-09T00:00:00.001'], dtype='datetime64[ms]'))  # doctest: +NORMALIZE_WHITESPACE
+    (array([2440000, 2450000], dtype=int32), array([43200000,        1], dtype=int32))
+    '''
+    epic_dt = np.asarray(epic_dt)
+    usec = (epic_dt.astype('datetime64[us]') - EPIC_REF_DATE).astype(np.int64)
+    msec = np.floor_divide(usec, 1000)
+    days = np.floor_divide(msec, MS_PER_DAY)
+    time2 = msec - days * MS_PER_DAY
+    return ((days + EPIC_REF_DAY).astype(np.int32), time2.astype(np.int32))
+
+"""------------------------------------- Tests --------------------------------------------------"""
+# randomized (property style) checks, run with: python epic_time.py
+
+#1582-10-15 (gregorian calendar) to 2100-01-01
+TEST_DAYS = (2299161, 2488070)
+
+def _random_epic(rand, size):
+    time = rand.randint(TEST_DAYS[0], TEST_DAYS[1], size)
+    time2 = rand.randint(0, MS_PER_DAY, size)
+    return (time, time2)
+
+def test_epic_roundtrip(size=100000, seed=0):
+    '''EPIC -> datetime64 -> EPIC is the identity'''
+    time, time2 = _random_epic(np.random.RandomState(seed), size)
+    time_rt, time2_rt = Datetime642EPIC(EPIC2Datetime64(time, time2))
+    assert (time_rt == time).all() and (time2_rt == time2).all()
+
+def test_datetime64_roundtrip(size=100000, seed=1):
+    '''datetime64[ms] -> EPIC -> datetime64[ms] is the identity, time2 stays in range'''
+    rand = np.random.RandomState(seed)
+    msec = rand.randint(-20000, 30000, size).astype(np.int64) * MS_PER_DAY \
+           + rand.randint(0, MS_PER_DAY, size)
+    dt64 = np.datetime64('1968-05-23T00:00:00.000', 'ms') + msec.astype('timedelta64[ms]')
+    time, time2 = Datetime642EPIC(dt64)
+    assert ((time2 >= 0) & (time2 < MS_PER_DAY)).all()
+    assert (EPIC2Datetime64(time, time2) == dt64).all()
+
+def test_scalar_matches_array(size=2000, seed=2):
+    '''the datetime (scalar) and datetime64 (array) paths agree, microseconds included'''
+    rand = np.random.RandomState(seed)
+    time, time2 = _random_epic(rand, size)
+    usec = rand.randint(0, 1000, size)
+    epic_dt = [epic2datetime(t, t2) + datetime.timedelta(microseconds=int(u))
+               for t, t2, u in zip(time, time2, usec)]
+    assert [datetime2epic(x) for x in epic_dt] == zip(time.tolist(), time2.tolist())
+    array_time, array_time2 = Datetime642EPIC(epic_dt)
+    assert (array_time == time).all() and (array_time2 == time2).all()
+    assert EPIC2Datetime64(time, time2).tolist() == [epic2datetime(t, t2) for t, t2 in zip(time, time2)]
+
+def test_day_boundaries():
+    '''last millisecond of a day and first of the next'''
+    time, time2 = Datetime642EPIC(np.array(['1968-05-22T23:59:59.999', '1968-05-23T00:00:00.000',
+                                            '2000-02-29T23:59:59.999'], dtype='datetime64[ms]'))
+    assert time.tolist() == [2439999, 2440000, 2451604]
+    assert time2.tolist() == [MS_PER_DAY - 1, 0, MS_PER_DAY - 1]
+
+def main():
+    import doctest
+    doctest.testmod()
+    for test in (test_epic_roundtrip, test_datetime64_roundtrip, test_scalar_matches_array,
+                 test_day_boundaries):
+        test()
+        print "{0}: ok".format(test.__name__)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# filename: geodesy.py
+r'''Vectorized great circle (haversine) and ellipsoidal (Vincenty) distances and bearings
+
+    All functions take latitudes/longitudes in degrees as scalars or numpy arrays
+    (broadcast against each other) and return kilometers / degrees.
+
+    distance(origin, destination)       -- (lat, lon) pairs, as general_utilities.haversine
+    consecutive(lats, lons)             -- n - 1 legs of a track
+    cumulative(lats, lons)              -- n along track distances starting at 0
+    pairwise(lats1, lons1, lats2, lons2) -- N x M matrix
+    nearest(lats1, lons1, lats2, lons2)  -- index/distance of the nearest of M points for each of N
+
+    method='vincenty' uses the WGS84 ellipsoid (Vincenty 1975 inverse solution),
+    nearly antipodal pairs that do not converge get the haversine distance.
+
+    Run this file to execute the doctests and tests.
+
+    Modifications
+    -------------
+    2016-12-12: SBELL - shared vectorized distances for cruise planning and sections
+
+'''
+import datetime
+import numpy as np
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+EARTH_RADIUS_KM = 6371.
+#WGS84
+WGS84_A = 6378137.
+WGS84_F = 1 / 298.257223563
+
+"""------------------------------------- Point to Point -----------------------------------------"""
+
+def haversine(lat1, lon1, lat2, lon2, radius=EARTH_RADIUS_KM):
+    r'''
+    Great circle distance in km
+
+    >>> round(float(haversine(0., 0., 0., 1.)), 3)
+    111.195
+    '''
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2.) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.) ** 2
+    return 2. * radius * np.arctan2(np.sqrt(a), np.sqrt(1. - a))
+
+def vincenty(lat1, lon1, lat2, lon2, a=WGS84_A, f=WGS84_F, tol=1e-12, max_iter=200):
+    r'''
+    Ellipsoidal distance in km (Vincenty inverse solution)
+
+    >>> round(float(vincenty(-37.95103342, 144.42486789, -37.65282114, 143.92649554)), 6)
+    54.972271
+    '''
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.radians(np.asarray(x, dtype=np.float64))
+                                                   for x in (lat1, lon1, lat2, lon2)])
+    b = a * (1. - f)
+    L = lon2 - lon1
+    U1 = np.arctan((1. - f) * np.tan(lat1))
+    U2 = np.arctan((1. - f) * np.tan(lat2))
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    shape = L.shape
+    L, sinU1, cosU1, sinU2, cosU2 = [x.ravel() for x in (L, sinU1, cosU1, sinU2, cosU2)]
+
+    lam = L.copy()
+    sin_sigma, cos_sigma, sigma = np.zeros(L.size), np.zeros(L.size), np.zeros(L.size)
+    cos2_alpha, cos_2sigma_m = np.zeros(L.size), np.zeros(L.size)
+    converged = np.zeros(L.size, dtype=bool)
+    # only the pairs that have not converged are iterated
+    active = np.arange(L.size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for iteration in range(max_iter):
+            if not active.size:
+                break
+            lam_a, s1, c1, s2, c2 = lam[active], sinU1[active], cosU1[active], sinU2[active], cosU2[active]
+            sin_lam, cos_lam = np.sin(lam_a), np.cos(lam_a)
+            sin_s = np.sqrt((c2 * sin_lam) ** 2 + (c1 * s2 - s1 * c2 * cos_lam) ** 2)
+            cos_s = s1 * s2 + c1 * c2 * cos_lam
+            sig = np.arctan2(sin_s, cos_s)
+            sin_alpha = np.where(sin_s == 0., 0., c1 * c2 * sin_lam / sin_s)
+            c2a = 1. - sin_alpha ** 2
+            # equatorial lines have cos2_alpha == 0
+            c2sm = np.where(c2a == 0., 0., cos_s - 2. * s1 * s2 / c2a)
+            C = f / 16. * c2a * (4. + f * (4. - 3. * c2a))
+            lam_new = L[active] + (1. - C) * f * sin_alpha * (sig + C * sin_s *
+                      (c2sm + C * cos_s * (-1. + 2. * c2sm ** 2)))
+
+            sin_sigma[active], cos_sigma[active], sigma[active] = sin_s, cos_s, sig
+            cos2_alpha[active], cos_2sigma_m[active] = c2a, c2sm
+            done = np.abs(lam_new - lam_a) <= tol
+            converged[active[done]] = True
+            lam[active[~done]] = lam_new[~done]
+            active = active[~done]
+
+        u2 = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        A = 1. + u2 / 16384. * (4096. + u2 * (-768. + u2 * (320. - 175. * u2)))
+        B = u2 / 1024. * (256. + u2 * (-128. + u2 * (74. - 47. * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4. * (cos_sigma * (-1. + 2. * cos_2sigma_m ** 2)
+                      - B / 6. * cos_2sigma_m * (-3. + 4. * sin_sigma ** 2) * (-3. + 4. * cos_2sigma_m ** 2)))
+        dist = (b * A * (sigma - delta_sigma) / 1000.).reshape(shape)
+
+    converged = converged.reshape(shape)
+    if not converged.all():
+        dist = np.where(converged, dist, haversine(np.degrees(lat1), np.degrees(lon1),
+                                                   np.degrees(lat2), np.degrees(lon2)))
+    return dist
+
+def bearing(lat1, lon1, lat2, lon2):
+    r'''
+    Initial great circle bearing from point 1 to point 2, degrees clockwise from north [0, 360)
+
+    >>> bearing([0., 0.], [0., 0.], [0., 1.], [1., 0.]).round(6) + 0.
+    array([90.,  0.])
+    '''
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2)]
+    dlon = lon2 - lon1
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.mod(np.degrees(np.arctan2(y, x)), 360.)
+
+METHODS = {'haversine': haversine, 'vincenty': vincenty}
+
+def distance(origin, destination, method='haversine'):
+    r'''
+    Distance in km between origin (lat, lon) and destination (lat, lon), drop in
+    for general_utilities.haversine.distance
+
+    >>> round(float(distance((57.5, -170.), (58., -170.))), 3)
+    55.597
+    '''
+    return METHODS[method](origin[0], origin[1], destination[0], destination[1])
+
+"""------------------------------------- Tracks and Sets ----------------------------------------"""
+
+def consecutive(lats, lons, method='haversine'):
+    '''km between successive points of a track (n - 1 legs)'''
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    return METHODS[method](lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+def cumulative(lats, lons, method='haversine'):
+    '''along track km of each point of a track, 0 at the first point'''
+    along_track = np.zeros(np.shape(lats))
+    along_track[1:] = np.cumsum(consecutive(lats, lons, method))
+    return along_track
+
+def consecutive_bearing(lats, lons):
+    '''initial bearing of each leg of a track (n - 1 legs)'''
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    return bearing(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+def pairwise(lats1, lons1, lats2, lons2, method='haversine'):
+    '''(N, M) km from each of N points to each of M points'''
+    lats1, lons1 = np.asarray(lats1, dtype=np.float64), np.asarray(lons1, dtype=np.float64)
+    lats2, lons2 = np.asarray(lats2, dtype=np.float64), np.asarray(lons2, dtype=np.float64)
+    return METHODS[method](lats1[:, np.newaxis], lons1[:, np.newaxis],
+                           lats2[np.newaxis, :], lons2[np.newaxis, :])
+
+def nearest(lats1, lons1, lats2, lons2, method='haversine', chunk=1024):
+    r'''
+    Nearest of M points (lats2, lons2) to each of N points (lats1, lons1), the
+    distance matrix is built chunk rows at a time
+
+    Returns
+    -------
+    Outputs : tuple (index, distance)
+              (N,) index into the M points and km to it
+
+    >>> nearest([57., 60.], [-170., -165.], [60.1, 57.2, 0.], [-165., -170., 0.])[0]
+    array([1, 0])
+    '''
+    lats1, lons1 = np.atleast_1d(lats1), np.atleast_1d(lons1)
+    index = np.empty(lats1.shape[0], dtype=np.intp)
+    dist = np.empty(lats1.shape[0])
+    for start in range(0, lats1.shape[0], chunk):
+        block = pairwise(lats1[start:start + chunk], lons1[start:start + chunk], lats2, lons2, method)
+        index[start:start + chunk] = block.argmin(axis=1)
+        dist[start:start + chunk] = block[np.arange(block.shape[0]), index[start:start + chunk]]
+    return (index, dist)
+
+"""------------------------------------- Tests --------------------------------------------------"""
+# run with: python geodesy.py
+
+def test_haversine_vs_vincenty(size=2000, seed=0):
+    '''ellipsoidal and spherical distances agree to within 0.6%'''
+    rand = np.random.RandomState(seed)
+    lat1, lat2 = rand.uniform(-80., 80., (2, size))
+    lon1, lon2 = rand.uniform(-180., 180., (2, size))
+    ratio = vincenty(lat1, lon1, lat2, lon2) / haversine(lat1, lon1, lat2, lon2)
+    assert np.isfinite(ratio).all() and (np.abs(ratio - 1.) < 0.006).all()
+
+def test_tracks(size=50, seed=1):
+    '''consecutive/cumulative/pairwise/nearest agree with scalar calls'''
+    rand = np.random.RandomState(seed)
+    lats, lons = rand.uniform(50., 75., size), rand.uniform(-180., -140., size)
+    legs = consecutive(lats, lons)
+    assert np.allclose(legs, [distance((lats[i], lons[i]), (lats[i + 1], lons[i + 1]))
+                              for i in range(size - 1)])
+    assert cumulative(lats, lons)[0] == 0. and np.allclose(np.diff(cumulative(lats, lons)), legs)
+    matrix = pairwise(lats, lons, lats[::-1], lons[::-1])
+    assert matrix.shape == (size, size) and np.allclose(matrix[0, -1], 0.)
+    index, dist = nearest(lats, lons, lats[::-1], lons[::-1], chunk=7)
+    assert (index == np.arange(size)[::-1]).all() and np.allclose(dist, 0.)
+
+def test_coincident_and_equator():
+    '''zero length and equatorial legs'''
+    assert vincenty(10., 20., 10., 20.) == 0.
+    assert abs(vincenty(0., 0., 0., 1.) - 111.319491) < 1e-6
+
+def main():
+    import doctest
+    doctest.testmod()
+    for test in (test_haversine_vs_vincenty, test_tracks, test_coincident_and_equator):
+        test()
+        print "{0}: ok".format(test.__name__)
+
+if __name__ == "__main__":
+    main()
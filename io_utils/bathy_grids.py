@@ -0,0 +1,288 @@
+#!/usr/bin/env
+
+"""
+ bathy_grids.py
+
+ Shared loader for the topography/bathymetry grids used by the cruise maps and
+ planning tools (ETOPO5 and IBCAO/ARDEM).
+
+ Only the lat/lon window that is asked for is read from the netCDF file (one
+ hyperslab, two if the window crosses the seam of a global grid) and 1D lat/lon
+ axes are returned unless meshgrid=True.  Windows can be cached on disk as .npz,
+ keyed by the source file (path, size, mtime), the grid variables and the bounds.
+
+ Usage:
+ ------
+ from io_utils.bathy_grids import etopo5_data, IBCAO_data, map_bounds
+
+ (topoin, elats, elons) = etopo5_data(filein, bounds=(50., 75., -180., -130.))
+
+ m = Basemap(resolution='i',projection='stere',width=2000000, height=2000000, lat_0=70,lon_0=191)
+ (topoin, elats, elons) = IBCAO_data(bounds=map_bounds(m), meshgrid=True)
+
+ bounds are (lat_min, lat_max, lon_min, lon_max), lon_min to lon_max is read
+ eastward and either longitude convention (-180/180 or 0/360) may be used.
+ Longitudes are returned in the convention of the grid (ETOPO5 is shifted to
+ -360 -> 0 as with shiftgrid(0., topoin, lons, start=False)) and are increasing
+ across the seam.
+
+ The cache directory is cache_dir or the BATHY_CACHE_DIR environment variable
+ (no caching if neither is set).
+
+ Built using Anaconda packaged Python:
+
+
+"""
+
+# System Stack
+import datetime, os, json, hashlib
+
+# Science Stack
+import numpy as np
+from netCDF4 import Dataset
+
+# User Stack
+from io_utils.disk_cache import save_npz, load_npz, masked_arrays, masked_from
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+# bump when the cached layout or the subsetting changes
+CACHE_VERSION = 2
+
+ETOPO5_FILE = '/Users/bell/Programs/Python/AtSeaPrograms/data/etopo5.nc'
+IBCAO_FILE = '/Users/bell/Data_Local/MapGrids/ARDEMv2.0.nc'
+
+GRIDS = {
+    # X is 0 -> 360, shifted to -360 -> 0
+    'etopo5': {'file': ETOPO5_FILE, 'topo': 'bath', 'lat': 'Y', 'lon': 'X', 'lon_offset': -360.},
+    'ibcao':  {'file': IBCAO_FILE, 'topo': 'z', 'lat': 'lat', 'lon': 'lon', 'lon_offset': 0.},
+}
+
+"""------------------------------------- Subsetting ---------------------------------------------"""
+
+def _axis_slice(axis, lo, hi):
+    """slice of a monotonic axis covering lo -> hi plus the node either side"""
+    if axis[0] > axis[-1]:
+        flipped = _axis_slice(axis[::-1], lo, hi)
+        return slice(axis.size - flipped.stop, axis.size - flipped.start)
+    start = max(np.searchsorted(axis, lo, side='right') - 1, 0)
+    stop = min(np.searchsorted(axis, hi, side='left') + 1, axis.size)
+    return slice(start, stop)
+
+def _is_global(lons):
+    """longitude axis spanning the globe (without the cyclic point)"""
+    step = (lons[-1] - lons[0]) / (lons.size - 1.)
+    return abs(abs(step) * lons.size - 360.) < 1e-6 * 360.
+
+def _lon_slices(lons, lon_min, lon_max):
+    """
+    Slices of an increasing longitude axis covering lon_min eastward to lon_max
+    as a list of (slice, offset), the offset (0 or 360) keeps the longitudes of a
+    window across the seam of a global grid increasing
+    """
+    if lon_max - lon_min >= 360.:
+        return [(slice(0, lons.size), 0.)]
+
+    lo = lons[0] + np.mod(lon_min - lons[0], 360.)
+    hi = lo + np.mod(lon_max - lon_min, 360.)
+
+    if not _is_global(lons):
+        # a regional grid may only be reached one turn to the west
+        if lo > lons[-1] and hi - 360. >= lons[0]:
+            lo, hi = lo - 360., hi - 360.
+        return [(_axis_slice(lons, lo, hi), 0.)]
+
+    if hi <= lons[-1]:
+        return [(_axis_slice(lons, lo, hi), 0.)]
+    east = _axis_slice(lons, lo, lons[-1])
+    west = _axis_slice(lons, lons[0], hi - 360.)
+    return [(slice(east.start, lons.size), 0.), (slice(0, west.stop), 360.)]
+
+def read_window(filein, topo_var, lat_var, lon_var, lon_offset=0., bounds=None):
+    """
+    Read the bounds (lat_min, lat_max, lon_min, lon_max) window of a grid, the
+    whole grid if bounds is None
+
+    Returns
+    -------
+    Outputs : tuple (topoin, lats, lons)
+              topoin (nlat, nlon), masked if the file holds missing values
+    """
+    ncdata = Dataset(filein)
+    try:
+        topo = ncdata.variables[topo_var]
+        lats = np.asarray(np.ma.getdata(ncdata.variables[lat_var][:]), dtype=np.float64)
+        lons = np.asarray(np.ma.getdata(ncdata.variables[lon_var][:]), dtype=np.float64) + lon_offset
+
+        if bounds is None:
+            return (topo[:], lats, lons)
+
+        lat_min, lat_max, lon_min, lon_max = bounds
+        lat_slice = _axis_slice(lats, lat_min, lat_max)
+        pieces, lon_pieces = [], []
+        for lon_slice, offset in _lon_slices(lons, lon_min, lon_max):
+            pieces.append(topo[lat_slice, lon_slice])
+            lon_pieces.append(lons[lon_slice] + offset)
+    finally:
+        ncdata.close()
+
+    if len(pieces) == 1:
+        topoin = pieces[0]
+    elif any(np.ma.isMA(piece) for piece in pieces):
+        topoin = np.ma.concatenate(pieces, axis=1)
+    else:
+        topoin = np.concatenate(pieces, axis=1)
+    return (topoin, lats[lat_slice], np.concatenate(lon_pieces))
+
+"""------------------------------------- Disk Cache ---------------------------------------------"""
+
+def cache_key(filein, spec, bounds):
+    """file name of the cache entry of a window, None if filein does not exist"""
+    try:
+        stat = os.stat(filein)
+    except OSError:
+        return None
+    key = json.dumps([os.path.abspath(filein), stat.st_size, stat.st_mtime, sorted(spec.items()),
+                      None if bounds is None else [float(b) for b in bounds], CACHE_VERSION])
+    return os.path.basename(filein).replace('.', '_') + '-' + hashlib.sha1(key).hexdigest()[:16] + '.npz'
+
+def _read_cache(fname):
+    cached = load_npz(fname)
+    if cached is None:
+        return None
+    return (masked_from(cached, 'topo'), cached['lats'], cached['lons'])
+
+def _write_cache(fname, topoin, lats, lons):
+    save_npz(fname, lats=lats, lons=lons, **masked_arrays('topo', topoin))
+
+"""------------------------------------- Loaders ------------------------------------------------"""
+
+def load_grid(grid='etopo5', filein=None, bounds=None, cache_dir=None, meshgrid=False):
+    """
+    Read a bathymetry grid (or a window of it)
+
+    Parameters
+    ----------
+    grid : str
+        key of GRIDS ('etopo5' or 'ibcao')
+    filein : str
+        netCDF file, the default path of the grid if None
+    bounds : tuple
+        (lat_min, lat_max, lon_min, lon_max), None reads the whole grid
+    cache_dir : str
+        directory for cached windows, BATHY_CACHE_DIR if None
+    meshgrid : bool
+        return 2D lats/lons (np.meshgrid) instead of the 1D axes
+
+    Returns
+    -------
+    Outputs : tuple (topoin, lats, lons)
+    """
+    spec = dict(GRIDS[grid])
+    default_file = spec.pop('file')
+    filein = filein or default_file
+    if cache_dir is None:
+        cache_dir = os.environ.get('BATHY_CACHE_DIR')
+
+    data, cache_file = None, None
+    if cache_dir:
+        key = cache_key(filein, spec, bounds)
+        if key is not None:
+            cache_file = os.path.join(cache_dir, key)
+            data = _read_cache(cache_file)
+
+    if data is None:
+        data = read_window(filein, spec['topo'], spec['lat'], spec['lon'],
+                           lon_offset=spec['lon_offset'], bounds=bounds)
+        if cache_file is not None:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            _write_cache(cache_file, *data)
+
+    (topoin, lats, lons) = data
+    if meshgrid:
+        lons, lats = np.meshgrid(lons, lats)
+    return (topoin, lats, lons)
+
+def etopo5_data(filein=ETOPO5_FILE, bounds=None, cache_dir=None, meshgrid=False):
+    """ read in etopo5 topography/bathymetry. """
+    return load_grid('etopo5', filein, bounds=bounds, cache_dir=cache_dir, meshgrid=meshgrid)
+
+def IBCAO_data(filein=IBCAO_FILE, bounds=None, cache_dir=None, meshgrid=False):
+    """ read in IBCAO topography/bathymetry. """
+    return load_grid('ibcao', filein, bounds=bounds, cache_dir=cache_dir, meshgrid=meshgrid)
+
+def map_bounds(m, pad=1., nedge=100):
+    """
+    (lat_min, lat_max, lon_min, lon_max) covering a Basemap instance, pad degrees
+    wider on every side.  Maps holding a pole get all longitudes.
+    """
+    t = np.linspace(0., 1., nedge)
+    dx, dy = m.xmax - m.xmin, m.ymax - m.ymin
+    x = np.concatenate((m.xmin + t * dx, np.repeat(m.xmax, nedge), m.xmax - t * dx, np.repeat(m.xmin, nedge)))
+    y = np.concatenate((np.repeat(m.ymin, nedge), m.ymin + t * dy, np.repeat(m.ymax, nedge), m.ymax - t * dy))
+    lons, lats = m(x, y, inverse=True)
+    # walk around the edge so a map across the dateline gives e.g. 150 -> 235
+    lons = np.degrees(np.unwrap(np.radians(lons)))
+
+    for pole in (90., -90.):
+        px, py = m(0., pole)
+        if m.xmin <= px <= m.xmax and m.ymin <= py <= m.ymax:
+            if pole > 0:
+                return (max(lats.min() - pad, -90.), 90., -180., 180.)
+            return (-90., min(lats.max() + pad, 90.), -180., 180.)
+    return (max(lats.min() - pad, -90.), min(lats.max() + pad, 90.), lons.min() - pad, lons.max() + pad)
+
+"""------------------------------------- Tests --------------------------------------------------"""
+# run with: python bathy_grids.py
+
+def _synthetic_grid(fname):
+    """global 1 degree grid in the etopo5 layout (X 0 -> 359, Y 90 -> -90)"""
+    lats, lons = np.arange(90., -90.5, -1.), np.arange(0., 360., 1.)
+    topo = np.add.outer(lats * 1000., lons)
+    ncdata = Dataset(fname, 'w')
+    ncdata.createDimension('Y', lats.size)
+    ncdata.createDimension('X', lons.size)
+    ncdata.createVariable('Y', 'f8', ('Y',))[:] = lats
+    ncdata.createVariable('X', 'f8', ('X',))[:] = lons
+    ncdata.createVariable('bath', 'f8', ('Y', 'X'))[:] = topo
+    ncdata.close()
+
+def test_windows():
+    """windows match the whole grid, also across the seam and in either lon convention"""
+    import tempfile, shutil
+    work_dir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(work_dir, 'etopo5.nc')
+        _synthetic_grid(fname)
+        (topo, lats, lons) = etopo5_data(fname)
+        assert lons[0] == -360. and lons[-1] == -1.
+
+        for bounds in [(50., 75., -180., -130.), (50., 75., 180., 230.), (-10., 10., -10., 10.),
+                       (60., 80., 150., 235.)]:
+            (wtopo, wlats, wlons) = etopo5_data(fname, bounds=bounds)
+            assert (np.diff(wlons) == 1.).all()
+            assert wlats.min() <= bounds[0] and wlats.max() >= bounds[1]
+            assert wlons[-1] - wlons[0] >= np.mod(bounds[3] - bounds[2], 360.)
+            assert (wtopo == np.add.outer(wlats * 1000., np.mod(wlons, 360.))).all()
+
+        cache_dir = os.path.join(work_dir, 'cache')
+        first = etopo5_data(fname, bounds=(60., 80., 150., 235.), cache_dir=cache_dir, meshgrid=True)
+        assert len(os.listdir(cache_dir)) == 1
+        second = etopo5_data(fname, bounds=(60., 80., 150., 235.), cache_dir=cache_dir, meshgrid=True)
+        for a, b in zip(first, second):
+            assert a.shape == b.shape and (a == b).all()
+    finally:
+        shutil.rmtree(work_dir)
+
+def main():
+    test_windows()
+    print "test_windows: ok"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env
+
+"""
+ bathy_pyramid.py
+
+ Decimated (multi-resolution) copies of a bathymetry grid for map rendering.
+
+ Level n of the pyramid averages (or takes the min/max of) factor x factor
+ blocks of the grid read by io_utils.bathy_grids.  A map only needs as many grid
+ cells as the saved figure has pixels, select_level/map_level pick the coarsest
+ level whose cells are still no more than pixels_per_cell pixels wide, so
+ projecting and contouring work on (factor**2 times) fewer points.
+
+ Usage:
+ ------
+ from io_utils.bathy_grids import map_bounds
+ from io_utils.bathy_pyramid import load_pyramid, map_level
+
+ m = Basemap(resolution='i',projection='stere',width=2000000, height=2000000, lat_0=70,lon_0=191)
+ level = map_level(load_pyramid('ibcao', bounds=map_bounds(m)), m, width_px=fig.get_figwidth() * 300)
+ elons, elats = np.meshgrid(level['lons'], level['lats'])
+ ex, ey = m(elons, elats)
+ CS = m.contourf(ex, ey, level['topo'], ...)
+
+ Pyramids are cached with the windows of bathy_grids (cache_dir or the
+ BATHY_CACHE_DIR environment variable).
+
+ Built using Anaconda packaged Python:
+
+
+"""
+
+# System Stack
+import datetime, os
+
+# Science Stack
+import numpy as np
+
+# User Stack
+from io_utils import bathy_grids
+from io_utils.disk_cache import save_npz, load_npz, masked_arrays, masked_from
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+LEVELS = (1, 2, 4, 8, 16)
+PIXELS_PER_CELL = 3.
+EARTH_RADIUS_M = 6371000.
+
+"""------------------------------------- Decimation ---------------------------------------------"""
+
+def _blocks(values, factor):
+    """(ny, nx) -> (ny // factor, factor, nx // factor, factor), remainder rows/columns are dropped"""
+    ny, nx = values.shape[0] // factor * factor, values.shape[1] // factor * factor
+    return values[:ny, :nx].reshape(ny // factor, factor, nx // factor, factor)
+
+def decimate(topoin, lats, lons, factor, how='mean'):
+    """
+    Reduce factor x factor blocks of topoin to one cell
+
+    Parameters
+    ----------
+    topoin : array_like (nlat, nlon)
+        masked cells are left out of each block
+    lats, lons : array_like
+        1D axes, the new axes are the block centres
+    factor : int
+    how : str
+        'mean', 'min' (deepest) or 'max' (shoalest)
+
+    Returns
+    -------
+    Outputs : tuple (topoin, lats, lons)
+    """
+    if factor == 1:
+        return (topoin, lats, lons)
+
+    blocks = _blocks(topoin, factor)
+    if how == 'mean':
+        # one mean over all cells of the block so masked cells do not skew the weights
+        reduced = blocks.swapaxes(1, 2).reshape(blocks.shape[0], blocks.shape[2], -1).mean(axis=2)
+    elif how == 'min':
+        reduced = blocks.min(axis=3).min(axis=1)
+    elif how == 'max':
+        reduced = blocks.max(axis=3).max(axis=1)
+    else:
+        raise ValueError("unknown reduction {0}".format(how))
+
+    lats = np.asarray(lats)[:blocks.shape[0] * factor].reshape(-1, factor).mean(axis=1)
+    lons = np.asarray(lons)[:blocks.shape[2] * factor].reshape(-1, factor).mean(axis=1)
+    return (reduced, lats, lons)
+
+def cell_size_m(lats, lons):
+    """largest grid spacing in meters (longitude spacing taken at the lowest |latitude|)"""
+    dlat = abs(lats[-1] - lats[0]) / max(lats.size - 1., 1.)
+    dlon = abs(lons[-1] - lons[0]) / max(lons.size - 1., 1.)
+    dy = np.radians(dlat) * EARTH_RADIUS_M
+    dx = np.radians(dlon) * EARTH_RADIUS_M * np.cos(np.radians(np.abs(lats).min()))
+    return max(dx, dy)
+
+def build_pyramid(topoin, lats, lons, levels=LEVELS, how='mean'):
+    """
+    Decimated copies of a grid, finest first
+
+    Each level is reduced from the previous one where its factor is a multiple
+    of the previous factor (block means of a masked grid are then means of means).
+
+    Returns
+    -------
+    Outputs : list of dict
+              {'factor', 'topo', 'lats', 'lons', 'cell_m'} for each of levels
+    """
+    pyramid = []
+    base = {'factor': 1, 'topo': topoin, 'lats': np.asarray(lats), 'lons': np.asarray(lons)}
+    for factor in sorted(levels):
+        source = base
+        for level in pyramid:
+            if factor % level['factor'] == 0:
+                source = level
+        (topo, level_lats, level_lons) = decimate(source['topo'], source['lats'], source['lons'],
+                                                  factor // source['factor'], how=how)
+        if level_lats.size < 2 or level_lons.size < 2:
+            break
+        pyramid.append({'factor': factor, 'topo': topo, 'lats': level_lats, 'lons': level_lons,
+                        'cell_m': cell_size_m(level_lats, level_lons)})
+    return pyramid
+
+"""------------------------------------- Level Selection ----------------------------------------"""
+
+def select_level(pyramid, map_width_m, width_px, pixels_per_cell=PIXELS_PER_CELL):
+    """
+    Coarsest level whose cells are at most pixels_per_cell pixels wide on a map
+    map_width_m meters wide drawn width_px pixels wide (the finest level if none is)
+    """
+    pixel_m = map_width_m / float(width_px)
+    chosen = pyramid[0]
+    for level in pyramid:
+        if level['cell_m'] <= pixels_per_cell * pixel_m:
+            chosen = level
+    return chosen
+
+def map_level(pyramid, m, width_px, pixels_per_cell=PIXELS_PER_CELL):
+    """
+    select_level for a Basemap instance m saved width_px pixels wide
+    (figure width in inches * dpi)
+    """
+    return select_level(pyramid, m.xmax - m.xmin, width_px, pixels_per_cell)
+
+"""------------------------------------- Cached Pyramids ----------------------------------------"""
+
+def _read_pyramid(fname):
+    cached = load_npz(fname)
+    if cached is None:
+        return None
+    return [{'factor': int(factor), 'topo': masked_from(cached, 'topo_%d' % factor),
+             'lats': cached['lats_%d' % factor], 'lons': cached['lons_%d' % factor],
+             'cell_m': float(cached['cell_m_%d' % factor])} for factor in cached['factors']]
+
+def _write_pyramid(fname, pyramid):
+    arrays = {'factors': np.array([level['factor'] for level in pyramid])}
+    for level in pyramid:
+        arrays.update(masked_arrays('topo_%d' % level['factor'], level['topo']))
+        arrays['lats_%d' % level['factor']] = level['lats']
+        arrays['lons_%d' % level['factor']] = level['lons']
+        arrays['cell_m_%d' % level['factor']] = level['cell_m']
+    save_npz(fname, **arrays)
+
+def load_pyramid(grid='etopo5', filein=None, bounds=None, cache_dir=None, levels=LEVELS, how='mean'):
+    """
+    Pyramid of a bathy_grids window (see bathy_grids.load_grid for the arguments),
+    cached on disk as one .npz per source, bounds, levels and reduction
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('BATHY_CACHE_DIR')
+
+    cache_file = None
+    if cache_dir:
+        spec = dict(bathy_grids.GRIDS[grid], levels=list(levels), how=how, pyramid=True)
+        key = bathy_grids.cache_key(filein or spec['file'], spec, bounds)
+        if key is not None:
+            cache_file = os.path.join(cache_dir, key)
+            pyramid = _read_pyramid(cache_file)
+            if pyramid is not None:
+                return pyramid
+
+    (topoin, lats, lons) = bathy_grids.load_grid(grid, filein, bounds=bounds, cache_dir=False)
+    pyramid = build_pyramid(topoin, lats, lons, levels=levels, how=how)
+    if cache_file is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        _write_pyramid(cache_file, pyramid)
+    return pyramid
+
+"""------------------------------------- Tests --------------------------------------------------"""
+# run with: python bathy_pyramid.py
+
+def test_decimate():
+    """block reductions, trimmed remainder and masked cells"""
+    topo = np.arange(30.).reshape(5, 6)
+    (reduced, lats, lons) = decimate(topo, np.arange(5.), np.arange(6.), 2)
+    assert reduced.tolist() == [[3.5, 5.5, 7.5], [15.5, 17.5, 19.5]]
+    assert lats.tolist() == [0.5, 2.5] and lons.tolist() == [0.5, 2.5, 4.5]
+    assert decimate(topo, np.arange(5.), np.arange(6.), 2, how='min')[0].tolist() == \
+           [[0., 2., 4.], [12., 14., 16.]]
+
+    masked = np.ma.masked_greater(topo, 7.)
+    reduced = decimate(masked, np.arange(5.), np.arange(6.), 2)[0]
+    assert reduced[0, 0] == 3.5 and reduced[0, 1] == 2.5 and reduced.mask[1].all()
+
+def test_select_level():
+    """coarsest level within pixels_per_cell, the finest level if none is"""
+    lats, lons = np.arange(60., 80., 0.01), np.arange(-190., -150., 0.01)
+    pyramid = build_pyramid(np.zeros((lats.size, lons.size)), lats, lons)
+    assert [level['factor'] for level in pyramid] == list(LEVELS)
+    pixel_m = 2000000. / 3600.
+    level = select_level(pyramid, 2000000., 3600)
+    assert level['cell_m'] <= PIXELS_PER_CELL * pixel_m
+    assert level is pyramid[-1] or pyramid[pyramid.index(level) + 1]['cell_m'] > PIXELS_PER_CELL * pixel_m
+    assert select_level(pyramid, 1000., 3600) is pyramid[0]
+
+def main():
+    for test in (test_decimate, test_select_level):
+        test()
+        print "{0}: ok".format(test.__name__)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env
+
+"""
+ disk_cache.py
+
+ Atomic writes and .npz entries shared by the disk caches (bathy_grids,
+ bathy_pyramid, map_cache, castcache, section_engine) and the reports written
+ in one piece (get_btl, CTD2NC).
+
+ atomic_path(path) gives a temporary name next to path and moves it into place
+ when the block completes, so readers never see a partial file or directory; a
+ block that raises leaves nothing behind.  atomic_write opens that temporary
+ name, save_npz/load_npz store and read a dict of arrays and masked_arrays/
+ masked_from keep a numpy masked array in an .npz.
+
+ Usage:
+ ------
+ from io_utils.disk_cache import atomic_write, save_npz, load_npz, masked_arrays, masked_from
+
+ save_npz(fname, lats=lats, **masked_arrays('topo', topoin))
+ cached = load_npz(fname)
+ if cached is not None:
+     topoin = masked_from(cached, 'topo')
+
+ with atomic_write(output_file, 'w') as fhandle:
+     json.dump(entries, fhandle)
+
+ Built using Anaconda packaged Python:
+
+
+"""
+
+# System Stack
+import datetime, os, shutil, contextlib
+
+# Science Stack
+import numpy as np
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+"""------------------------------------- Atomic Writes ------------------------------------------"""
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Temporary name (path.tmp<pid>) for a file or directory written in the block,
+    renamed to path when the block completes (an existing directory or, on
+    windows, file at path is removed first) and removed if the block raises
+    """
+    tmp_path = path + '.tmp%d' % os.getpid()
+    _remove(tmp_path)
+    try:
+        yield tmp_path
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        _remove(tmp_path)
+        raise
+
+@contextlib.contextmanager
+def atomic_write(fname, mode='wb'):
+    """open(fname, mode) written under atomic_path"""
+    with atomic_path(fname) as tmp_name:
+        with open(tmp_name, mode) as fhandle:
+            yield fhandle
+
+"""------------------------------------- .npz Entries -------------------------------------------"""
+
+def save_npz(fname, **arrays):
+    """np.savez of arrays, written atomically"""
+    with atomic_write(fname) as fhandle:
+        np.savez(fhandle, **arrays)
+
+def load_npz(fname):
+    """dict of the arrays of an .npz entry, None if it is missing or unreadable"""
+    try:
+        cached = np.load(fname)
+        with cached:
+            return dict((name, cached[name]) for name in cached.files)
+    except (IOError, OSError, ValueError):
+        return None
+
+def masked_arrays(name, values):
+    """
+    .npz arrays of a plain or masked array: name (data), name_mask (empty
+    without a mask) and name_is_masked
+    """
+    mask = np.ma.getmask(values)
+    return {name: np.ma.getdata(values),
+            name + '_mask': np.zeros(0, bool) if mask is np.ma.nomask else mask,
+            name + '_is_masked': np.ma.isMA(values)}
+
+def masked_from(arrays, name):
+    """array name of masked_arrays, masked again if it was"""
+    values = arrays[name]
+    if arrays[name + '_is_masked']:
+        mask = arrays[name + '_mask']
+        values = np.ma.array(values, mask=mask if mask.size else np.ma.nomask)
+    return values
+
+"""------------------------------------- Tests --------------------------------------------------"""
+# run with: python disk_cache.py
+
+def test_npz_roundtrip():
+    """plain, masked and nomask arrays come back as they were written"""
+    import tempfile
+    work_dir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(work_dir, 'entry.npz')
+        masked = np.ma.array(np.arange(6.).reshape(2, 3), mask=[[0, 1, 0], [0, 0, 1]])
+        arrays = dict(masked_arrays('masked', masked), **masked_arrays('plain', np.arange(4)))
+        arrays.update(masked_arrays('nomask', np.ma.array(np.ones(3))))
+        save_npz(fname, **arrays)
+        cached = load_npz(fname)
+        assert (masked_from(cached, 'masked').mask == masked.mask).all()
+        assert (masked_from(cached, 'masked').data == masked.data).all()
+        assert not np.ma.isMA(masked_from(cached, 'plain'))
+        assert np.ma.getmask(masked_from(cached, 'nomask')) is np.ma.nomask
+        assert load_npz(os.path.join(work_dir, 'missing.npz')) is None
+        assert os.listdir(work_dir) == ['entry.npz']
+    finally:
+        shutil.rmtree(work_dir)
+
+def test_atomic_path():
+    """a failed write leaves neither the temporary nor a partial entry, directories are replaced"""
+    import tempfile
+    work_dir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(work_dir, 'report.txt')
+        with atomic_write(fname, 'w') as fhandle:
+            fhandle.write('first')
+        try:
+            with atomic_write(fname, 'w') as fhandle:
+                fhandle.write('partial')
+                raise RuntimeError('disk full')
+        except RuntimeError:
+            pass
+        assert os.listdir(work_dir) == ['report.txt'] and open(fname).read() == 'first'
+
+        entry = os.path.join(work_dir, 'entry')
+        for value in ('old', 'new'):
+            with atomic_path(entry) as tmp_path:
+                os.makedirs(tmp_path)
+                with open(os.path.join(tmp_path, 'value'), 'w') as fhandle:
+                    fhandle.write(value)
+        assert open(os.path.join(entry, 'value')).read() == 'new'
+        assert sorted(os.listdir(work_dir)) == ['entry', 'report.txt']
+    finally:
+        shutil.rmtree(work_dir)
+
+def main():
+    for test in (test_npz_roundtrip, test_atomic_path):
+        test()
+        print "{0}: ok".format(test.__name__)
+
+if __name__ == "__main__":
+    main()
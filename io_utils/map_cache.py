@@ -0,0 +1,247 @@
+#!/usr/bin/env
+
+"""
+ map_cache.py
+
+ Disk cache of Basemap projected bathymetry grids and of their isobath lines.
+
+ project_grid(m, elons, elats) is m(elons, elats) for a grid, the projected
+ x/y arrays are saved as .npy and memory mapped on later runs with the same
+ projection (Basemap projparams and map corners) and the same lat/lon grid.
+
+ isobaths(...) contours the projected grid at the given levels and keeps the
+ line segments (ContourSet.allsegs) as .npz, draw_isobaths adds them to an axes
+ as LineCollections (black, or coloured per level from a colormap as contour
+ does without colors).  plt.clabel needs a ContourSet, so the cruise planning
+ maps, which all label their isobaths, keep m.contour on the cached x/y.
+
+ Usage:
+ ------
+ from io_utils.map_cache import project_grid, isobaths, draw_isobaths
+
+ ex, ey = project_grid(m, elons, elats)
+ draw_isobaths(ax, isobaths(m, elons, elats, topoin, levels=[-1000, -200, -100, -70]), linewidths=0.2)
+
+ The cache directory is cache_dir or the MAP_CACHE_DIR (then BATHY_CACHE_DIR)
+ environment variable, nothing is cached if none is set.
+
+ Built using Anaconda packaged Python:
+
+
+"""
+
+# System Stack
+import datetime, os, json, hashlib
+
+# Science Stack
+import numpy as np
+
+# User Stack
+from io_utils.disk_cache import atomic_path, save_npz, load_npz
+
+__author__   = 'Shaun Bell'
+__email__    = 'shaun.bell@noaa.gov'
+__created__  = datetime.datetime(2016, 12, 12)
+__modified__ = datetime.datetime(2016, 12, 12)
+__version__  = "0.1.0"
+__status__   = "Development"
+
+# bump when the on disk layout changes
+CACHE_VERSION = 1
+
+"""------------------------------------- Cache Keys ---------------------------------------------"""
+
+def _cache_dir(cache_dir):
+    if cache_dir is None:
+        cache_dir = os.environ.get('MAP_CACHE_DIR', os.environ.get('BATHY_CACHE_DIR'))
+    return cache_dir
+
+def _array_digest(sha, values):
+    values = np.ascontiguousarray(np.ma.getdata(values))
+    sha.update(str(values.shape) + values.dtype.str)
+    sha.update(values.data)
+
+def projection_key(m):
+    """projection parameters and map corners of a Basemap instance"""
+    return json.dumps([sorted(m.projparams.items()), m.llcrnrx, m.llcrnry, m.urcrnrx, m.urcrnry],
+                      default=str)
+
+def grid_key(lons, lats):
+    """digest of the lat/lon coordinates of a grid (1D axes or 2D)"""
+    sha = hashlib.sha1()
+    _array_digest(sha, lons)
+    _array_digest(sha, lats)
+    return sha.hexdigest()
+
+def _entry_name(prefix, *parts):
+    return prefix + '-' + hashlib.sha1(json.dumps(list(parts) + [CACHE_VERSION])).hexdigest()[:20]
+
+"""------------------------------------- Projected Grids ----------------------------------------"""
+
+def _project(m, lons, lats):
+    lons, lats = np.asarray(lons), np.asarray(lats)
+    if lons.ndim == 1:
+        lons, lats = np.meshgrid(lons, lats)
+    return m(lons, lats)
+
+def project_grid(m, lons, lats, cache_dir=None):
+    """
+    Map coordinates of a lat/lon grid, m(lons, lats) with a disk cache
+
+    Parameters
+    ----------
+    m : Basemap
+    lons, lats : array_like
+        1D axes (meshgrid is applied) or 2D coordinates
+    cache_dir : str
+        cache directory, MAP_CACHE_DIR/BATHY_CACHE_DIR if None
+
+    Returns
+    -------
+    Outputs : tuple (x, y)
+              2D arrays, read only memory maps when cached
+    """
+    cache_dir = _cache_dir(cache_dir)
+    if not cache_dir:
+        return _project(m, lons, lats)
+
+    cache_path = os.path.join(cache_dir, _entry_name('proj', projection_key(m), grid_key(lons, lats)))
+    try:
+        return (np.load(os.path.join(cache_path, 'x.npy'), mmap_mode='r'),
+                np.load(os.path.join(cache_path, 'y.npy'), mmap_mode='r'))
+    except (IOError, OSError, ValueError):
+        pass
+
+    x, y = _project(m, lons, lats)
+    with atomic_path(cache_path) as tmp_path:
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'x.npy'), np.asarray(x, dtype=np.float64))
+        np.save(os.path.join(tmp_path, 'y.npy'), np.asarray(y, dtype=np.float64))
+    return (np.load(os.path.join(cache_path, 'x.npy'), mmap_mode='r'),
+            np.load(os.path.join(cache_path, 'y.npy'), mmap_mode='r'))
+
+"""------------------------------------- Isobaths -----------------------------------------------"""
+
+def contour_segments(x, y, topoin, levels):
+    """
+    Line segments of topoin contoured at levels (x, y map coordinates)
+
+    Returns
+    -------
+    Outputs : list of (level, [ndarray (n, 2), ...])
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    levels = sorted(levels)
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    cs = ax.contour(x, y, topoin, levels=levels)
+    return [(level, [np.asarray(seg) for seg in segs]) for level, segs in zip(cs.levels, cs.allsegs)]
+
+def _read_segments(fname):
+    cached = load_npz(fname)
+    if cached is None:
+        return None
+    segments = []
+    for ind, level in enumerate(cached['levels']):
+        vertices, bounds = cached['vertices_%d' % ind], cached['bounds_%d' % ind]
+        segments.append((float(level), [vertices[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]))
+    return segments
+
+def _write_segments(fname, segments):
+    arrays = {'levels': np.array([level for level, segs in segments], dtype=np.float64)}
+    for ind, (level, segs) in enumerate(segments):
+        arrays['vertices_%d' % ind] = np.concatenate(segs) if segs else np.zeros((0, 2))
+        arrays['bounds_%d' % ind] = np.cumsum([0] + [len(seg) for seg in segs])
+    save_npz(fname, **arrays)
+
+def isobaths(m, lons, lats, topoin, levels, cache_dir=None):
+    """
+    Isobath line segments of a bathymetry grid on map m, cached by projection,
+    grid, topography and levels
+
+    Returns
+    -------
+    Outputs : list of (level, [ndarray (n, 2), ...]) in increasing level
+    """
+    x, y = project_grid(m, lons, lats, cache_dir=cache_dir)
+    cache_dir = _cache_dir(cache_dir)
+    if not cache_dir:
+        return contour_segments(x, y, topoin, levels)
+
+    sha = hashlib.sha1()
+    _array_digest(sha, topoin)
+    _array_digest(sha, np.ma.getmaskarray(topoin))
+    fname = os.path.join(cache_dir, _entry_name('isobaths', projection_key(m), grid_key(lons, lats),
+                                                 sha.hexdigest(), sorted(float(l) for l in levels)) + '.npz')
+    segments = _read_segments(fname)
+    if segments is None:
+        segments = contour_segments(x, y, topoin, levels)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        _write_segments(fname, segments)
+    return segments
+
+def level_colors(levels, cmap=None):
+    """
+    colors contour gives its lines when no colors are passed: cmap (the default
+    colormap if None) scaled from the lowest to the highest level
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import Normalize
+
+    norm = Normalize(min(levels), max(levels))
+    return [tuple(color) for color in plt.get_cmap(cmap)(norm(np.asarray(levels, dtype=float)))]
+
+def draw_isobaths(ax, segments, colors='black', cmap=None, **kwargs):
+    """
+    Add isobath segments (isobaths/contour_segments) to ax, one LineCollection
+    per level.  colors is one color or a list with one per level, with
+    colors=None each level is colored from cmap (level_colors).  kwargs are
+    passed to LineCollection (linewidths, linestyles, alpha...).  The axes
+    limits are left to the map.
+
+    Returns the list of LineCollections
+    """
+    from matplotlib.collections import LineCollection
+
+    if colors is None:
+        colors = level_colors([level for level, segs in segments], cmap)
+    elif isinstance(colors, basestring):
+        colors = [colors] * len(segments)
+    collections = []
+    for (level, segs), color in zip(segments, colors):
+        collection = LineCollection(segs, colors=color, **kwargs)
+        collection.set_label(str(level))
+        ax.add_collection(collection, autolim=False)
+        collections.append(collection)
+    return collections
+
+"""------------------------------------- Tests --------------------------------------------------"""
+# run with: python map_cache.py
+
+def test_segments_roundtrip():
+    """cached segments come back per level in order, empty levels included"""
+    import tempfile, shutil
+    segments = [(-200., [np.random.rand(5, 2), np.random.rand(3, 2)]), (-100., []),
+                (-50., [np.random.rand(7, 2)])]
+    work_dir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(work_dir, 'isobaths.npz')
+        _write_segments(fname, segments)
+        cached = _read_segments(fname)
+        assert [level for level, segs in cached] == [-200., -100., -50.]
+        for (level, segs), (cached_level, cached_segs) in zip(segments, cached):
+            assert len(segs) == len(cached_segs)
+            assert all((seg == cached_seg).all() for seg, cached_seg in zip(segs, cached_segs))
+    finally:
+        shutil.rmtree(work_dir)
+
+def main():
+    test_segments_roundtrip()
+    print "test_segments_roundtrip: ok"
+
+if __name__ == "__main__":
+    main()